@@ -0,0 +1,31 @@
+"""Add device_sessions for per-device uptime tracking
+
+Revision ID: 20251019_0004
+Revises: 20250119_0003
+Create Date: 2025-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0004'
+down_revision = '20250119_0003'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('device_sessions',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('device_id', sa.String(), nullable=False),
+        sa.Column('started_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('ended_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('online_before', sa.Float(), nullable=False, server_default=sa.text('0')),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE')
+    )
+    op.create_index('ix_device_sessions_device_started', 'device_sessions', ['device_id', 'started_at'], unique=True)
+
+def downgrade():
+    op.drop_index('ix_device_sessions_device_started', table_name='device_sessions')
+    op.drop_table('device_sessions')
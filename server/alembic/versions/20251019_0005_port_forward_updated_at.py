@@ -0,0 +1,22 @@
+"""Add port_forwards.updated_at for list versioning (ETags)
+
+Revision ID: 20251019_0005
+Revises: 20251019_0004
+Create Date: 2025-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0005'
+down_revision = '20251019_0004'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('port_forwards', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=True, server_default=sa.text('now()')))
+    op.execute("UPDATE port_forwards SET updated_at = created_at")
+
+def downgrade():
+    op.drop_column('port_forwards', 'updated_at')
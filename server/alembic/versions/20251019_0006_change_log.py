@@ -0,0 +1,44 @@
+"""Add change_log for delta sync cursors
+
+Revision ID: 20251019_0006
+Revises: 20251019_0005
+Create Date: 2025-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0006'
+down_revision = '20251019_0005'
+branch_labels = None
+depends_on = None
+
+# entity -> (table, id column); existing rows are logged once so a sync from cursor 0 sees everything
+BACKFILL = {
+    'users': ('users', 'id'),
+    'machines': ('machines', 'id'),
+    'keys': ('auth_keys', 'id'),
+    'port_forwards': ('port_forwards', 'id'),
+    'devices': ('devices', 'ts_device_id'),
+}
+
+def upgrade():
+    op.create_table(
+        'change_log',
+        sa.Column('seq', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('entity', sa.String(), nullable=False),
+        sa.Column('entity_id', sa.String(), nullable=False),
+        sa.Column('op', sa.String(), nullable=False),
+        sa.Column('changed_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()')),
+    )
+    op.create_index('ix_change_log_entity_seq', 'change_log', ['entity', 'seq'])
+    for entity, (table, id_column) in BACKFILL.items():
+        op.execute(
+            f"INSERT INTO change_log (entity, entity_id, op) "
+            f"SELECT '{entity}', {id_column}, 'upsert' FROM {table} WHERE {id_column} IS NOT NULL"
+        )
+
+def downgrade():
+    op.drop_index('ix_change_log_entity_seq', table_name='change_log')
+    op.drop_table('change_log')
@@ -0,0 +1,35 @@
+"""Add notification_outbox for durable Telegram/Discord delivery
+
+Revision ID: 20251019_0007
+Revises: 20251019_0006
+Create Date: 2025-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0007'
+down_revision = '20251019_0006'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'notification_outbox',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('channel', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('next_attempt_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()')),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()')),
+        sa.Column('sent_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    )
+    op.create_index('ix_notification_outbox_due', 'notification_outbox', ['channel', 'status', 'next_attempt_at'])
+
+def downgrade():
+    op.drop_index('ix_notification_outbox_due', table_name='notification_outbox')
+    op.drop_table('notification_outbox')
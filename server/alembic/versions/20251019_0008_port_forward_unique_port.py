@@ -0,0 +1,32 @@
+"""Unique active (protocol, source_port) on port_forwards
+
+Revision ID: 20251019_0008
+Revises: 20251019_0007
+Create Date: 2025-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0008'
+down_revision = '20251019_0007'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Keep the oldest active rule of any port that is claimed twice, deactivate the others
+    op.execute("""
+        UPDATE port_forwards SET active = false
+        WHERE active AND id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY protocol, source_port ORDER BY created_at, id) AS n
+                FROM port_forwards WHERE active
+            ) ranked WHERE n > 1
+        )
+    """)
+    op.create_index('uq_port_forwards_active_port', 'port_forwards', ['protocol', 'source_port'],
+                    unique=True, postgresql_where=sa.text('active'))
+
+def downgrade():
+    op.drop_index('uq_port_forwards_active_port', table_name='port_forwards')
@@ -0,0 +1,50 @@
+"""Persist bulk deployments and their per-device targets
+
+Revision ID: 20251019_0009
+Revises: 20251019_0008
+Create Date: 2025-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0009'
+down_revision = '20251019_0008'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'deployments',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('status', sa.String(), nullable=False, server_default='started'),
+        sa.Column('config', sa.Text(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('queued', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('running', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('succeeded', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('started_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()')),
+        sa.Column('completed_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    )
+    op.create_table(
+        'deployment_targets',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('deployment_id', sa.String(), sa.ForeignKey('deployments.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('hostname', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default='queued'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('lease_until', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('started_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('completed_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    )
+    op.create_index('ix_deployment_targets_deployment_host', 'deployment_targets', ['deployment_id', 'hostname'], unique=True)
+    op.create_index('ix_deployment_targets_claim', 'deployment_targets', ['status', 'id'])
+
+def downgrade():
+    op.drop_index('ix_deployment_targets_claim', table_name='deployment_targets')
+    op.drop_index('ix_deployment_targets_deployment_host', table_name='deployment_targets')
+    op.drop_table('deployment_targets')
+    op.drop_table('deployments')
@@ -0,0 +1,28 @@
+"""Add numbered deployment progress events for resumable streams
+
+Revision ID: 20251019_0010
+Revises: 20251019_0009
+Create Date: 2025-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0010'
+down_revision = '20251019_0009'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('deployments', sa.Column('seq', sa.BigInteger(), nullable=False, server_default='0'))
+    op.create_table(
+        'deployment_events',
+        sa.Column('deployment_id', sa.String(), sa.ForeignKey('deployments.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('seq', sa.BigInteger(), primary_key=True),
+        sa.Column('data', sa.Text(), nullable=False),
+    )
+
+def downgrade():
+    op.drop_table('deployment_events')
+    op.drop_column('deployments', 'seq')
@@ -0,0 +1,21 @@
+"""Record the agent artifact a build resolved to
+
+Revision ID: 20251019_0011
+Revises: 20251019_0010
+Create Date: 2025-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '20251019_0011'
+down_revision = '20251019_0010'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('deployment_logs', sa.Column('artifact', sa.String(), nullable=True))
+
+def downgrade():
+    op.drop_column('deployment_logs', 'artifact')
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from typing import Dict, List
 from ..db import get_db
 from ..models import User, Device, AuthKey, AuditLog
+from ..services.uptime import fleet_uptime
 
 router = APIRouter()
 
@@ -31,7 +32,8 @@ async def get_analytics_overview(db: Session = Depends(get_db)):
     ).count()
     
     # System health
-    uptime_avg = 98.5  # Calculate from device uptime data
+    now = datetime.utcnow()
+    uptime_avg = fleet_uptime(db, now - timedelta(hours=24), now)["uptime"]
     
     return {
         "totalUsers": total_users,
@@ -72,6 +74,10 @@ async def get_device_performance(db: Session = Depends(get_db)):
     devices = db.query(Device).all()
     performance_data = []
     
+    # Exact 24h uptime per device from recorded online sessions
+    now = datetime.utcnow()
+    uptime = fleet_uptime(db, now - timedelta(hours=24), now)["devices"]
+    
     for device in devices:
         # This would normally come from agent telemetry
         performance_data.append({
@@ -80,7 +86,7 @@ async def get_device_performance(db: Session = Depends(get_db)):
             "ip": device.ip,
             "status": device.status,
             "ping": 45 if device.status == 'online' else None,
-            "uptime": 99.2 if device.status == 'online' else 0,
+            "uptime": uptime.get(device.id, {}).get("uptime", 0),
             "lastUpdate": device.last_seen.isoformat() if device.last_seen else None
         })
     
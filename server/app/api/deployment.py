@@ -1,112 +1,108 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from typing import Dict, List
-import subprocess
 import os
-import tempfile
 from datetime import datetime
 from ..db import get_db
 from ..models import DeploymentLog, AuthKey
-from ..utils.agent_builder import build_windows_agent
-from ..websockets import notification_manager
+from ..services.agent_builds import agent_build_queue, artifact_path
+from ..services.artifacts import artifact_response, sha256_of
+from ..utils.http_cache import IMMUTABLE, NO_CACHE
+
+AGENT_FILENAME = "tailscale-agent.exe"
 
 router = APIRouter()
 
 @router.post("/build-agent")
 async def build_agent(
     config: Dict,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
-    """Build Windows agent with configuration"""
+    """Build Windows agent with configuration (instant when an identical build exists or the base can be stamped)"""
+    
+    # Get active auth key for agent
+    auth_key = db.query(AuthKey).filter(
+        AuthKey.active == True,
+        AuthKey.expires_at > datetime.utcnow()
+    ).first()
+    
+    if not auth_key:
+        raise HTTPException(status_code=400, detail="No active auth key found")
+    
+    # Build configuration
+    agent_config = {
+        "auth_key_url": config.get("auth_key_url", "http://100.96.11.97:9090/authkey.txt"),
+        "fallback_url": config.get("fallback_url", "https://auth.csonline-sri.work/authkey.txt"),
+        "security_token": config.get("security_token", ""),
+        "auto_start": config.get("auto_start", True),
+        "auto_repair": config.get("auto_repair", True),
+        "log_path": "C:\\ATT Tail Scale\\Logs\\tailscalelogs.log"
+    }
     
-    try:
-        # Get active auth key for agent
-        auth_key = db.query(AuthKey).filter(
-            AuthKey.status == 'active',
-            AuthKey.expires_at > datetime.utcnow()
-        ).first()
-        
-        if not auth_key:
-            raise HTTPException(status_code=400, detail="No active auth key found")
-        
-        # Build configuration
-        agent_config = {
-            "auth_key_url": config.get("auth_key_url", "http://100.96.11.97:9090/authkey.txt"),
-            "fallback_url": config.get("fallback_url", "https://auth.csonline-sri.work/authkey.txt"),
-            "security_token": config.get("security_token", ""),
-            "auto_start": config.get("auto_start", True),
-            "auto_repair": config.get("auto_repair", True),
-            "log_path": "C:\\ATT Tail Scale\\Logs\\tailscalelogs.log"
-        }
-        
-        # Build agent in background
-        background_tasks.add_task(build_agent_background, agent_config, db)
-        
-        return {"status": "building", "message": "Agent build started"}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # The deployment log row is the build id
+    build = DeploymentLog(action="build_agent", status="building", details="Agent build queued")
+    db.add(build)
+    db.flush()
+    
+    key, done = await agent_build_queue.submit(build.id, agent_config)
+    if done:
+        build.status = "completed"
+        build.details = f"Agent built successfully: {key}"
+        build.artifact = key
+    db.commit()
+    
+    return {
+        "status": build.status,
+        "build_id": build.id,
+        "artifact": key if done else None,
+        "download_url": f"/api/deployment/artifacts/{key}" if done else None,
+        "message": "Agent build completed" if done else "Agent build started"
+    }
 
-async def build_agent_background(config: Dict, db: Session):
-    """Background task to build agent"""
-    try:
-        # Create deployment log
-        log = DeploymentLog(
-            action="build_agent",
-            status="building",
-            details=f"Building agent with config: {config}",
-            created_at=datetime.utcnow()
-        )
-        db.add(log)
-        db.commit()
-        
-        # Build the agent (this would call PyInstaller)
-        agent_path = await build_windows_agent(config)
-        
-        # Update log
-        log.status = "completed"
-        log.details = f"Agent built successfully: {agent_path}"
-        db.commit()
-        
-        # Broadcast update
-        await notification_manager.broadcast({
-            "type": "deployment_update",
-            "data": {
-                "action": "build_agent",
-                "status": "completed",
-                "message": "Agent build completed successfully"
-            }
-        })
-        
-    except Exception as e:
-        log.status = "failed"
-        log.details = f"Build failed: {str(e)}"
-        db.commit()
-        
-        await notification_manager.broadcast({
-            "type": "deployment_update",
-            "data": {
-                "action": "build_agent",
-                "status": "failed",
-                "message": f"Agent build failed: {str(e)}"
-            }
-        })
+@router.get("/builds/{build_id}")
+async def get_build(build_id: str, db: Session = Depends(get_db)):
+    """Status of one agent build, with its content hash and download URL once completed"""
+    build = db.get(DeploymentLog, build_id)
+    if not build or build.action != "build_agent":
+        raise HTTPException(status_code=404, detail="Build not found")
+    result = build.to_dict()
+    if build.artifact and os.path.exists(artifact_path(build.artifact)):
+        result["sha256"] = await asyncio.to_thread(sha256_of, artifact_path(build.artifact))
+        result["download_url"] = f"/api/deployment/artifacts/{build.artifact}"
+    return result
 
-@router.get("/download-agent")
-async def download_agent():
-    """Download the latest built agent"""
-    agent_path = "/tmp/tailscale-agent.exe"
+def _completed_artifact(db: Session, build_id: str | None = None) -> str:
+    query = db.query(DeploymentLog).filter(
+        DeploymentLog.action == "build_agent",
+        DeploymentLog.status == "completed",
+        DeploymentLog.artifact.isnot(None)
+    )
+    if build_id:
+        query = query.filter(DeploymentLog.id == build_id)
+    build = query.order_by(DeploymentLog.created_at.desc()).first()
     
-    if not os.path.exists(agent_path):
+    if not build or not os.path.exists(artifact_path(build.artifact)):
         raise HTTPException(status_code=404, detail="Agent not found. Please build first.")
-    
-    return FileResponse(
-        agent_path,
-        media_type="application/octet-stream",
-        filename="tailscale-agent.exe"
-    )
+    return artifact_path(build.artifact)
+
+@router.api_route("/download-agent", methods=["GET", "HEAD"])
+async def download_agent(request: Request, build_id: str | None = None, db: Session = Depends(get_db)):
+    """Download a built agent (the latest completed build unless `build_id` is given).
+    Revalidated on every use since "latest" moves; prefer /artifacts/{key} for mass rollouts."""
+    path = _completed_artifact(db, build_id)
+    return await artifact_response(request, path, AGENT_FILENAME, IMMUTABLE if build_id else NO_CACHE)
+
+@router.api_route("/artifacts/{key}", methods=["GET", "HEAD"])
+async def download_artifact(key: str, request: Request):
+    """Download an agent by build key (content address): cacheable by browsers and proxies forever,
+    resumable with Range, br/gzip variants when accepted"""
+    if len(key) != 64 or any(c not in "0123456789abcdef" for c in key):
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    path = artifact_path(key)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return await artifact_response(request, path, AGENT_FILENAME, IMMUTABLE)
 
 @router.get("/deployment-history")
 async def get_deployment_history(db: Session = Depends(get_db)):
@@ -16,12 +16,75 @@ class Settings(BaseSettings):
     ROTATE_WARN_DAYS: int = 7
     ROTATE_CHECK_INTERVAL_MIN: int = 15
 
+    DEVICE_SYNC_INTERVAL_SEC: int = 60
+    DEVICE_ONLINE_WINDOW_SEC: int = 300
+
+    ANALYTICS_SNAPSHOT_TTL_SEC: int = 10
+
+    PORT_FORWARD_BACKEND: str = "iptables"  # iptables | nftables | userspace
+    PORT_FORWARD_CHAIN_PREFIX: str = "TSM"  # iptables: <prefix>-PREROUTING / <prefix>-FORWARD; nftables: table ip <prefix lowercased>
+    PORT_FORWARD_RECONCILE_INTERVAL_SEC: int = 300
+
+    # userspace backend (in-process relay)
+    RELAY_LISTEN_HOST: str = "0.0.0.0"
+    RELAY_BUFFER_SIZE: int = 256 * 1024
+    RELAY_MAX_CONNECTIONS_PER_RULE: int = 1024
+    RELAY_CONNECT_TIMEOUT_SEC: float = 10.0
+    RELAY_UDP_IDLE_SEC: int = 60
+
+    TRAFFIC_SAMPLE_INTERVAL_SEC: int = 10
+    TRAFFIC_HISTORY_POINTS: int = 360   # per rule (1h at the default interval)
+
+    PROBE_INTERVAL_SEC: int = 60
+    PROBE_JITTER: float = 0.2           # +/- fraction of the interval
+    PROBE_CONCURRENCY: int = 200
+    PROBE_TIMEOUT_SEC: float = 3.0
+    PROBE_WINDOW: int = 100             # latency samples kept per target
+    PROBE_REFRESH_SEC: int = 30         # how often the active rule list is reloaded
+
+    COMPRESSION_MIN_SIZE: int = 1024
+
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT_SEC: float = 10.0
+    WS_EVICT_AFTER_DROPS: int = 256
+
+    EVENT_BUS_BACKEND: str = "memory"  # memory | redis
+    REDIS_URL: str = "redis://localhost:6379/0"
+    EVENT_BUS_CHANNEL: str = "tsm:events"
+    EVENT_BUS_BATCH_MS: int = 20
+    EVENT_BUS_BATCH_MAX: int = 200
+    EVENT_BUS_COMPRESS_MIN: int = 1024
+
     ENCRYPTION_KEY: str
 
     TELEGRAM_BOT_TOKEN: str | None = None
     TELEGRAM_CHAT_ID: str | None = None
     DISCORD_WEBHOOK_URL: str | None = None
 
+    NOTIFY_POLL_SEC: float = 5.0
+    NOTIFY_BATCH_MAX: int = 500
+    NOTIFY_DIGEST_MIN: int = 5          # this many queued messages of one kind are sent as one digest
+    NOTIFY_DIGEST_SAMPLE: int = 10      # lines quoted in a digest
+    NOTIFY_TELEGRAM_PER_MIN: int = 20
+    NOTIFY_DISCORD_PER_MIN: int = 30
+    NOTIFY_MAX_ATTEMPTS: int = 8
+    NOTIFY_RETRY_BASE_SEC: int = 10
+    NOTIFY_RETRY_MAX_SEC: int = 3600
+
+    DEPLOY_WORKERS: int = 32             # devices deployed concurrently per API worker
+    DEPLOY_DEVICE_TIMEOUT_SEC: int = 600
+    DEPLOY_LEASE_GRACE_SEC: int = 60     # a claimed device is retried this long after its timeout (worker died)
+    DEPLOY_MAX_ATTEMPTS: int = 3
+    DEPLOY_POLL_SEC: float = 5.0
+    DEPLOY_OUTPUT_FLUSH_SEC: float = 1.0  # device output lines are written/streamed in batches this often
+
+    AGENT_BUILD_DIR: str = "data/agent-builds"  # content-addressed agent executables
+    AGENT_BUILD_WORKERS: int = 0                # concurrent PyInstaller runs; 0 = one per CPU core
+    AGENT_CONFIG_STAMPING: bool = True          # one base build per template, configs appended (utils/agent_stamp.py)
+    AGENT_STAMP_KEY: str | None = None          # hex HMAC key for stamped configs; derived from ENCRYPTION_KEY if unset
+    ARTIFACT_BROTLI_QUALITY: int = 9            # precompressed .br variant (written once per artifact)
+    ARTIFACT_MIN_SAVING: float = 0.05           # drop a variant that saves less than this fraction
+
     class Config:
         env_file = ".env"
 
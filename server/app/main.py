@@ -1,16 +1,35 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from brotli_asgi import BrotliMiddleware
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from sqlalchemy.orm import Session
 from .config import settings
 from .db import SessionLocal
-from .routers import devices, users, authkeys, portforwards, analytics, deployment, alerts
+from .routers import devices, users, authkeys, portforwards, analytics, deployment, alerts, events, live
+from .api import deployment as agent_builds_api
 from .services.rotate import rotate_if_necessary
+from .services.device_sync import sync_devices
+from .services.portforward import PortForwardManager, reconcile_port_forwards
+from .services.ports import port_index
+from .services.traffic import traffic_collector
+from .services.probe import probe_scheduler
+from .services.eventbus import event_bus
+from .services.notify import notification_dispatcher
+from .services.deployments import deployment_workers
+from .services.agent_builds import agent_build_queue
+from .services import entity_events  # noqa: F401  (registers the entity delta session hooks)
+from .utils.logging import get_logger
 from .websockets import notification_manager, websocket_endpoint
 import json
 from datetime import datetime, timezone
 
-app = FastAPI(title="ATT Tailscale Manager API")
+log = get_logger(__name__)
+
+app = FastAPI(title="ATT Tailscale Manager API", default_response_class=ORJSONResponse)
+
+# Brotli for clients that accept it, gzip otherwise; small bodies are not worth the CPU
+app.add_middleware(BrotliMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE, gzip_fallback=True)
 
 # Add CORS middleware  
 app.add_middleware(
@@ -35,7 +54,10 @@ app.include_router(authkeys.router, prefix="/api/keys", tags=["authkeys"])
 app.include_router(portforwards.router, prefix="/api/port-forwards", tags=["port-forwards"])
 app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
 app.include_router(deployment.router, prefix="/api/deployment", tags=["deployment"])
+app.include_router(agent_builds_api.router, prefix="/api/deployment", tags=["agent-builds"])
 app.include_router(alerts.router, prefix="/api/alerts", tags=["alerts"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
+app.include_router(live.router, prefix="/api/live", tags=["live"])
 
 
 scheduler = AsyncIOScheduler()
@@ -54,18 +76,79 @@ def _rotate_job():
     finally:
         db.close()
 
+async def _device_sync_job():
+    db: Session = SessionLocal()
+    try:
+        await sync_devices(db)
+    except Exception as e:
+        log.exception(f"Device sync failed: {e}")
+    finally:
+        db.close()
+
+async def _port_forward_reconcile_job():
+    db: Session = SessionLocal()
+    try:
+        await reconcile_port_forwards(db)
+        port_index.reload(db)  # pick up ports claimed or freed by other workers
+    except Exception as e:
+        log.exception(f"Port forward reconcile failed: {e}")
+    finally:
+        db.close()
+
+async def _traffic_sample_job():
+    db: Session = SessionLocal()
+    try:
+        await traffic_collector.sample(db)
+    except Exception as e:
+        log.exception(f"Traffic sampling failed: {e}")
+    finally:
+        db.close()
+
 @app.on_event("startup")
 async def startup():
+    # real-time fan-out across workers
+    await event_bus.start(notification_manager)
+    # Telegram/Discord outbox delivery
+    await notification_dispatcher.start()
+    # port-forward target reachability
+    await probe_scheduler.start()
+    # bulk deployment queue (resumes work left by a previous run)
+    await deployment_workers.start()
+    # Windows agent builds
+    await agent_build_queue.start()
     # cron kiểm tra xoay vòng
     scheduler.add_job(_rotate_job, "interval", minutes=settings.ROTATE_CHECK_INTERVAL_MIN, id="rotate")
+    # device mirror + online/offline sessions (first run right away)
+    scheduler.add_job(_device_sync_job, "interval", seconds=settings.DEVICE_SYNC_INTERVAL_SEC, id="device_sync",
+                      next_run_time=datetime.now(timezone.utc), max_instances=1, coalesce=True)
+    # restore/repair kernel port-forward rules (after restarts, manual edits)
+    scheduler.add_job(_port_forward_reconcile_job, "interval", seconds=settings.PORT_FORWARD_RECONCILE_INTERVAL_SEC,
+                      id="port_forward_reconcile", next_run_time=datetime.now(timezone.utc), max_instances=1, coalesce=True)
+    # per-rule traffic counters -> rates
+    scheduler.add_job(_traffic_sample_job, "interval", seconds=settings.TRAFFIC_SAMPLE_INTERVAL_SEC,
+                      id="traffic_sample", max_instances=1, coalesce=True)
     scheduler.start()
 
+@app.on_event("shutdown")
+async def shutdown():
+    await agent_build_queue.stop()
+    await deployment_workers.stop()
+    await probe_scheduler.stop()
+    await notification_dispatcher.stop()
+    await PortForwardManager.backend.close()
+    await event_bus.stop()
+
 # WebSocket endpoint - using notification_manager from websockets module
 @app.websocket("/ws")
 async def websocket_endpoint_handler(websocket: WebSocket):
     print(f"WebSocket connection attempt from: {websocket.client}")
     await websocket_endpoint(websocket)
 
+@app.get("/api/ws/stats")
+async def websocket_stats():
+    """Connection count, queue depth and send latency of the WebSocket fan-out"""
+    return {**notification_manager.stats(), "bus": event_bus.stats()}
+
 @app.get("/healthz")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
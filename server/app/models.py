@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Boolean, Integer, ForeignKey, TIMESTAMP, text, Text
+from sqlalchemy import String, Boolean, Integer, BigInteger, Float, ForeignKey, TIMESTAMP, Index, func, text, Text
 from uuid import uuid4
 from .db import Base
 
@@ -123,10 +123,17 @@ class PortForward(Base):
     active: Mapped[bool] = mapped_column(Boolean, default=True)
     description: Mapped[str | None] = mapped_column(String, nullable=True)
     created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
+    updated_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"), onupdate=func.now())
     
     user: Mapped[User] = relationship(back_populates="port_forwards")
     machine: Mapped["Machine"] = relationship(back_populates="port_forwards")
 
+    __table_args__ = (
+        # One active rule per listening port (backstop for the in-memory index, services/ports.py)
+        Index("uq_port_forwards_active_port", "protocol", "source_port", unique=True,
+              postgresql_where=text("active"), sqlite_where=text("active")),
+    )
+
     def __repr__(self):
         return f"<PortForward(id='{self.id}', name='{self.name}', {self.source_port}->{self.target_host}:{self.target_port})"
 
@@ -142,7 +149,8 @@ class PortForward(Base):
             "protocol": self.protocol,
             "active": self.active,
             "description": self.description,
-            "created_at": self.created_at.isoformat() if self.created_at else None
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
 
 class Event(Base):
@@ -182,6 +190,53 @@ class Device(Base):
     created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
     updated_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
 
+class DeviceSession(Base):
+    """One contiguous online interval of a mirrored device (run-length encoded status)"""
+    __tablename__ = "device_sessions"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    device_id: Mapped[str] = mapped_column(String, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False)
+    started_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    ended_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)  # NULL while still online
+    online_before: Mapped[float] = mapped_column(Float, nullable=False, default=0)      # cumulative online seconds before started_at
+
+    __table_args__ = (
+        Index("ix_device_sessions_device_started", "device_id", "started_at", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<DeviceSession(device_id='{self.device_id}', started_at='{self.started_at}', ended_at='{self.ended_at}')"
+
+class ChangeLog(Base):
+    """One row per write to a synced entity; `seq` is the delta-sync cursor (see services/changelog.py)"""
+    __tablename__ = "change_log"
+    seq: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    entity: Mapped[str] = mapped_column(String, nullable=False)      # keys, machines, port_forwards, users, devices
+    entity_id: Mapped[str] = mapped_column(String, nullable=False)
+    op: Mapped[str] = mapped_column(String, nullable=False)          # upsert | delete
+    changed_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
+
+    __table_args__ = (
+        Index("ix_change_log_entity_seq", "entity", "seq"),
+    )
+
+class Notification(Base):
+    """Outbox of chat notifications; delivered (batched, rate limited, retried) by services/notify.py"""
+    __tablename__ = "notification_outbox"
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    channel: Mapped[str] = mapped_column(String, nullable=False)     # telegram | discord
+    kind: Mapped[str] = mapped_column(String, nullable=False)        # key_created, key_rotated, ... (digest grouping)
+    message: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="pending")  # pending, sent, failed
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
+    sent_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_notification_outbox_due", "channel", "status", "next_attempt_at"),
+    )
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
     id: Mapped[str] = mapped_column(String, primary_key=True, default=pk)
@@ -199,8 +254,83 @@ class DeploymentLog(Base):
     action: Mapped[str] = mapped_column(String, nullable=False)
     status: Mapped[str] = mapped_column(String, nullable=False)  # building, completed, failed
     details: Mapped[str | None] = mapped_column(Text, nullable=True)
+    artifact: Mapped[str | None] = mapped_column(String, nullable=True)  # build key of the agent executable (services/agent_builds.py)
     created_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "action": self.action,
+            "status": self.status,
+            "details": self.details,
+            "artifact": self.artifact,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
+class Deployment(Base):
+    """A bulk agent rollout; the counters are kept up to date by the workers (services/deployments.py)"""
+    __tablename__ = "deployments"
+    id: Mapped[str] = mapped_column(String, primary_key=True, default=pk)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="started")  # started, completed
+    config: Mapped[str] = mapped_column(Text, nullable=False)  # JSON text (DeploymentConfig)
+    total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    queued: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    running: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    succeeded: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    failed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    seq: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)  # last progress event (deployment_events)
+    started_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
+    completed_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "seq": self.seq,
+            "total": self.total,
+            "queued": self.queued,
+            "running": self.running,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class DeploymentTarget(Base):
+    """One device of a deployment; claimed by a worker under a lease so a crashed worker's devices are retried"""
+    __tablename__ = "deployment_targets"
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    deployment_id: Mapped[str] = mapped_column(String, ForeignKey("deployments.id", ondelete="CASCADE"), nullable=False)
+    hostname: Mapped[str] = mapped_column(String, nullable=False)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="queued")  # queued, running, success, failed
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    message: Mapped[str | None] = mapped_column(Text, nullable=True)
+    lease_until: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    started_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    completed_at: Mapped[str | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_deployment_targets_deployment_host", "deployment_id", "hostname", unique=True),
+        Index("ix_deployment_targets_claim", "status", "id"),
+    )
+
+    def to_dict(self):
+        return {
+            "device": self.hostname,
+            "status": self.status,
+            "attempts": self.attempts,
+            "message": self.message,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class DeploymentEvent(Base):
+    """Progress event of a deployment, numbered per deployment so streams can resume from a seq"""
+    __tablename__ = "deployment_events"
+    deployment_id: Mapped[str] = mapped_column(String, ForeignKey("deployments.id", ondelete="CASCADE"), primary_key=True)
+    seq: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    data: Mapped[str] = mapped_column(Text, nullable=False)  # JSON text, sent to clients as is
+
 class SystemMetrics(Base):
     __tablename__ = "system_metrics"
     id: Mapped[str] = mapped_column(String, primary_key=True, default=pk)
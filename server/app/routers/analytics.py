@@ -1,220 +1,232 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
+from sqlalchemy import select, func, or_, literal, union_all
+from typing import Optional
+from collections import Counter
+from ..config import settings
 from ..db import get_db
-from ..models import User, AuthKey, Machine
-from ..tailscale import list_devices, get_tailnet_info, health_check
+from ..models import User, AuthKey, Machine, Device
+from ..tailscale import list_devices, get_tailnet_info
+from ..services.uptime import fleet_uptime, device_uptime
+from ..utils.http_cache import conditional, etag_for
+from ..utils.responses import fast_json
 from datetime import datetime, timedelta, timezone
+import asyncio
 import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-@router.get("/")
-async def get_analytics_root(db: Session = Depends(get_db)):
-    """Get analytics root data"""
-    return await _get_analytics_data(db)
+SERVER_TAGS = ["tag:server", "tag:production", "tag:backend", "tag:prod"]
+SERVER_WORDS = ["server", "prod", "backend", "api", "ipg", "hfserver", "tesla", "db", "mysql", "redis", "nginx", "docker", "k8s", "kubernetes"]
+MOBILE_TAGS = ["tag:mobile", "tag:phone", "tag:tablet", "tag:ios", "tag:android"]
+MOBILE_WORDS = ["phone", "mobile", "android", "ios", "tablet", "iphone", "ipad", "samsung", "xiaomi", "huawei", "oneplus", "pixel", "galaxy"]
+IOT_TAGS = ["tag:iot", "tag:sensor", "tag:camera", "tag:smart", "tag:thermostat"]
+IOT_WORDS = ["sensor", "camera", "thermostat", "smart", "nest", "ring", "philips", "hue", "bulb", "switch", "plug", "doorbell", "security", "motion", "temperature", "humidity"]
 
-async def _get_analytics_data(db: Session):
-    """Common analytics data helper with enhanced Tailscale integration"""
+# Panels served by /dashboard, in the order the Analytics page renders them
+PANELS = (
+    "overview", "device-metrics", "network-performance", "geographic-distribution",
+    "security-events", "connection-trends", "device-distribution", "usage-analytics", "real-time",
+)
+
+def _classify_device(device: dict) -> tuple[str, str]:
+    """Classify a Tailscale device as desktop/mobile/server/iot, returning (type, reason)"""
+    hostname = (device.get("hostname") or "").lower()
+    tags = device.get("tags") or []
+    for device_type, type_tags, words in (("server", SERVER_TAGS, SERVER_WORDS),
+                                          ("mobile", MOBILE_TAGS, MOBILE_WORDS),
+                                          ("iot", IOT_TAGS, IOT_WORDS)):
+        matched = [tag for tag in tags if tag in type_tags]
+        if matched:
+            return device_type, f"tag-based: {matched}"
+        if any(word in hostname for word in words):
+            return device_type, f"hostname-based: {device.get('hostname', '')}"
+    # Default to desktop for Windows machines and general workstations
+    return "desktop", "default classification"
+
+def _region(device: dict) -> str:
+    hostname = (device.get("hostname") or "").lower()
+    tags = device.get("tags") or []
+    if any(tag in ["tag:us", "tag:america", "tag:na"] for tag in tags) or any(word in hostname for word in ["us-", "nyc", "la", "sf", "chicago"]):
+        return "US"
+    if any(tag in ["tag:eu", "tag:europe", "tag:uk", "tag:de"] for tag in tags) or any(word in hostname for word in ["eu-", "london", "berlin", "paris", "amsterdam"]):
+        return "EU"
+    if any(tag in ["tag:asia", "tag:japan", "tag:singapore"] for tag in tags) or any(word in hostname for word in ["asia-", "tokyo", "singapore", "seoul", "beijing"]):
+        return "Asia"
+    return "Other"
+
+def _last_seen(device: dict) -> Optional[datetime]:
+    last_seen_str = device.get("lastSeen", "")
+    if not last_seen_str:
+        return None
+    try:
+        return datetime.fromisoformat(last_seen_str.replace('Z', '+00:00'))
+    except ValueError as e:
+        logger.warning(f"Error processing device lastSeen: {e}")
+        return None
+
+def _distribution(counts: dict) -> dict:
+    total = sum(counts.values())
+    return {
+        name: {"count": count, "percentage": round((count / total) * 100, 1) if total else 0}
+        for name, count in counts.items()
+    }
+
+async def _fetch_devices() -> dict:
+    """Single timed Tailscale device fetch shared by every panel (also serves as the health probe)"""
+    started = time.time()
     try:
-        # Get device data from Tailscale
         device_data = await list_devices()
-        devices = device_data.get("devices", [])
-        
-        # Enhanced device analysis with REAL data
-        now = datetime.now(timezone.utc)
-        one_hour_ago = now - timedelta(hours=1)
-        
-        online_devices = 0
-        device_types = {"desktop": 0, "mobile": 0, "server": 0, "iot": 0}
-        connection_trends = []
-        
-        # Analyze REAL device data from Tailscale
-        for device in devices:
-            try:
-                last_seen_str = device.get("lastSeen", "")
-                if last_seen_str:
-                    last_seen = datetime.fromisoformat(last_seen_str.replace('Z', '+00:00'))
-                    if last_seen > one_hour_ago:
-                        online_devices += 1
-                
-                # Analyze device type based on REAL hostname and tags
-                hostname = device.get("hostname", "").lower()
-                tags = device.get("tags", [])
-                
-                # Enhanced classification based on REAL data patterns
-                if any(tag in ["tag:server", "tag:production", "tag:backend", "tag:prod"] for tag in tags) or any(word in hostname for word in ["server", "prod", "backend", "api", "ipg", "hfserver", "tesla", "db", "mysql", "redis", "nginx", "docker", "k8s", "kubernetes"]):
-                    device_types["server"] += 1
-                elif any(tag in ["tag:mobile", "tag:phone", "tag:tablet", "tag:ios", "tag:android"] for tag in tags) or any(word in hostname for word in ["phone", "mobile", "android", "ios", "tablet", "iphone", "ipad", "samsung", "xiaomi", "huawei", "oneplus", "pixel", "galaxy"]):
-                    device_types["mobile"] += 1
-                elif any(tag in ["tag:iot", "tag:sensor", "tag:camera", "tag:smart", "tag:thermostat"] for tag in tags) or any(word in hostname for word in ["sensor", "camera", "thermostat", "smart", "nest", "ring", "philips", "hue", "bulb", "switch", "plug", "doorbell", "security", "motion", "temperature", "humidity"]):
-                    device_types["iot"] += 1
-                else:
-                    # Default to desktop for Windows machines and general workstations
-                    device_types["desktop"] += 1
-                    
-            except Exception as e:
-                logger.warning(f"Error processing device {device.get('id', 'unknown')}: {e}")
-                continue
-        
-        # User statistics from database
-        total_users = db.query(User).count()
-        active_users = db.query(User).filter(User.is_active == True).count()
-        
-        # Auth key statistics from database - count REAL active keys
-        # A key is active if: not revoked, not expired, and has valid expiry
-        now_utc = datetime.now(timezone.utc)
-        active_keys = 0
-        total_keys = db.query(AuthKey).count()
-        
-        all_keys = db.query(AuthKey).all()
-        for key in all_keys:
-            try:
-                # Check if key is revoked
-                if key.revoked:
-                    continue
-                
-                # Check if key is expired
-                if key.expires_at:
-                    expires_at = key.expires_at
-                    if isinstance(expires_at, str):
-                        expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-                    elif expires_at and hasattr(expires_at, 'tzinfo') and expires_at.tzinfo is None:
-                        expires_at = expires_at.replace(tzinfo=timezone.utc)
-                    
-                    if expires_at and expires_at < now_utc:
-                        continue
-                
-                # If we reach here, key is active
-                active_keys += 1
-                
-            except Exception as e:
-                logger.warning(f"Error processing key {key.id}: {e}")
-                continue
-        
-        # Machine statistics from database
-        total_machines = db.query(Machine).count()
-        machines_with_devices = db.query(Machine).filter(Machine.ts_device_id.isnot(None)).count()
-        
-        # Calculate REAL uptime based on online devices and recent activity
-        # Consider devices as "online" if they've been seen in the last 24 hours
-        one_day_ago = now - timedelta(hours=24)
-        online_devices_24h = 0
-        
-        for device in devices:
-            try:
-                last_seen_str = device.get("lastSeen", "")
-                if last_seen_str:
-                    last_seen = datetime.fromisoformat(last_seen_str.replace('Z', '+00:00'))
-                    if last_seen > one_day_ago:
-                        online_devices_24h += 1
-            except Exception as e:
-                logger.warning(f"Error processing device lastSeen: {e}")
-                continue
-        
-        # Calculate uptime as percentage of devices active in last 24h
-        uptime = (online_devices_24h / len(devices) * 100) if devices else 0
-        
-        # Ensure uptime is reasonable (not too low due to timezone issues)
-        if uptime < 20 and len(devices) > 0:
-            # Fallback: use devices seen in last week
-            one_week_ago = now - timedelta(days=7)
-            weekly_active = 0
-            for device in devices:
-                try:
-                    last_seen_str = device.get("lastSeen", "")
-                    if last_seen_str:
-                        last_seen = datetime.fromisoformat(last_seen_str.replace('Z', '+00:00'))
-                        if last_seen > one_week_ago:
-                            weekly_active += 1
-                except Exception:
-                    continue
-            
-            uptime = max(uptime, (weekly_active / len(devices) * 100))
-        
-        # Ensure uptime is between 0 and 100
-        uptime = max(0, min(100, uptime))
-        
-        # Get Tailscale health info
-        try:
-            ts_health = await health_check()
-            tailnet_status = ts_health.get("status", "unknown")
-            api_response_time = ts_health.get("api_response_time", 0)
-        except Exception as e:
-            logger.warning(f"Failed to get Tailscale health: {e}")
-            tailnet_status = "unknown"
-            api_response_time = 0
-        
-        # Calculate REAL data transfer based on active devices
-        # Estimate: each active device uses ~5-10 GB per day
-        estimated_daily_usage = online_devices * 7.5  # GB per device per day
-        data_transfer_gb = estimated_daily_usage
-        
-        # Calculate security events count for alerts
-        now_24h_ago = now - timedelta(hours=24)
-        recent_keys = db.query(AuthKey).filter(
-            AuthKey.created_at >= now_24h_ago
-        ).count()
-        recent_users = db.query(User).filter(
-            User.last_login >= now_24h_ago
-        ).count()
-        alerts_today = max(0, recent_keys + recent_users - 2)  # Assume some are resolved
-        
-        # Enhanced analytics data with REAL values
-        analytics_data = {
-            "totalUsers": total_users,
-            "activeUsers": active_users,
-            "activeDevices": online_devices,
-            "totalDevices": len(devices),
-            "activeKeys": active_keys,
-            "avgUptime": round(uptime, 1),
-            "dataTransfer": f"{data_transfer_gb:.1f} GB",  # REAL calculation
-            "alertsToday": alerts_today,  # REAL security events count
-            "deploymentsToday": 0,  # Count from deployment logs
-            "deviceTypes": device_types,
-            "connectionTrends": [],  # Will be populated by dedicated endpoint
-            "tailnetStatus": tailnet_status,
-            "apiResponseTime": api_response_time,
-            "totalMachines": total_machines,
-            "machinesWithDevices": machines_with_devices,
-            "lastUpdated": now.isoformat()
-        }
-        
-        logger.info(f"Generated REAL analytics data: {analytics_data}")
-        return analytics_data
-        
+        devices = device_data.get("devices", []) if isinstance(device_data, dict) else []
+        return {"devices": devices, "status": "healthy", "response_time": round(time.time() - started, 3)}
     except Exception as e:
-        logger.error(f"Failed to get analytics data: {e}")
-        # Return default values if Tailscale API fails
-        return {
-            "totalUsers": db.query(User).count(),
-            "activeUsers": db.query(User).filter(User.is_active == True).count(),
-            "activeDevices": 0,
-            "totalDevices": 0,
-            "activeKeys": db.query(AuthKey).filter(AuthKey.revoked == False, AuthKey.active == True).count(),
-            "avgUptime": 0,
-            "dataTransfer": "0 GB",
-            "alertsToday": 0,
-            "deploymentsToday": 0,
-            "deviceTypes": {"desktop": 0, "mobile": 0, "server": 0, "iot": 0},
-            "connectionTrends": [],
-            "tailnetStatus": "error",
-            "apiResponseTime": 0,
-            "totalMachines": db.query(Machine).count(),
-            "machinesWithDevices": 0,
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
+        logger.warning(f"Failed to fetch Tailscale devices: {e}")
+        return {"devices": [], "status": "error", "response_time": 0}
+
+def _db_aggregates(db: Session, now: datetime) -> dict:
+    """All DB counters used by the panels, computed in one round-trip"""
+    day_ago = now - timedelta(hours=24)
+    count = lambda model, *where: select(func.count()).select_from(model).where(*where).scalar_subquery()
+    row = db.execute(select(
+        count(User).label("total_users"),
+        count(User, User.is_active == True).label("active_users"),
+        count(AuthKey).label("total_keys"),
+        count(AuthKey, AuthKey.revoked == False,
+              or_(AuthKey.expires_at == None, AuthKey.expires_at >= now)).label("active_keys"),
+        count(AuthKey, AuthKey.revoked == False, AuthKey.active == True).label("enabled_keys"),
+        count(AuthKey, AuthKey.created_at >= day_ago).label("recent_keys"),
+        count(User, User.last_login >= day_ago).label("recent_logins"),
+        count(Machine).label("total_machines"),
+        count(Machine, Machine.ts_device_id.isnot(None)).label("machines_with_devices"),
+    )).one()
+    return dict(row._mapping)
+
+SECURITY_EVENTS_SHOWN = 10
+
+def _recent_security_events(db: Session, now: datetime) -> list:
+    """Newest auth key creations and logins of the last 24h, in one query"""
+    day_ago = now - timedelta(hours=24)
+    events = union_all(
+        select(literal("KEY_CREATED").label("type"), AuthKey.created_at.label("at"), AuthKey.description.label("subject"))
+        .where(AuthKey.created_at >= day_ago),
+        select(literal("LOGIN_ATTEMPT"), User.last_login, User.email).where(User.last_login >= day_ago),
+    ).subquery()
+    rows = db.execute(select(events).order_by(events.c.at.desc()).limit(SECURITY_EVENTS_SHOWN)).all()
+    return [
+        {
+            "time": at.strftime("%m/%d/%Y, %I:%M:%S %p"),
+            "type": event_type,
+            "description": (f"New auth key created: {subject or 'No description'}" if event_type == "KEY_CREATED"
+                            else f"Successful login from user: {subject}"),
+            "severity": "INFO"
         }
+        for event_type, at, subject in rows
+    ]
 
-@router.get("/overview")
-async def get_analytics_overview(db: Session = Depends(get_db)):
-    """Get system overview analytics"""
-    return await _get_analytics_data(db)
+class _Snapshot:
+    """Everything the panels are computed from: one device fetch, one aggregate query, one timestamp.
 
-@router.get("/device-metrics")
-async def get_device_metrics(db: Session = Depends(get_db)):
-    """Get enhanced device metrics"""
-    data = await _get_analytics_data(db)
+    Snapshots are reused for ANALYTICS_SNAPSHOT_TTL_SEC; `id` is a version of everything the panels
+    render, so clients revalidating a panel of the current snapshot get a 304.
+    """
+
+    def __init__(self, db: Session, fetched: dict, now: datetime):
+        self.now = now
+        self.timestamp = now.isoformat()
+        self.devices = fetched["devices"]
+        self.tailnet_status = fetched["status"]
+        self.api_response_time = fetched["response_time"]
+        self.agg = _db_aggregates(db, now)
+        self.security_events = _recent_security_events(db, now)
+        # Exact fleet uptime over the last 24h from the device session store
+        self.uptime = fleet_uptime(db, now - timedelta(hours=24), now)["uptime"]
+        self._cache = {}
+
+        one_hour_ago = now - timedelta(hours=1)
+        self.last_seen = [_last_seen(device) for device in self.devices]
+        self.online = [bool(seen and seen > one_hour_ago) for seen in self.last_seen]
+        self.active_devices = sum(self.online)
+        self.device_types = {"desktop": 0, "mobile": 0, "server": 0, "iot": 0}
+        for device in self.devices:
+            self.device_types[_classify_device(device)[0]] += 1
+
+        # Covers everything the panels render, lastUpdated and the API response time included,
+        # so equal tags always mean equal bodies
+        self.id = etag_for(
+            self.timestamp, self.api_response_time, self.tailnet_status, sorted(self.agg.items()),
+            round(self.uptime, 1), self.security_events,
+            [(d.get("id"), d.get("hostname"), d.get("tags"), online, seen.date() if seen else None)
+             for d, online, seen in zip(self.devices, self.online, self.last_seen)],
+        )
+
+    def panel(self, name: str, db: Session) -> dict:
+        if name not in self._cache:
+            self._cache[name] = PANEL_BUILDERS[name](self, db)
+        return self._cache[name]
+
+_snapshot_cache = {"snapshot": None, "expires": 0.0}
+_snapshot_lock = asyncio.Lock()
+
+def _fresh_snapshot() -> _Snapshot | None:
+    if time.monotonic() < _snapshot_cache["expires"]:
+        return _snapshot_cache["snapshot"]
+    return None
+
+async def _snapshot(db: Session) -> _Snapshot:
+    snapshot = _fresh_snapshot()
+    if snapshot is not None:
+        return snapshot
+    # One rebuild at a time: requests arriving after expiry wait for it instead of each fetching
+    async with _snapshot_lock:
+        snapshot = _fresh_snapshot()
+        if snapshot is None:
+            fetched = await _fetch_devices()
+            snapshot = _Snapshot(db, fetched, datetime.now(timezone.utc))
+            _snapshot_cache.update(snapshot=snapshot, expires=time.monotonic() + settings.ANALYTICS_SNAPSHOT_TTL_SEC)
+    return snapshot
+
+async def _panels_response(request: Request, response: Response, db: Session, names: list):
+    """Panels of the current snapshot, or a 304 if the client already holds this version"""
+    snapshot = await _snapshot(db)
+    cache_control = f"private, max-age={settings.ANALYTICS_SNAPSHOT_TTL_SEC}"
+    not_modified = conditional(request, response, etag_for(snapshot.id, *names), cache_control)
+    if not_modified is not None:
+        return not_modified, None
+    return None, snapshot
+
+async def _panel_response(request: Request, response: Response, db: Session, name: str):
+    not_modified, snapshot = await _panels_response(request, response, db, [name])
+    if not_modified is not None:
+        return not_modified
+    return fast_json(snapshot.panel(name, db), response)
+
+def _overview_panel(s: _Snapshot, db: Session) -> dict:
+    # Estimate: each active device uses ~5-10 GB per day
+    data_transfer_gb = s.active_devices * 7.5
+    return {
+        "totalUsers": s.agg["total_users"],
+        "activeUsers": s.agg["active_users"],
+        "activeDevices": s.active_devices,
+        "totalDevices": len(s.devices),
+        "activeKeys": s.agg["active_keys"],
+        "avgUptime": round(s.uptime, 1),
+        "dataTransfer": f"{data_transfer_gb:.1f} GB",
+        "alertsToday": max(0, s.agg["recent_keys"] + s.agg["recent_logins"] - 2),  # Assume some are resolved
+        "deploymentsToday": 0,  # Count from deployment logs
+        "deviceTypes": dict(s.device_types),
+        "connectionTrends": [],  # Will be populated by dedicated endpoint
+        "tailnetStatus": s.tailnet_status,
+        "apiResponseTime": s.api_response_time,
+        "totalMachines": s.agg["total_machines"],
+        "machinesWithDevices": s.agg["machines_with_devices"],
+        "lastUpdated": s.timestamp
+    }
+
+def _device_metrics_panel(s: _Snapshot, db: Session) -> dict:
+    data = s.panel("overview", db)
     return {
         "totalDevices": data["totalDevices"],
         "activeDevices": data["activeDevices"],
@@ -225,228 +237,69 @@ async def get_device_metrics(db: Session = Depends(get_db)):
         "lastUpdated": data["lastUpdated"]
     }
 
-@router.get("/network-performance")
-async def get_network_performance(db: Session = Depends(get_db)):
-    """Get enhanced network performance metrics with REAL data from Tailscale"""
-    try:
-        # Get Tailscale health for network metrics
-        ts_health = await health_check()
-        api_response_time = ts_health.get("api_response_time", 0)
-        
-        # Get current device data for REAL network metrics
-        device_data = await list_devices()
-        devices = device_data.get("devices", [])
-        
-        # Calculate REAL bandwidth usage based on active devices
-        active_devices = 0
-        total_bandwidth_capacity = len(devices) * 10  # GB per device capacity
-        
-        for device in devices:
-            try:
-                last_seen_str = device.get("lastSeen", "")
-                if last_seen_str:
-                    last_seen = datetime.fromisoformat(last_seen_str.replace('Z', '+00:00'))
-                    one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-                    if last_seen > one_hour_ago:
-                        active_devices += 1
-            except Exception as e:
-                logger.warning(f"Error processing device for network metrics: {e}")
-                continue
-        
-        # Calculate REAL bandwidth usage (active devices * estimated usage per device)
-        estimated_usage_per_device = 8.5  # GB per device per day
-        used_bandwidth = active_devices * estimated_usage_per_device
-        
-        # Calculate REAL latency from API response time
-        real_latency = api_response_time * 1000 if api_response_time else 0
-        
-        # Calculate REAL packet loss based on device connectivity
-        if devices:
-            packet_loss = max(0, (len(devices) - active_devices) / len(devices) * 100)
-        else:
-            packet_loss = 0
-        
-        # Calculate REAL network health score based on response time and device status
-        if api_response_time < 0.1 and active_devices == len(devices):
-            health_score = 95
-        elif api_response_time < 0.5 and active_devices >= len(devices) * 0.8:
-            health_score = 85
-        elif api_response_time < 1.0 and active_devices >= len(devices) * 0.6:
-            health_score = 75
-        else:
-            health_score = 60
-            
-        # Calculate REAL throughput based on active devices
-        throughput_gbps = (active_devices * 0.8) if active_devices > 0 else 0
-            
-        return {
-            "dataTransfer": f"{used_bandwidth:.1f} GB",
-            "latency": f"{real_latency:.1f}ms" if real_latency else "N/A",
-            "throughput": f"{throughput_gbps:.1f} Gbps",
-            "packetLoss": f"{packet_loss:.2f}%",
-            "bandwidthUsage": round((used_bandwidth / total_bandwidth_capacity) * 100, 1) if total_bandwidth_capacity > 0 else 0,
-            "peakUsage": f"{used_bandwidth * 1.3:.1f} GB",
-            "healthScore": health_score,
-            "tailnetStatus": ts_health.get("status", "unknown"),
-            "activeDevices": active_devices,
-            "totalDevices": len(devices),
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
-    except Exception as e:
-        logger.error(f"Failed to get network performance: {e}")
-        return {
-            "dataTransfer": "0 GB",
-            "latency": "N/A",
-            "throughput": "0 Gbps",
-            "packetLoss": "N/A",
-            "bandwidthUsage": 0,
-            "peakUsage": "0 GB",
-            "healthScore": 0,
-            "tailnetStatus": "error",
-            "activeDevices": 0,
-            "totalDevices": 0,
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
+def _network_performance_panel(s: _Snapshot, db: Session) -> dict:
+    total = len(s.devices)
+    active = s.active_devices
+    api_response_time = s.api_response_time
+    total_bandwidth_capacity = total * 10  # GB per device capacity
+    used_bandwidth = active * 8.5  # GB per device per day
+    real_latency = api_response_time * 1000 if api_response_time else 0
+    packet_loss = max(0, (total - active) / total * 100) if total else 0
 
-@router.get("/geographic-distribution")
-async def get_geographic_distribution(db: Session = Depends(get_db)):
-    """Get real-time geographic distribution based on device locations"""
-    try:
-        # Get current device data from Tailscale
-        device_data = await list_devices()
-        devices = device_data.get("devices", [])
-        
-        # Analyze device locations and tags for geographic distribution
-        regions = {"US": 0, "EU": 0, "Asia": 0, "Other": 0}
-        
-        for device in devices:
-            try:
-                hostname = device.get("hostname", "").lower()
-                tags = device.get("tags", [])
-                last_seen = device.get("lastSeen", "")
-                
-                # Determine region based on hostname patterns and tags
-                if any(tag in ["tag:us", "tag:america", "tag:na"] for tag in tags) or any(word in hostname for word in ["us-", "nyc", "la", "sf", "chicago"]):
-                    regions["US"] += 1
-                elif any(tag in ["tag:eu", "tag:europe", "tag:uk", "tag:de"] for tag in tags) or any(word in hostname for word in ["eu-", "london", "berlin", "paris", "amsterdam"]):
-                    regions["EU"] += 1
-                elif any(tag in ["tag:asia", "tag:japan", "tag:singapore"] for tag in tags) or any(word in hostname for word in ["asia-", "tokyo", "singapore", "seoul", "beijing"]):
-                    regions["Asia"] += 1
-                else:
-                    regions["Other"] += 1
-                    
-            except Exception as e:
-                logger.warning(f"Error processing device location: {e}")
-                regions["Other"] += 1
-                continue
-        
-        # Calculate percentages
-        total_devices = sum(regions.values())
-        if total_devices > 0:
-            distribution = {
-                region: {
-                    "count": count,
-                    "percentage": round((count / total_devices) * 100, 1)
-                }
-                for region, count in regions.items()
-            }
-        else:
-            distribution = {region: {"count": 0, "percentage": 0} for region in regions}
-        
-        return {
-            "regions": distribution,
-            "totalDevices": total_devices,
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to get geographic distribution: {e}")
-        return {
-            "regions": {
-                "US": {"count": 0, "percentage": 0},
-                "EU": {"count": 0, "percentage": 0},
-                "Asia": {"count": 0, "percentage": 0},
-                "Other": {"count": 0, "percentage": 0}
-            },
-            "totalDevices": 0,
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
+    # Network health score based on response time and device status
+    if api_response_time < 0.1 and active == total:
+        health_score = 95
+    elif api_response_time < 0.5 and active >= total * 0.8:
+        health_score = 85
+    elif api_response_time < 1.0 and active >= total * 0.6:
+        health_score = 75
+    else:
+        health_score = 60
+    if s.tailnet_status == "error":
+        health_score = 0
 
-@router.get("/security-events")
-async def get_security_events(db: Session = Depends(get_db)):
-    """Get enhanced security events with real-time data"""
-    data = await _get_analytics_data(db)
-    
-    # Calculate security score based on active keys and devices
+    throughput_gbps = (active * 0.8) if active > 0 else 0
+    return {
+        "dataTransfer": f"{used_bandwidth:.1f} GB",
+        "latency": f"{real_latency:.1f}ms" if real_latency else "N/A",
+        "throughput": f"{throughput_gbps:.1f} Gbps",
+        "packetLoss": f"{packet_loss:.2f}%",
+        "bandwidthUsage": round((used_bandwidth / total_bandwidth_capacity) * 100, 1) if total_bandwidth_capacity > 0 else 0,
+        "peakUsage": f"{used_bandwidth * 1.3:.1f} GB",
+        "healthScore": health_score,
+        "tailnetStatus": s.tailnet_status,
+        "activeDevices": active,
+        "totalDevices": total,
+        "lastUpdated": s.timestamp
+    }
+
+def _geographic_distribution_panel(s: _Snapshot, db: Session) -> dict:
+    regions = {"US": 0, "EU": 0, "Asia": 0, "Other": 0}
+    for device in s.devices:
+        regions[_region(device)] += 1
+    return {
+        "regions": _distribution(regions),
+        "totalDevices": sum(regions.values()),
+        "lastUpdated": s.timestamp
+    }
+
+def _security_events_panel(s: _Snapshot, db: Session) -> dict:
+    data = s.panel("overview", db)
     total_devices = data["totalDevices"]
     active_keys = data["activeKeys"]
-    
+
     # Simple security scoring algorithm
     if total_devices > 0 and active_keys > 0:
         security_score = min(100, (active_keys / total_devices) * 50 + 50)
     else:
         security_score = 0
-    
-    # Generate real-time security events based on current system state
-    now = datetime.now(timezone.utc)
-    security_events = []
-    
-    # Check for recent key activities
-    recent_keys = db.query(AuthKey).filter(
-        AuthKey.created_at >= now - timedelta(hours=24)
-    ).all()
-    
-    for key in recent_keys:
-        if key.created_at:
-            event_time = key.created_at.strftime("%m/%d/%Y, %I:%M:%S %p")
-            security_events.append({
-                "time": event_time,
-                "type": "KEY_CREATED",
-                "description": f"New auth key created: {key.description or 'No description'}",
-                "severity": "INFO"
-            })
-    
-    # Check for recent user activities
-    recent_users = db.query(User).filter(
-        User.last_login >= now - timedelta(hours=24)
-    ).all()
-    
-    for user in recent_users:
-        if user.last_login:
-            event_time = user.last_login.strftime("%m/%d/%Y, %I:%M:%S %p")
-            security_events.append({
-                "time": event_time,
-                "type": "LOGIN_ATTEMPT",
-                "description": f"Successful login from user: {user.email}",
-                "severity": "INFO"
-            })
-    
-    # Sort events by time (most recent first)
-    security_events.sort(key=lambda x: x["time"], reverse=True)
-    
-    # Limit to last 10 events
-    security_events = security_events[:10]
-    
-    # Calculate security events count based on current system state
-    # Count recent key activities and user logins
-    now_24h_ago = now - timedelta(hours=24)
-    
-    # Count recent key creations
-    recent_keys = db.query(AuthKey).filter(
-        AuthKey.created_at >= now_24h_ago
-    ).count()
-    
-    # Count recent user logins (simulate based on user activity)
-    recent_users = db.query(User).filter(
-        User.last_login >= now_24h_ago
-    ).count()
-    
-    # Total security events = key activities + user activities
-    total_security_events = recent_keys + recent_users
-    alerts_today = max(0, total_security_events - 2)  # Assume some are resolved
-    
+
+    # Key creations and logins of the last 24h (fetched with the snapshot)
+    security_events = s.security_events
+
+    total_security_events = s.agg["recent_keys"] + s.agg["recent_logins"]
     return {
-        "alertsToday": alerts_today,
+        "alertsToday": max(0, total_security_events - 2),  # Assume some are resolved
         "totalEvents": total_security_events,
         "resolved": len([e for e in security_events if e["type"] in ["KEY_CREATED", "LOGIN_ATTEMPT"]]),
         "pending": len([e for e in security_events if e["type"] not in ["KEY_CREATED", "LOGIN_ATTEMPT"]]),
@@ -464,153 +317,43 @@ async def get_security_events(db: Session = Depends(get_db)):
         "lastUpdated": data["lastUpdated"]
     }
 
-@router.get("/connection-trends")
-async def get_connection_trends(db: Session = Depends(get_db)):
-    """Get real-time connection trends data from actual device activity"""
-    try:
-        # Get current device data from Tailscale
-        device_data = await list_devices()
-        devices = device_data.get("devices", [])
-        
-        # Generate REAL connection trends based on device activity
-        now = datetime.now(timezone.utc)
-        trends = []
-        
-        # Analyze device activity for the last 7 days
-        for i in range(7):
-            date = now - timedelta(days=i)
-            date_str = date.strftime("%m/%d/%Y")
-            
-            # Count devices that were active on this date
-            active_on_date = 0
-            for device in devices:
-                try:
-                    last_seen_str = device.get("lastSeen", "")
-                    if last_seen_str:
-                        last_seen = datetime.fromisoformat(last_seen_str.replace('Z', '+00:00'))
-                        # Check if device was active on this specific date
-                        if last_seen.date() == date.date():
-                            active_on_date += 1
-                except Exception as e:
-                    logger.warning(f"Error processing device lastSeen: {e}")
-                    continue
-            
-            # If no devices were active on this date, use a realistic base count
-            if active_on_date == 0:
-                # Use a more realistic base count - not all devices are active every day
-                base_count = max(1, len(devices) // 3)  # Only 1/3 of devices active per day on average
-                # Add some variation based on day of week (weekends vs weekdays)
-                day_variation = 1 if date.weekday() < 5 else -1  # Weekdays +1, weekends -1
-                active_on_date = max(1, base_count + day_variation)
-            
-            # Ensure the connection count is realistic and not too high
-            max_realistic_connections = min(len(devices), 20)  # Cap at total devices or 20, whichever is lower
-            active_on_date = min(active_on_date, max_realistic_connections)
-            
-            trends.append({
-                "date": date_str,
-                "connections": active_on_date
-            })
-        
-        # Reverse to show oldest to newest
-        trends.reverse()
-        
-        logger.info(f"Generated REAL connection trends: {trends}")
-        return {
-            "trends": trends,
-            "totalDevices": len(devices),
-            "lastUpdated": now.isoformat()
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to get connection trends: {e}")
-        return {
-            "trends": [],
-            "totalDevices": 0,
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
+def _connection_trends_panel(s: _Snapshot, db: Session) -> dict:
+    total = len(s.devices)
+    active_by_date = Counter(seen.date() for seen in s.last_seen if seen)
+    trends = []
 
-@router.get("/device-distribution")
-async def get_device_distribution(db: Session = Depends(get_db)):
-    """Get real-time device type distribution from actual device data"""
-    try:
-        # Get current device data from Tailscale
-        device_data = await list_devices()
-        devices = device_data.get("devices", [])
-        
-        # Analyze REAL device types based on hostname and tags
-        device_types = {"desktop": 0, "mobile": 0, "server": 0, "iot": 0}
-        
-        for device in devices:
-            try:
-                hostname = device.get("hostname", "").lower()
-                tags = device.get("tags", [])
-                
-                # Enhanced classification based on REAL hostname patterns (same logic as main analytics)
-                if any(tag in ["tag:server", "tag:production", "tag:backend", "tag:prod"] for tag in tags) or any(word in hostname for word in ["server", "prod", "backend", "api", "ipg", "hfserver", "tesla", "db", "mysql", "redis", "nginx", "docker", "k8s", "kubernetes"]):
-                    device_types["server"] += 1
-                elif any(tag in ["tag:mobile", "tag:phone", "tag:tablet", "tag:ios", "tag:android"] for tag in tags) or any(word in hostname for word in ["phone", "mobile", "android", "ios", "tablet", "iphone", "ipad", "samsung", "xiaomi", "huawei", "oneplus", "pixel", "galaxy"]):
-                    device_types["mobile"] += 1
-                elif any(tag in ["tag:iot", "tag:sensor", "tag:camera", "tag:smart", "tag:thermostat"] for tag in tags) or any(word in hostname for word in ["sensor", "camera", "thermostat", "smart", "nest", "ring", "philips", "hue", "bulb", "switch", "plug", "doorbell", "security", "motion", "temperature", "humidity"]):
-                    device_types["iot"] += 1
-                else:
-                    # Default to desktop for Windows machines and general workstations
-                    device_types["desktop"] += 1
-                    
-            except Exception as e:
-                logger.warning(f"Error processing device type: {e}")
-                device_types["desktop"] += 1
-                continue
-        
-        # Calculate REAL percentages
-        total_devices = sum(device_types.values())
-        if total_devices > 0:
-            distribution = {
-                device_type: {
-                    "count": count,
-                    "percentage": round((count / total_devices) * 100, 1)
-                }
-                for device_type, count in device_types.items()
-            }
-        else:
-            distribution = {device_type: {"count": 0, "percentage": 0} for device_type in device_types}
-        
-        logger.info(f"Generated REAL device distribution: {distribution}")
-        return {
-            "distribution": distribution,
-            "totalDevices": total_devices,
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to get device distribution: {e}")
-        return {
-            "distribution": {
-                "desktop": {"count": 0, "percentage": 0},
-                "mobile": {"count": 0, "percentage": 0},
-                "server": {"count": 0, "percentage": 0},
-                "iot": {"count": 0, "percentage": 0}
-            },
-            "totalDevices": 0,
-            "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
+    # Device activity for the last 7 days, oldest to newest
+    for i in reversed(range(7)):
+        date = s.now - timedelta(days=i)
+        active_on_date = active_by_date.get(date.date(), 0)
 
-@router.get("/usage-analytics")
-async def get_usage_analytics(db: Session = Depends(get_db)):
-    """Get enhanced usage analytics"""
-    data = await _get_analytics_data(db)
-    
-    # Calculate usage efficiency
-    if data["totalUsers"] > 0:
-        user_efficiency = (data["activeUsers"] / data["totalUsers"]) * 100
-    else:
-        user_efficiency = 0
-        
-    if data["totalDevices"] > 0:
-        device_efficiency = (data["activeDevices"] / data["totalDevices"]) * 100
-    else:
-        device_efficiency = 0
-    
+        # If no devices were active on this date, use a realistic base count
+        if active_on_date == 0:
+            base_count = max(1, total // 3)  # Only 1/3 of devices active per day on average
+            day_variation = 1 if date.weekday() < 5 else -1  # Weekdays +1, weekends -1
+            active_on_date = max(1, base_count + day_variation)
+
+        # Cap at total devices or 20, whichever is lower
+        active_on_date = min(active_on_date, min(total, 20))
+        trends.append({"date": date.strftime("%m/%d/%Y"), "connections": active_on_date})
+
+    return {
+        "trends": trends if s.tailnet_status != "error" else [],
+        "totalDevices": total,
+        "lastUpdated": s.timestamp
+    }
+
+def _device_distribution_panel(s: _Snapshot, db: Session) -> dict:
+    return {
+        "distribution": _distribution(s.device_types),
+        "totalDevices": sum(s.device_types.values()),
+        "lastUpdated": s.timestamp
+    }
+
+def _usage_analytics_panel(s: _Snapshot, db: Session) -> dict:
+    data = s.panel("overview", db)
+    user_efficiency = (data["activeUsers"] / data["totalUsers"]) * 100 if data["totalUsers"] > 0 else 0
+    device_efficiency = (data["activeDevices"] / data["totalDevices"]) * 100 if data["totalDevices"] > 0 else 0
     return {
         "activeUsers": data["activeUsers"],
         "totalUsers": data["totalUsers"],
@@ -625,62 +368,124 @@ async def get_usage_analytics(db: Session = Depends(get_db)):
         "lastUpdated": data["lastUpdated"]
     }
 
+def _real_time_panel(s: _Snapshot, db: Session) -> dict:
+    current_devices = len(s.devices)
+    return {
+        "timestamp": s.timestamp,
+        "devices": {
+            "total": current_devices,
+            "online": current_devices,  # Simplified for now
+            "status": "healthy"
+        },
+        "users": {
+            "total": s.agg["active_users"],
+            "active": s.agg["active_users"],
+            "status": "active"
+        },
+        "keys": {
+            "total": s.agg["enabled_keys"],
+            "active": s.agg["enabled_keys"],
+            "status": "active"
+        },
+        "tailscale": {
+            "status": s.tailnet_status,
+            "responseTime": s.api_response_time,
+            "lastCheck": s.timestamp
+        },
+        "system": {
+            "uptime": "99.9%",
+            "health": "healthy",
+            "version": "1.0.0"
+        }
+    }
+
+PANEL_BUILDERS = {
+    "overview": _overview_panel,
+    "device-metrics": _device_metrics_panel,
+    "network-performance": _network_performance_panel,
+    "geographic-distribution": _geographic_distribution_panel,
+    "security-events": _security_events_panel,
+    "connection-trends": _connection_trends_panel,
+    "device-distribution": _device_distribution_panel,
+    "usage-analytics": _usage_analytics_panel,
+    "real-time": _real_time_panel,
+}
+
+async def _get_analytics_data(db: Session):
+    """Common analytics data helper with enhanced Tailscale integration"""
+    return (await _snapshot(db)).panel("overview", db)
+
+@router.get("/")
+async def get_analytics_root(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get analytics root data"""
+    return await _panel_response(request, response, db, "overview")
+
+@router.get("/dashboard")
+async def get_dashboard(
+    request: Request,
+    response: Response,
+    panels: Optional[str] = Query(None, description=f"Comma-separated panels to include (default: all): {', '.join(PANELS)}"),
+    db: Session = Depends(get_db)
+):
+    """Every Analytics panel computed from one device fetch, one DB aggregate batch and one timestamp"""
+    selected = [p.strip() for p in panels.split(",") if p.strip()] if panels else list(PANELS)
+    unknown = [p for p in selected if p not in PANEL_BUILDERS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown panels: {', '.join(unknown)}")
+
+    not_modified, snapshot = await _panels_response(request, response, db, selected)
+    if not_modified is not None:
+        return not_modified
+    return fast_json({
+        "timestamp": snapshot.timestamp,
+        "snapshotId": snapshot.id.removeprefix("W/").strip('"'),
+        "panels": {name: snapshot.panel(name, db) for name in selected}
+    }, response)
+
+@router.get("/overview")
+async def get_analytics_overview(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get system overview analytics"""
+    return await _panel_response(request, response, db, "overview")
+
+@router.get("/device-metrics")
+async def get_device_metrics(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get enhanced device metrics"""
+    return await _panel_response(request, response, db, "device-metrics")
+
+@router.get("/network-performance")
+async def get_network_performance(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get enhanced network performance metrics with REAL data from Tailscale"""
+    return await _panel_response(request, response, db, "network-performance")
+
+@router.get("/geographic-distribution")
+async def get_geographic_distribution(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get real-time geographic distribution based on device locations"""
+    return await _panel_response(request, response, db, "geographic-distribution")
+
+@router.get("/security-events")
+async def get_security_events(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get enhanced security events with real-time data"""
+    return await _panel_response(request, response, db, "security-events")
+
+@router.get("/connection-trends")
+async def get_connection_trends(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get real-time connection trends data from actual device activity"""
+    return await _panel_response(request, response, db, "connection-trends")
+
+@router.get("/device-distribution")
+async def get_device_distribution(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get real-time device type distribution from actual device data"""
+    return await _panel_response(request, response, db, "device-distribution")
+
+@router.get("/usage-analytics")
+async def get_usage_analytics(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get enhanced usage analytics"""
+    return await _panel_response(request, response, db, "usage-analytics")
+
 @router.get("/real-time")
-async def get_real_time_analytics(db: Session = Depends(get_db)):
+async def get_real_time_analytics(request: Request, response: Response, db: Session = Depends(get_db)):
     """Get real-time analytics data"""
-    try:
-        # Get current Tailscale status
-        ts_health = await health_check()
-        
-        # Get current device count
-        device_data = await list_devices()
-        current_devices = len(device_data.get("devices", []))
-        
-        # Get current user count
-        current_users = db.query(User).filter(User.is_active == True).count()
-        
-        # Get current key count
-        current_keys = db.query(AuthKey).filter(
-            AuthKey.revoked == False,
-            AuthKey.active == True
-        ).count()
-        
-        return {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "devices": {
-                "total": current_devices,
-                "online": current_devices,  # Simplified for now
-                "status": "healthy"
-            },
-            "users": {
-                "total": current_users,
-                "active": current_users,
-                "status": "active"
-            },
-            "keys": {
-                "total": current_keys,
-                "active": current_keys,
-                "status": "active"
-            },
-            "tailscale": {
-                "status": ts_health.get("status", "unknown"),
-                "responseTime": ts_health.get("api_response_time", 0),
-                "lastCheck": ts_health.get("last_check", "unknown")
-            },
-            "system": {
-                "uptime": "99.9%",
-                "health": "healthy",
-                "version": "1.0.0"
-            }
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to get real-time analytics: {e}")
-        return {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "error": str(e),
-            "status": "error"
-        }
+    return await _panel_response(request, response, db, "real-time")
 
 @router.get("/debug/devices")
 async def debug_device_classification(db: Session = Depends(get_db)):
@@ -689,62 +494,29 @@ async def debug_device_classification(db: Session = Depends(get_db)):
         # Get current device data from Tailscale
         device_data = await list_devices()
         devices = device_data.get("devices", [])
-        
+
         debug_info = []
         device_types = {"desktop": 0, "mobile": 0, "server": 0, "iot": 0}
-        
+
         for device in devices:
-            try:
-                hostname = device.get("hostname", "")
-                tags = device.get("tags", [])
-                last_seen = device.get("lastSeen", "")
-                device_id = device.get("id", "unknown")
-                
-                # Classify device type
-                device_type = "desktop"  # default
-                classification_reason = "default classification"
-                
-                if any(tag in ["tag:server", "tag:production", "tag:backend", "tag:prod"] for tag in tags):
-                    device_type = "server"
-                    classification_reason = f"tag-based: {[tag for tag in tags if tag in ['tag:server', 'tag:production', 'tag:backend', 'tag:prod']]}"
-                elif any(word in hostname.lower() for word in ["server", "prod", "backend", "api", "ipg", "hfserver", "tesla", "db", "mysql", "redis", "nginx", "docker", "k8s", "kubernetes"]):
-                    device_type = "server"
-                    classification_reason = f"hostname-based: {hostname}"
-                elif any(tag in ["tag:mobile", "tag:phone", "tag:tablet", "tag:ios", "tag:android"] for tag in tags):
-                    device_type = "mobile"
-                    classification_reason = f"tag-based: {[tag for tag in tags if tag in ['tag:mobile', 'tag:phone', 'tag:tablet', 'tag:ios', 'tag:android']]}"
-                elif any(word in hostname.lower() for word in ["phone", "mobile", "android", "ios", "tablet", "iphone", "ipad", "samsung", "xiaomi", "huawei", "oneplus", "pixel", "galaxy"]):
-                    device_type = "mobile"
-                    classification_reason = f"hostname-based: {hostname}"
-                elif any(tag in ["tag:iot", "tag:sensor", "tag:camera", "tag:smart", "tag:thermostat"] for tag in tags):
-                    device_type = "iot"
-                    classification_reason = f"tag-based: {[tag for tag in tags if tag in ['tag:iot', 'tag:sensor', 'tag:camera', 'tag:smart', 'tag:thermostat']]}"
-                elif any(word in hostname.lower() for word in ["sensor", "camera", "thermostat", "smart", "nest", "ring", "philips", "hue", "bulb", "switch", "plug", "doorbell", "security", "motion", "temperature", "humidity"]):
-                    device_type = "iot"
-                    classification_reason = f"hostname-based: {hostname}"
-                
-                device_types[device_type] += 1
-                
-                debug_info.append({
-                    "id": device_id,
-                    "hostname": hostname,
-                    "tags": tags,
-                    "lastSeen": last_seen,
-                    "classifiedAs": device_type,
-                    "reason": classification_reason
-                })
-                
-            except Exception as e:
-                logger.warning(f"Error processing device for debug: {e}")
-                continue
-        
-        return {
+            device_type, classification_reason = _classify_device(device)
+            device_types[device_type] += 1
+            debug_info.append({
+                "id": device.get("id", "unknown"),
+                "hostname": device.get("hostname", ""),
+                "tags": device.get("tags", []),
+                "lastSeen": device.get("lastSeen", ""),
+                "classifiedAs": device_type,
+                "reason": classification_reason
+            })
+
+        return fast_json({
             "totalDevices": len(devices),
             "deviceTypes": device_types,
             "classificationDetails": debug_info,
             "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
-        
+        })
+
     except Exception as e:
         logger.error(f"Failed to get debug device info: {e}")
         return {
@@ -753,4 +525,41 @@ async def debug_device_classification(db: Session = Depends(get_db)):
             "deviceTypes": {"desktop": 0, "mobile": 0, "server": 0, "iot": 0},
             "classificationDetails": [],
             "lastUpdated": datetime.now(timezone.utc).isoformat()
-        }
\ No newline at end of file
+        }
+
+def _uptime_window(start: Optional[datetime], end: Optional[datetime], hours: int):
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=hours)
+    return start, end
+
+@router.get("/uptime")
+async def get_fleet_uptime(
+    start: Optional[datetime] = Query(None, description="Window start (ISO 8601), defaults to end - hours"),
+    end: Optional[datetime] = Query(None, description="Window end (ISO 8601), defaults to now"),
+    hours: int = Query(24, ge=1, le=24 * 365, description="Window length when start is omitted"),
+    db: Session = Depends(get_db)
+):
+    """Exact per-device and fleet-wide uptime for any window, from recorded online sessions"""
+    start, end = _uptime_window(start, end, hours)
+    try:
+        return fleet_uptime(db, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/uptime/{device_id}")
+async def get_device_uptime(
+    device_id: str,
+    start: Optional[datetime] = Query(None, description="Window start (ISO 8601), defaults to end - hours"),
+    end: Optional[datetime] = Query(None, description="Window end (ISO 8601), defaults to now"),
+    hours: int = Query(24, ge=1, le=24 * 365, description="Window length when start is omitted"),
+    db: Session = Depends(get_db)
+):
+    """Exact uptime of one device (mirror id or Tailscale device id)"""
+    device = db.query(Device).filter((Device.id == device_id) | (Device.ts_device_id == device_id)).first()
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    start, end = _uptime_window(start, end, hours)
+    try:
+        return device_uptime(db, device.id, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
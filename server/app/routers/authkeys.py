@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from ..db import get_db
@@ -12,6 +13,9 @@ from pydantic import BaseModel, Field
 from datetime import datetime, timedelta, timezone
 import json
 import logging
+from ..services.changelog import CHANGES_PAGE_MAX, changes_since
+from ..utils.responses import fast_json
+from ..utils.streaming import ndjson_response, stream_rows
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -58,33 +62,73 @@ class AuthKeyStats(BaseModel):
     keys_expiring_soon: int
     tailnet_info: dict
 
+def _key_status(key: AuthKey, now: datetime) -> str:
+    expires_at = key.expires_at
+    
+    # Handle different datetime formats
+    if isinstance(expires_at, str):
+        try:
+            expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+        except ValueError:
+            # Fallback for other date formats
+            expires_at = datetime.fromisoformat(expires_at)
+    
+    # Ensure expires_at has timezone info (naive datetimes are UTC)
+    if expires_at and hasattr(expires_at, 'tzinfo') and expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    
+    if key.revoked:
+        return "revoked"
+    if expires_at and expires_at < now:
+        return "expired"
+    return "active"
+
+def _key_row(key: AuthKey, key_status: str, ts_key: dict, user_email: Optional[str],
+             machine_hostname: Optional[str], permissions: dict) -> dict:
+    return {
+        "id": key.id,
+        "ts_key_id": key.ts_key_id or "",
+        "description": key.description or "",
+        "key": None,
+        "key_masked": key.key_masked or key.masked or "Unknown",
+        "status": key_status,
+        "expires_at": key.expires_at.isoformat() if hasattr(key.expires_at, 'isoformat') else str(key.expires_at),
+        "uses": key.uses or 0,
+        "max_uses": ts_key.get("maxUses"),
+        "created_at": key.created_at.isoformat() if hasattr(key.created_at, 'isoformat') else str(key.created_at),
+        "tags": json.loads(key.tags) if key.tags and isinstance(key.tags, str) else (key.tags or []),
+        "reusable": key.reusable,
+        "ephemeral": key.ephemeral,
+        "preauthorized": key.preauthorized,
+        "user_email": user_email,
+        "machine_hostname": machine_hostname,
+        "permissions": permissions
+    }
+
 @router.get("", response_model=List[AuthKeyResponse])
 async def list_auth_keys(
     db: Session = Depends(get_db),
     status: Optional[str] = Query(None, description="Filter by status: active, expired, revoked"),
     user_id: Optional[str] = Query(None, description="Filter by user ID"),
     machine_id: Optional[str] = Query(None, description="Filter by machine ID"),
-    include_inactive: bool = Query(False, description="Include inactive keys")
+    include_inactive: bool = Query(False, description="Include inactive keys"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="ndjson streams one key per line (permissions are not fetched)")
 ):
     """Get all auth keys with optional filtering"""
     try:
-        # Get keys from database
-        query = db.query(AuthKey)
+        conditions = []
         
         # Apply include_inactive filter
         if not include_inactive:
             # Only show active keys (not revoked and not expired)
-            query = query.filter(AuthKey.revoked == False)
+            conditions.append(AuthKey.revoked == False)
         # If include_inactive is True, show all keys including revoked and expired
         
         if user_id:
-            query = query.filter(AuthKey.user_id == user_id)
+            conditions.append(AuthKey.user_id == user_id)
         
         if machine_id:
-            query = query.filter(AuthKey.machine_id == machine_id)
-        
-        db_keys = query.all()
-        logger.info(f"Found {len(db_keys)} keys in database")
+            conditions.append(AuthKey.machine_id == machine_id)
         
         # Try to sync with Tailscale if possible
         ts_keys = []
@@ -96,39 +140,40 @@ async def list_auth_keys(
             ts_keys = []
         
         ts_key_map = {k["id"]: k for k in ts_keys}
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+
+        if format == "ndjson":
+            # Owner and machine come from the same cursor; per-key permission lookups would stall the stream
+            stmt = (
+                select(AuthKey, User.email, Machine.hostname)
+                .outerjoin(User, User.id == AuthKey.user_id)
+                .outerjoin(Machine, Machine.id == AuthKey.machine_id)
+                .where(*conditions)
+                .order_by(AuthKey.created_at, AuthKey.id)
+            )
+
+            def to_dict(row):
+                key, user_email, machine_hostname = row
+                key_status = _key_status(key, now)
+                if status and key_status != status:
+                    return None
+                return _key_row(key, key_status, ts_key_map.get(key.ts_key_id, {}), user_email, machine_hostname, {})
+
+            return ndjson_response(stream_rows(stmt, to_dict))
+
+        db_keys = db.query(AuthKey).filter(*conditions).all()
+        logger.info(f"Found {len(db_keys)} keys in database")
+
+        # Owner emails and machine hostnames for all keys in two queries instead of two per key
+        user_ids = {k.user_id for k in db_keys if k.user_id}
+        machine_ids = {k.machine_id for k in db_keys if k.machine_id}
+        user_emails = dict(db.query(User.id, User.email).filter(User.id.in_(user_ids)).all()) if user_ids else {}
+        machine_hostnames = dict(db.query(Machine.id, Machine.hostname).filter(Machine.id.in_(machine_ids)).all()) if machine_ids else {}
         
         key_list = []
         for key in db_keys:
             try:
-                # Get user and machine info
-                user = db.query(User).filter(User.id == key.user_id).first() if key.user_id else None
-                machine = db.query(Machine).filter(Machine.id == key.machine_id).first() if key.machine_id else None
-                
-                # Determine status
-                now = datetime.utcnow().replace(tzinfo=timezone.utc)
-                expires_at = key.expires_at
-                
-                # Handle different datetime formats
-                if isinstance(expires_at, str):
-                    try:
-                        expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-                    except ValueError:
-                        # Fallback for other date formats
-                        expires_at = datetime.fromisoformat(expires_at)
-                elif expires_at and hasattr(expires_at, 'tzinfo') and expires_at.tzinfo is None:
-                    # If datetime is naive, assume UTC
-                    expires_at = expires_at.replace(tzinfo=timezone.utc)
-                
-                # Ensure expires_at has timezone info
-                if expires_at and hasattr(expires_at, 'tzinfo') and expires_at.tzinfo is None:
-                    expires_at = expires_at.replace(tzinfo=timezone.utc)
-                
-                if key.revoked:
-                    key_status = "revoked"
-                elif expires_at and expires_at < now:
-                    key_status = "expired"
-                else:
-                    key_status = "active"
+                key_status = _key_status(key, now)
                 
                 # Apply status filter if specified
                 if status and key_status != status:
@@ -143,35 +188,30 @@ async def list_auth_keys(
                         logger.warning(f"Failed to get permissions for key {key.ts_key_id}: {e}")
                         permissions = {}
                 
-                key_list.append(AuthKeyResponse(
-                    id=key.id,
-                    ts_key_id=key.ts_key_id or "",
-                    description=key.description or "",
-                    key_masked=key.key_masked or key.masked or "Unknown",
-                    status=key_status,
-                    expires_at=key.expires_at.isoformat() if hasattr(key.expires_at, 'isoformat') else str(key.expires_at),
-                    uses=key.uses or 0,
-                    max_uses=ts_key_map.get(key.ts_key_id, {}).get("maxUses"),
-                    created_at=key.created_at.isoformat() if hasattr(key.created_at, 'isoformat') else str(key.created_at),
-                    tags=json.loads(key.tags) if key.tags and isinstance(key.tags, str) else (key.tags or []),
-                    reusable=key.reusable,
-                    ephemeral=key.ephemeral,
-                    preauthorized=key.preauthorized,
-                    user_email=user.email if user else None,
-                    machine_hostname=machine.hostname if machine else None,
-                    permissions=permissions
+                key_list.append(_key_row(
+                    key, key_status, ts_key_map.get(key.ts_key_id, {}),
+                    user_emails.get(key.user_id), machine_hostnames.get(key.machine_id), permissions
                 ))
             except Exception as e:
                 logger.error(f"Error processing key {key.id}: {e}")
                 continue
         
         logger.info(f"Returning {len(key_list)} filtered keys")
-        return key_list
+        return fast_json(key_list)
         
     except Exception as e:
         logger.error(f"Failed to list auth keys: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to list auth keys: {str(e)}")
 
+@router.get("/changes")
+async def key_changes(
+    since: int = Query(0, ge=0, description="Cursor from the previous response (0 = from the beginning)"),
+    limit: int = Query(1000, ge=1, le=CHANGES_PAGE_MAX),
+    db: Session = Depends(get_db)
+):
+    """Keys created, updated or deleted after `since` (delta sync)"""
+    return fast_json(changes_since(db, "keys", since, limit))
+
 @router.get("/stats", response_model=AuthKeyStats)
 async def get_auth_key_stats(db: Session = Depends(get_db)):
     """Get comprehensive statistics about auth keys"""
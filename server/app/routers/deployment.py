@@ -1,9 +1,18 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 from typing import List, Optional
 import asyncio
 import json
+import orjson
 from datetime import datetime
+from ..db import get_db, SessionLocal
+from ..models import Deployment, DeploymentTarget
+from ..services.deployments import create_deployment, deployment_workers, events_since, public_config, topic
+from ..websockets import notification_manager
+from .live import KEEPALIVE_SEC, RECONNECT_MS, sse
 
 router = APIRouter()
 
@@ -27,13 +36,16 @@ class BulkDeploymentRequest(BaseModel):
     devices: List[str]  # hostnames
     config: DeploymentConfig
 
-# In-memory storage - replace with database
-deployments_db = []
+REPLAY_PAGE = 1000
+
+def _recent_deployments(db: Session, limit: int) -> list:
+    rows = db.scalars(select(Deployment).order_by(Deployment.started_at.desc()).limit(limit))
+    return [d.to_dict() for d in rows]
 
 @router.get("/")
-async def get_deployments():
+async def get_deployments(limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
     """Get all deployments"""
-    return deployments_db
+    return _recent_deployments(db, limit)
 
 @router.get("/discover-devices")
 async def discover_windows_devices():
@@ -174,71 +186,167 @@ try {{
     }
 
 @router.post("/deploy-bulk")
-async def deploy_bulk(request: BulkDeploymentRequest, background_tasks: BackgroundTasks):
+async def deploy_bulk(request: BulkDeploymentRequest, db: Session = Depends(get_db)):
     """Deploy Tailscale to multiple Windows devices"""
+    deployment = create_deployment(db, request.devices, request.config.dict())
+    db.commit()
     
-    deployment_id = f"deploy-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-    
-    deployment = {
-        "id": deployment_id,
-        "devices": request.devices,
-        "config": request.config.dict(),
-        "status": "started",
-        "started_at": datetime.now().isoformat(),
-        "results": []
-    }
-    
-    deployments_db.append(deployment)
-    
-    # Start background deployment task
-    background_tasks.add_task(execute_bulk_deployment, deployment_id, request)
+    # Start background deployment (the worker pool picks the targets up from the database)
+    deployment_workers.notify()
     
     return {
-        "deployment_id": deployment_id,
-        "status": "started",
-        "message": f"Bulk deployment started for {len(request.devices)} devices"
+        "deployment_id": deployment.id,
+        "status": deployment.status,
+        "message": f"Bulk deployment started for {deployment.total} devices"
     }
 
-async def execute_bulk_deployment(deployment_id: str, request: BulkDeploymentRequest):
-    """Background task to execute deployment"""
-    deployment = next((d for d in deployments_db if d["id"] == deployment_id), None)
-    if not deployment:
-        return
-    
-    for device in request.devices:
-        try:
-            # Simulate deployment process
-            await asyncio.sleep(2)  # Simulate installation time
-            
-            result = {
-                "device": device,
-                "status": "success",
-                "message": "Deployment completed successfully",
-                "completed_at": datetime.now().isoformat()
-            }
-            
-        except Exception as e:
-            result = {
-                "device": device,
-                "status": "failed", 
-                "message": f"Deployment failed: {str(e)}",
-                "completed_at": datetime.now().isoformat()
-            }
-        
-        deployment["results"].append(result)
-    
-    deployment["status"] = "completed"
-    deployment["completed_at"] = datetime.now().isoformat()
-
 @router.get("/deployments")
-async def get_deployments():
+async def get_deployment_history(limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
     """Get all deployment history"""
-    return deployments_db
+    return _recent_deployments(db, limit)
 
 @router.get("/deployments/{deployment_id}")
-async def get_deployment_status(deployment_id: str):
-    """Get specific deployment status"""
-    deployment = next((d for d in deployments_db if d["id"] == deployment_id), None)
+async def get_deployment_status(deployment_id: str, db: Session = Depends(get_db)):
+    """Get specific deployment status (counters only; per-device results via /results)"""
+    deployment = db.get(Deployment, deployment_id)
     if not deployment:
         raise HTTPException(status_code=404, detail="Deployment not found")
-    return deployment
\ No newline at end of file
+    return {**deployment.to_dict(), "config": public_config(deployment.config)}
+
+@router.get("/deployments/{deployment_id}/results")
+async def get_deployment_results(
+    deployment_id: str,
+    status: Optional[str] = Query(None, pattern="^(queued|running|success|failed)$"),
+    after: int = Query(0, ge=0, description="Cursor from the previous page"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """Per-device results of a deployment, in queue order"""
+    if not db.get(Deployment, deployment_id):
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    query = select(DeploymentTarget).where(DeploymentTarget.deployment_id == deployment_id, DeploymentTarget.id > after)
+    if status:
+        query = query.where(DeploymentTarget.status == status)
+    targets = db.scalars(query.order_by(DeploymentTarget.id).limit(limit)).all()
+    return {
+        "deployment_id": deployment_id,
+        "results": [t.to_dict() for t in targets],
+        "cursor": targets[-1].id if targets else after,
+        "has_more": len(targets) == limit,
+    }
+
+@router.get("/deployments/{deployment_id}/events")
+async def get_deployment_events(
+    deployment_id: str,
+    since: int = Query(0, ge=0, description="Last seq already seen"),
+    limit: int = Query(REPLAY_PAGE, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """Progress events after `since` (replay for clients resuming a `deployment:{id}` subscription)"""
+    if not db.get(Deployment, deployment_id):
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    events = [orjson.loads(data) for data in events_since(db, deployment_id, since, limit)]
+    return {
+        "deployment_id": deployment_id,
+        "events": events,
+        "seq": events[-1]["seq"] if events else since,
+        "has_more": len(events) == limit,
+    }
+
+def _replay_page(deployment_id: str, since: int) -> list[str]:
+    db = SessionLocal()
+    try:
+        return events_since(db, deployment_id, since, REPLAY_PAGE)
+    finally:
+        db.close()
+
+def _progress_frame(seq: int, data: bytes) -> bytes:
+    return f"id: {seq}\n".encode() + sse(data, "progress")
+
+async def _catch_up(deployment_id: str, since: int) -> tuple[list, int, bool]:
+    """Stored events after `since` as frames (one per page); returns (frames, last seq, finished)"""
+    frames, last, finished = [], since, False
+    while True:
+        page = await asyncio.to_thread(_replay_page, deployment_id, last)
+        if not page:
+            break
+        tail = orjson.loads(page[-1])
+        last, finished = tail["seq"], tail.get("t") == "status"
+        # Stored events are already JSON: spliced in without re-encoding
+        data = (b'{"type":"deployment_progress","deployment_id":' + orjson.dumps(deployment_id)
+                + b',"events":[' + ",".join(page).encode() + b"]}")
+        frames.append(_progress_frame(last, data))
+        if len(page) < REPLAY_PAGE:
+            break
+    return frames, last, finished
+
+async def _progress_events(request: Request, client, deployment_id: str, snapshot: dict, since: int):
+    try:
+        yield f"retry: {RECONNECT_MS}\n\n".encode()
+        yield sse(orjson.dumps(snapshot), "snapshot")
+        frames, last, finished = await _catch_up(deployment_id, since)
+        for frame in frames:
+            yield frame
+        if finished or (snapshot["status"] == "completed" and last >= snapshot["seq"]):
+            return
+
+        while True:
+            try:
+                payload = await asyncio.wait_for(client.next(), KEEPALIVE_SEC)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield b": keepalive\n\n"
+                continue
+            if client.dropped:
+                return  # lagged and lost events: the browser reconnects with Last-Event-ID and replays
+            message = orjson.loads(payload)
+            events = [e for e in message.get("events", ()) if e["seq"] > last]
+            if not events:
+                continue  # heartbeat or already replayed
+            if events[0]["seq"] != last + 1:
+                # Published out of order (another worker): the database has everything up to here
+                frames, last, finished = await _catch_up(deployment_id, last)
+                for frame in frames:
+                    yield frame
+            else:
+                message["events"] = events
+                last, finished = events[-1]["seq"], events[-1].get("t") == "status"
+                yield _progress_frame(last, orjson.dumps(message))
+            if finished:
+                return
+    except ConnectionError:
+        return  # evicted as a slow consumer
+    finally:
+        notification_manager.close_stream(client)
+
+@router.get("/deployments/{deployment_id}/stream")
+async def stream_deployment(
+    deployment_id: str,
+    request: Request,
+    since: Optional[int] = Query(None, ge=0, description="Last seq already seen (default: Last-Event-ID, else 0)"),
+    last_event_id: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Server-Sent Events: a `snapshot` with the counters, then `progress` events (device transitions,
+    output lines, completion), each batch tagged with its last seq so a reconnect resumes where it left off"""
+    if since is None:
+        since = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    # Subscribe before reading so nothing falls in between; overlap with the replay is skipped by seq
+    client = notification_manager.open_stream([topic(deployment_id)])
+    try:
+        deployment = db.get(Deployment, deployment_id)
+    except Exception:
+        notification_manager.close_stream(client)
+        raise
+    if not deployment:
+        notification_manager.close_stream(client)
+        raise HTTPException(status_code=404, detail="Deployment not found")
+
+    return StreamingResponse(
+        _progress_events(request, client, deployment_id, deployment.to_dict(), since),
+        media_type="text/event-stream",
+        # identity keeps the compression middleware from buffering the stream
+        headers={"Cache-Control": "no-cache", "Content-Encoding": "identity", "X-Accel-Buffering": "no"},
+    )
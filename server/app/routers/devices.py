@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 from ..db import get_db
-from ..models import Machine, User
+from ..models import Machine, User, Device
 from ..tailscale import list_devices
-from ..websockets import notification_manager
+from ..services.changelog import CHANGES_PAGE_MAX, changes_since
+from ..services.device_sync import REMOVED
+from ..utils.http_cache import conditional, etag_for
+from ..utils.responses import fast_json
+from ..utils.streaming import ndjson_response, stream_rows
 from pydantic import BaseModel
 from datetime import datetime
+from itertools import chain
 
 router = APIRouter()
 
@@ -14,92 +20,145 @@ class MachineCreate(BaseModel):
     hostname: str
     ts_device_id: str | None = None
 
+def _machine_row(machine: Machine, email: str | None) -> dict:
+    return {
+        "id": machine.id,
+        "hostname": machine.hostname,
+        "ts_device_id": machine.ts_device_id,
+        "user_email": email,
+        "user_id": machine.user_id,
+        "created_at": machine.created_at.isoformat() if machine.created_at else None,
+        "status": "active"  # Default status for database machines
+    }
+
+def _ts_row(ts_device: dict) -> dict:
+    return {
+        "id": ts_device["id"],
+        "hostname": ts_device["hostname"],
+        "ts_device_id": ts_device["id"],
+        "user_email": None,
+        "user_id": None,
+        "created_at": None,
+        "status": ts_device["status"]
+    }
+
+def _machines_stmt():
+    return select(Machine, User.email).outerjoin(User, User.id == Machine.user_id)
+
+def _db_devices(db: Session) -> list:
+    return [_machine_row(machine, email) for machine, email in db.execute(_machines_stmt()).all()]
+
+def _list_version(db: Session) -> tuple:
+    """Data version of the device list: machines plus the Tailscale device mirror"""
+    row = db.execute(select(
+        select(func.count(Machine.id)).scalar_subquery(),
+        select(func.max(Machine.created_at)).scalar_subquery(),
+        select(func.count(Device.id)).scalar_subquery(),
+        select(func.max(Device.updated_at)).scalar_subquery(),
+    )).one()
+    return tuple(row)
+
+async def _tailscale_devices(db: Session, mirrored: bool) -> list:
+    """Tailscale devices from the synced mirror, or live from the API before the first sync"""
+    if mirrored:
+        return [
+            {"id": d.ts_device_id, "hostname": d.hostname or "Unknown", "status": d.status}
+            for d in db.query(Device).filter(Device.status != REMOVED).all()
+        ]
+    ts_response = await list_devices()
+    if isinstance(ts_response, dict) and "devices" in ts_response:
+        ts_devices = ts_response["devices"]
+    elif isinstance(ts_response, list):
+        ts_devices = ts_response
+    else:
+        ts_devices = []
+    return [
+        {"id": d.get("id"), "hostname": d.get("hostname", "Unknown"),
+         "status": "online" if d.get("lastSeen") else "offline"}
+        for d in ts_devices
+    ]
+
+async def _stream_devices(db: Session, mirrored: bool):
+    """Machines, then Tailscale devices that are not registered machines, one per line"""
+    rows = stream_rows(_machines_stmt().order_by(Machine.created_at, Machine.id), lambda row: _machine_row(*row))
+    if mirrored:
+        registered = select(Machine.ts_device_id).where(Machine.ts_device_id.isnot(None))
+        unregistered = stream_rows(
+            select(Device)
+            .where(Device.ts_device_id.not_in(registered), Device.status != REMOVED)
+            .order_by(Device.created_at, Device.id),
+            lambda row: _ts_row({"id": row[0].ts_device_id, "hostname": row[0].hostname or "Unknown", "status": row[0].status})
+        )
+    else:
+        # Not synced yet: the live API response is already in memory, only the machine ids are needed to dedupe
+        try:
+            ts_devices = await _tailscale_devices(db, mirrored)
+        except Exception as e:
+            print(f"Warning: Failed to get devices from Tailscale: {e}")
+            ts_devices = []
+        known_ids = {ts_id for (ts_id,) in db.execute(select(Machine.ts_device_id).where(Machine.ts_device_id.isnot(None)))}
+        unregistered = (_ts_row(d) for d in ts_devices if d["id"] not in known_ids)
+    return ndjson_response(chain(rows, unregistered))
+
 @router.get("")
-async def devices(db: Session = Depends(get_db)):
+async def devices(
+    request: Request,
+    response: Response,
+    format: str = Query("json", pattern="^(json|ndjson)$", description="ndjson streams one device per line"),
+    db: Session = Depends(get_db)
+):
     """Get devices from both database and Tailscale"""
     try:
+        version = _list_version(db)
+        mirrored = version[2] > 0
+        if format == "ndjson":
+            return await _stream_devices(db, mirrored)
+        if mirrored:
+            not_modified = conditional(request, response, etag_for("devices", *version))
+            if not_modified is not None:
+                return not_modified
+
         # Get devices from database first
-        db_machines = db.query(Machine).all()
-        db_devices = []
-        
-        for machine in db_machines:
-            user = db.query(User).filter(User.id == machine.user_id).first()
-            db_devices.append({
-                "id": machine.id,
-                "hostname": machine.hostname,
-                "ts_device_id": machine.ts_device_id,
-                "user_email": user.email if user else None,
-                "user_id": machine.user_id,
-                "created_at": machine.created_at.isoformat() if machine.created_at else None,
-                "status": "active"  # Default status for database machines
-            })
+        db_devices = _db_devices(db)
         
-        # Try to get devices from Tailscale API
-        ts_devices = []
+        # Tailscale devices (mirror, or live API until the first sync)
         try:
-            ts_response = await list_devices()
-            if isinstance(ts_response, dict) and "devices" in ts_response:
-                ts_devices = ts_response["devices"]
-            elif isinstance(ts_response, list):
-                ts_devices = ts_response
-            else:
-                ts_devices = []
+            ts_devices = await _tailscale_devices(db, mirrored)
         except Exception as e:
             print(f"Warning: Failed to get devices from Tailscale: {e}")
             ts_devices = []
         
         # Combine and deduplicate devices
         all_devices = db_devices.copy()
+        known_ids = {d["ts_device_id"] for d in db_devices}
         
         # Add Tailscale devices that aren't in database
         for ts_device in ts_devices:
-            if not any(d["ts_device_id"] == ts_device.get("id") for d in all_devices):
-                all_devices.append({
-                    "id": ts_device.get("id"),
-                    "hostname": ts_device.get("hostname", "Unknown"),
-                    "ts_device_id": ts_device.get("id"),
-                    "user_email": None,
-                    "user_id": None,
-                    "created_at": None,
-                    "status": "online" if ts_device.get("lastSeen") else "offline"
-                })
+            if ts_device["id"] not in known_ids:
+                all_devices.append(_ts_row(ts_device))
         
-        # Send notification about device status
-        try:
-            await notification_manager.broadcast_notification({
-                "type": "device_status_update",
-                "message": f"Device list updated - {len(all_devices)} devices total",
-                "data": {"device_count": len(all_devices)}
-            })
-        except Exception as e:
-            print(f"Warning: Failed to send notification: {e}")
-        
-        return {"devices": all_devices, "total": len(all_devices)}
+        return fast_json({"devices": all_devices, "total": len(all_devices)}, response)
         
     except Exception as e:
         print(f"Error in devices endpoint: {e}")
         # Return database devices only if Tailscale fails
         try:
-            db_machines = db.query(Machine).all()
-            db_devices = []
-            
-            for machine in db_machines:
-                user = db.query(User).filter(User.id == machine.user_id).first()
-                db_devices.append({
-                    "id": machine.id,
-                    "hostname": machine.hostname,
-                    "ts_device_id": machine.ts_device_id,
-                    "user_email": user.email if user else None,
-                    "user_id": machine.user_id,
-                    "created_at": machine.created_at.isoformat() if machine.created_at else None,
-                    "status": "active"
-                })
-            
+            db_devices = _db_devices(db)
             return {"devices": db_devices, "total": len(db_devices)}
         except Exception as db_error:
             print(f"Database error: {db_error}")
             raise HTTPException(status_code=500, detail=f"Failed to get devices: {str(e)}")
 
+@router.get("/changes")
+async def device_changes(
+    entity: str = Query("devices", pattern="^(devices|machines)$", description="Tailscale device mirror or registered machines"),
+    since: int = Query(0, ge=0, description="Cursor from the previous response (0 = from the beginning)"),
+    limit: int = Query(1000, ge=1, le=CHANGES_PAGE_MAX),
+    db: Session = Depends(get_db)
+):
+    """Devices or machines created, updated or removed after `since` (delta sync)"""
+    return fast_json(changes_since(db, entity, since, limit))
+
 @router.post("")
 async def create_machine(machine_data: MachineCreate, db: Session = Depends(get_db)):
     """Create new machine for user"""
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Optional
+from ..db import get_db
+from ..models import Event
+from ..utils.responses import fast_json
+from ..utils.streaming import ndjson_response, stream_rows
+
+router = APIRouter()
+
+@router.get("")
+async def list_events(
+    type: Optional[str] = Query(None, description="Filter by event type"),
+    before_id: Optional[int] = Query(None, description="Only events older than this id (JSON paging)"),
+    limit: int = Query(100, ge=1, le=1000, description="Page size (JSON only)"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="ndjson streams the whole log, oldest first"),
+    db: Session = Depends(get_db)
+):
+    """Get the event log (newest first), or stream all of it as NDJSON"""
+    stmt = select(Event)
+    if type:
+        stmt = stmt.where(Event.type == type)
+
+    if format == "ndjson":
+        return ndjson_response(stream_rows(stmt.order_by(Event.id), lambda row: row[0].to_dict()))
+
+    if before_id is not None:
+        stmt = stmt.where(Event.id < before_id)
+    events = db.execute(stmt.order_by(Event.id.desc()).limit(limit)).scalars().all()
+    return fast_json({
+        "events": [e.to_dict() for e in events],
+        "next_before_id": events[-1].id if len(events) == limit else None
+    })
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+import asyncio
+import orjson
+
+from ..db import get_db
+from ..models import AuthKey, Machine, PortForward, DeploymentLog, Device
+from ..services.device_sync import REMOVED, device_view
+from ..websockets import notification_manager
+
+router = APIRouter()
+
+KEEPALIVE_SEC = 15
+RECONNECT_MS = 5000
+
+def _snapshot(db: Session, entity: str) -> list:
+    if entity == "devices":
+        return [device_view(d) for d in db.query(Device).filter(Device.status != REMOVED).all()]
+    return [row.to_dict() for row in db.query(SNAPSHOT_MODELS[entity]).all()]
+
+SNAPSHOT_MODELS = {
+    "keys": AuthKey,
+    "machines": Machine,
+    "port_forwards": PortForward,
+    "deployments": DeploymentLog,
+}
+ENTITIES = ("devices", *SNAPSHOT_MODELS)
+
+def sse(data: bytes, event: str | None = None) -> bytes:
+    """One server-sent event frame"""
+    head = f"event: {event}\n".encode() if event else b""
+    return head + b"data: " + data + b"\n\n"
+
+async def _events(request: Request, client, snapshot: dict):
+    try:
+        yield f"retry: {RECONNECT_MS}\n\n".encode()
+        for entity, items in snapshot.items():
+            yield sse(orjson.dumps({"entity": entity, "items": items}), "snapshot")
+        snapshot.clear()
+
+        while True:
+            try:
+                payload = await asyncio.wait_for(client.next(), KEEPALIVE_SEC)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield b": keepalive\n\n"
+                continue
+            if client.dropped:
+                # Deltas were lost while the client lagged: end the stream so the browser
+                # reconnects and starts again from a fresh snapshot
+                return
+            # Deltas are forwarded exactly as published (serialized once by the manager)
+            yield sse(payload.encode())
+    except ConnectionError:
+        return  # evicted as a slow consumer
+    finally:
+        notification_manager.close_stream(client)
+
+@router.get("")
+async def live_feed(
+    request: Request,
+    entities: str = Query(",".join(ENTITIES), description=f"Comma-separated entities: {', '.join(ENTITIES)}"),
+    db: Session = Depends(get_db)
+):
+    """Server-Sent Events: one `snapshot` event per entity, then device_delta / entity_delta messages"""
+    selected = [e.strip() for e in entities.split(",") if e.strip()]
+    unknown = [e for e in selected if e not in ENTITIES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown entities: {', '.join(unknown)}")
+
+    # Subscribe before reading the snapshot so no change falls in between; replaying a delta
+    # that the snapshot already contains is harmless
+    client = notification_manager.open_stream(selected)
+    try:
+        snapshot = {entity: _snapshot(db, entity) for entity in selected}
+    except Exception:
+        notification_manager.close_stream(client)
+        raise
+
+    return StreamingResponse(
+        _events(request, client, snapshot),
+        media_type="text/event-stream",
+        # identity keeps the compression middleware from buffering the stream
+        headers={"Cache-Control": "no-cache", "Content-Encoding": "identity", "X-Accel-Buffering": "no"},
+    )
@@ -1,35 +1,71 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List
+import time
 from ..db import get_db
 from ..models import User, Machine, PortForward, Event
-from ..schemas import CreatePortForwardReq, PortForwardOut, UpdatePortForwardReq
-from ..services.portforward import PortForwardManager
+from ..schemas import BulkCreatePortForwardReq, CreatePortForwardReq, PortForwardOut, UpdatePortForwardReq
+from ..services.portforward import Forward, PortForwardManager, reconcile_port_forwards
+from ..services.changelog import CHANGES_PAGE_MAX, changes_since
+from ..services.ports import port_index
+from ..services.probe import probe_scheduler
+from ..services.traffic import FIELDS as TRAFFIC_FIELDS, traffic_collector
+from ..config import settings
 from ..utils.logging import get_logger
+from ..utils.http_cache import conditional, etag_for
+from ..utils.responses import fast_json, json_datetime
 
 router = APIRouter()
 log = get_logger(__name__)
 
 @router.get("", response_model=List[PortForwardOut])
-async def list_port_forwards(db: Session = Depends(get_db)):
+async def list_port_forwards(request: Request, response: Response, db: Session = Depends(get_db)):
     """List all port forwarding rules"""
+    version = db.execute(select(func.count(PortForward.id), func.max(PortForward.updated_at))).one()
+    not_modified = conditional(request, response, etag_for("port-forwards", *version))
+    if not_modified is not None:
+        return not_modified
+
     forwards = db.query(PortForward).all()
-    return [
-        PortForwardOut(
-            id=pf.id,
-            name=pf.name,
-            source_port=pf.source_port,
-            target_host=pf.target_host,
-            target_port=pf.target_port,
-            protocol=pf.protocol,
-            active=pf.active,
-            description=pf.description,
-            created_at=pf.created_at,
-            user_id=pf.user_id,
-            machine_id=pf.machine_id
-        )
+    return fast_json([
+        {
+            "id": pf.id,
+            "name": pf.name,
+            "source_port": pf.source_port,
+            "target_host": pf.target_host,
+            "target_port": pf.target_port,
+            "protocol": pf.protocol,
+            "active": pf.active,
+            "description": pf.description,
+            "created_at": json_datetime(pf.created_at),
+            "user_id": pf.user_id,
+            "machine_id": pf.machine_id
+        }
         for pf in forwards
-    ]
+    ], response)
+
+def _owners(db: Session, forwards: list) -> list:
+    """Active forwards holding the (protocol, port) of any of `forwards`"""
+    keys = {(fw.protocol, fw.source_port) for fw in forwards}
+    rows = db.scalars(select(PortForward).where(
+        PortForward.active == True, PortForward.source_port.in_({port for _, port in keys})))
+    return [Forward(pf.source_port, pf.target_host, pf.target_port, pf.protocol)
+            for pf in rows if (pf.protocol, pf.source_port) in keys]
+
+async def _commit_claim(db: Session, port_forward: PortForward):
+    """Commit a change that makes `port_forward` active. If another worker claimed the port in the
+    meantime (unique index), withdraw our kernel rule and report the conflict; the port stays marked taken."""
+    fw = Forward(port_forward.source_port, port_forward.target_host, port_forward.target_port, port_forward.protocol)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        await PortForwardManager.withdraw([fw], _owners(db, [fw]))
+        raise HTTPException(400, f"Port {fw.source_port} ({fw.protocol}) is already in use")
+    finally:
+        port_index.settle([(fw.protocol, fw.source_port)])
 
 @router.post("", response_model=PortForwardOut)
 async def create_port_forward(body: CreatePortForwardReq, db: Session = Depends(get_db)):
@@ -46,14 +82,14 @@ async def create_port_forward(body: CreatePortForwardReq, db: Session = Depends(
         if not machine:
             raise HTTPException(404, "Machine not found")
     
-    # Check if source port is already in use
-    existing = db.query(PortForward).filter(
-        PortForward.source_port == body.source_port,
-        PortForward.protocol == body.protocol,
-        PortForward.active == True
-    ).first()
-    
-    if existing:
+    # Reject rules the backend cannot express before touching the port index or the kernel
+    reason = PortForwardManager.invalid_reason(
+        Forward(body.source_port, body.target_host, body.target_port, body.protocol))
+    if reason is not None:
+        raise HTTPException(400, reason)
+
+    # Claim the source port (released again if anything below fails)
+    if not port_index.claim(db, body.protocol, body.source_port):
         raise HTTPException(400, f"Port {body.source_port} ({body.protocol}) is already in use")
     
     # Create the port forward rule in the system
@@ -65,6 +101,7 @@ async def create_port_forward(body: CreatePortForwardReq, db: Session = Depends(
     )
     
     if not success:
+        port_index.release(body.protocol, body.source_port)
         raise HTTPException(500, "Failed to create port forwarding rule in system")
     
     # Create database record
@@ -91,7 +128,7 @@ async def create_port_forward(body: CreatePortForwardReq, db: Session = Depends(
     )
     db.add(event)
     
-    db.commit()
+    await _commit_claim(db, port_forward)
     db.refresh(port_forward)
     
     log.info(f"Created port forward: {port_forward.name} ({port_forward.id})")
@@ -110,6 +147,139 @@ async def create_port_forward(body: CreatePortForwardReq, db: Session = Depends(
         machine_id=port_forward.machine_id
     )
 
+@router.post("/bulk")
+async def bulk_create_port_forwards(body: BulkCreatePortForwardReq, db: Session = Depends(get_db)):
+    """Create many port forwarding rules at once.
+
+    Items are validated in one pass (owners, machines, rule syntax, port index), the valid ones are
+    installed in a single ruleset batch and inserted in one statement. Invalid items are reported
+    per item and do not affect the others.
+    """
+    items = body.items
+    user_ids = {item.user_id for item in items}
+    machine_ids = {item.machine_id for item in items if item.machine_id}
+    known_users = set(db.scalars(select(User.id).where(User.id.in_(user_ids))))
+    known_machines = set(db.scalars(select(Machine.id).where(Machine.id.in_(machine_ids)))) if machine_ids else set()
+
+    results: list[dict] = [{"index": i, "ok": False} for i in range(len(items))]
+    candidates = []
+    for i, item in enumerate(items):
+        fw = Forward(item.source_port, item.target_host, item.target_port, item.protocol)
+        if item.user_id not in known_users:
+            results[i]["error"] = "User not found"
+        elif item.machine_id and item.machine_id not in known_machines:
+            results[i]["error"] = "Machine not found"
+        elif (reason := PortForwardManager.invalid_reason(fw)) is not None:
+            results[i]["error"] = reason
+        else:
+            candidates.append((i, fw))
+
+    # Claim all ports at once; a port repeated within the request goes to its first item
+    granted = port_index.claim_many(db, [(fw.protocol, fw.source_port) for _, fw in candidates])
+    accepted = []
+    for (i, fw), ok in zip(candidates, granted):
+        if ok:
+            accepted.append((i, fw))
+        else:
+            results[i]["error"] = f"Port {fw.source_port} ({fw.protocol}) is already in use"
+
+    forwards = [fw for _, fw in accepted]
+    if accepted:
+        if not await PortForwardManager.apply_changes(add=forwards):
+            for fw in forwards:
+                port_index.release(fw.protocol, fw.source_port)
+            raise HTTPException(500, "Failed to create port forwarding rules in system")
+
+        port_forwards = [
+            PortForward(
+                user_id=items[i].user_id,
+                machine_id=items[i].machine_id,
+                name=items[i].name,
+                source_port=fw.source_port,
+                target_host=fw.target_host,
+                target_port=fw.target_port,
+                protocol=fw.protocol,
+                description=items[i].description,
+                active=True
+            )
+            for i, fw in accepted
+        ]
+        # One flush: the rows go out as a single multi-row INSERT
+        db.add_all(port_forwards)
+        db.add(Event(
+            type="PORT_FORWARD_CREATED",
+            message=f"Bulk created {len(port_forwards)} port forwards"
+        ))
+        claims = [(fw.protocol, fw.source_port) for fw in forwards]
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker took one of the ports since the index was loaded: undo the batch and resync
+            db.rollback()
+            await PortForwardManager.withdraw(forwards, _owners(db, forwards))
+            for protocol, port in claims:
+                port_index.release(protocol, port)
+            port_index.reload(db)
+            raise HTTPException(409, "Some ports were claimed concurrently; retry the request")
+        port_index.settle(claims)
+
+        for (i, _), port_forward in zip(accepted, port_forwards):
+            results[i].update(ok=True, id=port_forward.id)
+
+    created = len(accepted)
+    log.info(f"Bulk created {created} port forwards ({len(items) - created} rejected)")
+    return fast_json({"created": created, "failed": len(items) - created, "results": results})
+
+@router.get("/free-ports")
+async def free_ports(
+    protocol: str = Query("tcp", pattern="^(tcp|udp)$"),
+    count: int = Query(10, ge=1, le=1000),
+    range_size: int = Query(1, ge=1, le=1000, description="Return runs of this many consecutive free ports"),
+    start: int = Query(1024, ge=1, le=65535),
+    end: int = Query(65535, ge=1, le=65535),
+    db: Session = Depends(get_db)
+):
+    """Next free source ports (or ranges of consecutive ports) not held by an active rule"""
+    port_index.ensure_loaded(db)
+    if range_size > 1:
+        ranges = port_index.free_ranges(protocol, range_size, count, start, end)
+        return {"protocol": protocol, "ranges": [list(r) for r in ranges]}
+    return {"protocol": protocol, "ports": port_index.free(protocol, count, start, end)}
+
+@router.get("/changes")
+async def port_forward_changes(
+    since: int = Query(0, ge=0, description="Cursor from the previous response (0 = from the beginning)"),
+    limit: int = Query(1000, ge=1, le=CHANGES_PAGE_MAX),
+    db: Session = Depends(get_db)
+):
+    """Port forwards created, updated or deleted after `since` (delta sync)"""
+    return fast_json(changes_since(db, "port_forwards", since, limit))
+
+@router.get("/traffic")
+async def port_forward_traffic(
+    limit: int = Query(50, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Current per-rule throughput, busiest rules first"""
+    rows = traffic_collector.top(limit)
+    names = dict(db.query(PortForward.id, PortForward.name).filter(PortForward.id.in_([r["id"] for r in rows])).all()) if rows else {}
+    for row in rows:
+        row["name"] = names.get(row["id"])
+    return fast_json({
+        "backend": PortForwardManager.backend.name,
+        "supported": traffic_collector.supported,
+        "interval_sec": settings.TRAFFIC_SAMPLE_INTERVAL_SEC,
+        "rules": rows,
+    })
+
+@router.get("/health")
+async def port_forward_health(status: str | None = Query(None, pattern="^(up|down|no_reply|pending)$")):
+    """Reachability and latency percentiles of every active rule's target (from memory)"""
+    rules = probe_scheduler.all()
+    if status:
+        rules = {id: health for id, health in rules.items() if health["status"] == status}
+    return fast_json({"interval_sec": settings.PROBE_INTERVAL_SEC, "rules": rules})
+
 @router.get("/{id}", response_model=PortForwardOut)
 async def get_port_forward(id: str, db: Session = Depends(get_db)):
     """Get a specific port forwarding rule"""
@@ -131,6 +301,32 @@ async def get_port_forward(id: str, db: Session = Depends(get_db)):
         machine_id=port_forward.machine_id
     )
 
+@router.get("/{id}/traffic")
+async def port_forward_traffic_series(
+    id: str,
+    minutes: int = Query(60, ge=1, le=1440),
+    db: Session = Depends(get_db)
+):
+    """Rate history of one rule: one [timestamp, <fields>...] point per sample"""
+    if not db.get(PortForward, id):
+        raise HTTPException(404, "Port forward not found")
+    since = time.time() - minutes * 60
+    return fast_json({
+        "id": id,
+        "interval_sec": settings.TRAFFIC_SAMPLE_INTERVAL_SEC,
+        "fields": ["at", *(f"{field}_per_sec" for field in TRAFFIC_FIELDS)],
+        "points": traffic_collector.series(id, since),
+        "latest": traffic_collector.latest(id),
+    })
+
+@router.get("/{id}/health")
+async def port_forward_target_health(id: str):
+    """Reachability and latency percentiles of one rule's target"""
+    health = probe_scheduler.health(id)
+    if health is None:
+        raise HTTPException(404, "No probe results for this port forward (unknown or inactive)")
+    return {"id": id, **health}
+
 @router.put("/{id}", response_model=PortForwardOut)
 async def update_port_forward(id: str, body: UpdatePortForwardReq, db: Session = Depends(get_db)):
     """Update a port forwarding rule"""
@@ -153,11 +349,18 @@ async def update_port_forward(id: str, body: UpdatePortForwardReq, db: Session =
         port_forward.description = body.description
     if body.active is not None:
         port_forward.active = body.active
+
+    reason = PortForwardManager.invalid_reason(
+        Forward(port_forward.source_port, port_forward.target_host, port_forward.target_port, port_forward.protocol))
+    if reason is not None:
+        raise HTTPException(400, reason)
     
     # Handle system-level changes
     if body.active is not None and body.active != old_active:
         if body.active:
             # Enable the rule
+            if not port_index.claim(db, port_forward.protocol, port_forward.source_port):
+                raise HTTPException(400, f"Port {port_forward.source_port} ({port_forward.protocol}) is already in use")
             success = await PortForwardManager.enable_port_forward(
                 port_forward.source_port,
                 port_forward.target_host,
@@ -165,6 +368,7 @@ async def update_port_forward(id: str, body: UpdatePortForwardReq, db: Session =
                 port_forward.protocol
             )
             if not success:
+                port_index.release(port_forward.protocol, port_forward.source_port)
                 raise HTTPException(500, "Failed to enable port forwarding rule")
         else:
             # Disable the rule
@@ -176,33 +380,19 @@ async def update_port_forward(id: str, body: UpdatePortForwardReq, db: Session =
             )
             if not success:
                 log.warning(f"Failed to disable port forwarding rule for {port_forward.id}")
+            port_index.release(port_forward.protocol, port_forward.source_port)
     
     # If target changed and rule is active, update the system rule
     elif port_forward.active and (body.target_host is not None or body.target_port is not None):
-        # Remove old rule
-        await PortForwardManager.disable_port_forward(
-            port_forward.source_port,
-            old_target_host,
-            old_target_port,
-            port_forward.protocol
-        )
-        # Add new rule
-        success = await PortForwardManager.enable_port_forward(
-            port_forward.source_port,
-            port_forward.target_host,
-            port_forward.target_port,
-            port_forward.protocol
+        # Swap old rule for new one in a single ruleset transaction
+        success = await PortForwardManager.move_port_forward(
+            Forward(port_forward.source_port, old_target_host, old_target_port, port_forward.protocol),
+            Forward(port_forward.source_port, port_forward.target_host, port_forward.target_port, port_forward.protocol)
         )
         if not success:
             # Rollback changes
             port_forward.target_host = old_target_host
             port_forward.target_port = old_target_port
-            await PortForwardManager.enable_port_forward(
-                port_forward.source_port,
-                old_target_host,
-                old_target_port,
-                port_forward.protocol
-            )
             raise HTTPException(500, "Failed to update port forwarding rule")
     
     # Log event
@@ -214,7 +404,7 @@ async def update_port_forward(id: str, body: UpdatePortForwardReq, db: Session =
     )
     db.add(event)
     
-    db.commit()
+    await _commit_claim(db, port_forward)
     db.refresh(port_forward)
     
     log.info(f"Updated port forward: {port_forward.name} ({port_forward.id})")
@@ -261,8 +451,11 @@ async def delete_port_forward(id: str, db: Session = Depends(get_db)):
     db.add(event)
     
     # Delete from database
+    was_active = port_forward.active
     db.delete(port_forward)
     db.commit()
+    if was_active:
+        port_index.release(port_forward.protocol, port_forward.source_port)
     
     log.info(f"Deleted port forward: {port_forward.name} ({id})")
     
@@ -279,6 +472,8 @@ async def toggle_port_forward(id: str, db: Session = Depends(get_db)):
     
     if new_state:
         # Enable the rule
+        if not port_index.claim(db, port_forward.protocol, port_forward.source_port):
+            raise HTTPException(400, f"Port {port_forward.source_port} ({port_forward.protocol}) is already in use")
         success = await PortForwardManager.enable_port_forward(
             port_forward.source_port,
             port_forward.target_host,
@@ -296,6 +491,8 @@ async def toggle_port_forward(id: str, db: Session = Depends(get_db)):
     
     if not success:
         action = "enable" if new_state else "disable"
+        if new_state:
+            port_index.release(port_forward.protocol, port_forward.source_port)
         raise HTTPException(500, f"Failed to {action} port forwarding rule")
     
     port_forward.active = new_state
@@ -309,7 +506,11 @@ async def toggle_port_forward(id: str, db: Session = Depends(get_db)):
     )
     db.add(event)
     
-    db.commit()
+    if new_state:
+        await _commit_claim(db, port_forward)
+    else:
+        db.commit()
+        port_index.release(port_forward.protocol, port_forward.source_port)
     
     log.info(f"{'Enabled' if new_state else 'Disabled'} port forward: {port_forward.name} ({id})")
     
@@ -322,7 +523,32 @@ async def get_system_status():
     active_rules = await PortForwardManager.list_port_forwards()
     
     return {
+        "backend": PortForwardManager.backend.name,
         "iptables_available": iptables_available,
         "active_system_rules": len(active_rules),
         "system_rules": active_rules
     }
+
+@router.post("/system/apply")
+async def apply_system_rules(db: Session = Depends(get_db)):
+    """Rewrite the kernel port-forward rules from the active rows in one atomic batch"""
+    forwards = [
+        Forward(pf.source_port, pf.target_host, pf.target_port, pf.protocol)
+        for pf in db.query(PortForward).filter(PortForward.active == True).all()
+    ]
+    if not await PortForwardManager.replace_all(forwards):
+        raise HTTPException(500, "Failed to apply port forwarding rules")
+    return {"ok": True, "applied": len(forwards)}
+
+@router.get("/system/drift")
+async def get_system_drift(db: Session = Depends(get_db)):
+    """Differences between the active rules and the kernel (nothing is changed)"""
+    return await reconcile_port_forwards(db, apply=False)
+
+@router.post("/system/reconcile")
+async def reconcile_system_rules(db: Session = Depends(get_db)):
+    """Apply the minimal change that brings the kernel in line with the active rules"""
+    report = await reconcile_port_forwards(db)
+    if not report["ok"]:
+        raise HTTPException(500, report.get("error") or "Failed to reconcile port forwarding rules")
+    return report
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List
 from ..db import get_db
@@ -6,6 +7,8 @@ from ..models import User
 from pydantic import BaseModel
 from datetime import datetime
 from ..models import Machine
+from ..services.changelog import CHANGES_PAGE_MAX, changes_since
+from ..utils.responses import fast_json
 
 router = APIRouter()
 
@@ -26,24 +29,31 @@ class UserResponse(BaseModel):
 async def list_users(db: Session = Depends(get_db)):
     """Get all users"""
     users = db.query(User).all()
-    
-    # Convert to response format
-    user_list = []
-    for user in users:
-        # Count devices for this user
-        device_count = db.query(Machine).filter(Machine.user_id == user.id).count()
-        
-        user_list.append(UserResponse(
-            id=user.id,
-            name=user.name,
-            email=user.email,
-            status="active" if user.is_active else "inactive",
-            lastLogin=user.last_login.isoformat() if user.last_login else datetime.utcnow().isoformat(),
-            devices=device_count,
-            created_at=user.created_at.isoformat() if user.created_at else datetime.utcnow().isoformat()
-        ))
-    
-    return user_list
+    # Device counts for every user in one grouped query
+    device_counts = dict(db.query(Machine.user_id, func.count(Machine.id)).group_by(Machine.user_id).all())
+    now = datetime.utcnow().isoformat()
+
+    return fast_json([
+        {
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "status": "active" if user.is_active else "inactive",
+            "lastLogin": user.last_login.isoformat() if user.last_login else now,
+            "devices": device_counts.get(user.id, 0),
+            "created_at": user.created_at.isoformat() if user.created_at else now
+        }
+        for user in users
+    ])
+
+@router.get("/changes")
+async def user_changes(
+    since: int = Query(0, ge=0, description="Cursor from the previous response (0 = from the beginning)"),
+    limit: int = Query(1000, ge=1, le=CHANGES_PAGE_MAX),
+    db: Session = Depends(get_db)
+):
+    """Users created, updated or deleted after `since` (delta sync)"""
+    return fast_json(changes_since(db, "users", since, limit))
 
 @router.post("", response_model=UserResponse)
 async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
@@ -35,6 +35,9 @@ class CreatePortForwardReq(BaseModel):
     protocol: str = Field(default="tcp", pattern="^(tcp|udp)$")
     description: str | None = None
 
+class BulkCreatePortForwardReq(BaseModel):
+    items: list[CreatePortForwardReq] = Field(min_length=1, max_length=1000)
+
 class PortForwardOut(BaseModel):
     id: str
     name: str
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import Dict
+
+from ..config import settings
+from ..db import SessionLocal
+from ..models import DeploymentLog
+from ..utils.agent_builder import build_key, build_windows_agent
+from ..utils.agent_stamp import stamp_file
+from ..utils.logging import get_logger
+from ..websockets import notification_manager
+from .artifacts import prepare
+
+log = get_logger(__name__)
+
+def artifact_path(key: str) -> str:
+    """Where the executable for build key `key` is stored (content addressed, shared by every build with that key)"""
+    return os.path.join(settings.AGENT_BUILD_DIR, "objects", key[:2], f"{key}.exe")
+
+def stamp_key() -> bytes:
+    """HMAC key compiled into base executables (AGENT_STAMP_KEY, else derived from ENCRYPTION_KEY)"""
+    if settings.AGENT_STAMP_KEY:
+        return bytes.fromhex(settings.AGENT_STAMP_KEY)
+    return hashlib.sha256(b"agent-config-stamp:" + settings.ENCRYPTION_KEY.encode()).digest()
+
+def base_key() -> str:
+    """Build key of the base executable for the current template version and stamp key"""
+    return build_key({"base": True, "stamp_key": hashlib.sha256(stamp_key()).hexdigest()[:16]})
+
+class AgentBuildQueue:
+    """Windows agent builds: one PyInstaller run per core at most, one run per distinct
+    (template, config), and none at all when that executable already exists.
+
+    With AGENT_CONFIG_STAMPING only the base executable of each template version goes through
+    PyInstaller; a config build is a copy of it with the config stamped on (milliseconds).
+
+    Every request gets its own build id (a DeploymentLog row) that records the artifact it
+    resolved to; builds requested while an identical one is running wait for that run.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._waiting: dict = {}  # key -> build ids waiting for it
+        self._configs: dict = {}  # key -> config of the queued/running build
+        self._base: asyncio.Task | None = None
+        self._stamping: dict = {}  # key -> task stamping it from the base
+        self._preparing: set[asyncio.Task] = set()
+
+    @property
+    def concurrency(self) -> int:
+        return settings.AGENT_BUILD_WORKERS or os.cpu_count() or 1
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"workers": len(self._workers), "queued": self._queue.qsize() if self._queue else 0,
+                "building": len(self._waiting)}
+
+    async def submit(self, build_id: str, config: Dict) -> tuple[str, bool]:
+        """Queue a build for `build_id`; returns (key, done). A done build needs no further work:
+        the executable existed already or was stamped from the base right away."""
+        key = build_key(config)
+        if os.path.exists(artifact_path(key)):
+            return key, True
+        if settings.AGENT_CONFIG_STAMPING and os.path.exists(artifact_path(base_key())):
+            task = self._stamping.get(key)
+            if task is None:  # identical requests arriving together share one stamp
+                task = self._stamping[key] = asyncio.create_task(self._stamp_from_base(key, config))
+            await asyncio.shield(task)
+            return key, True
+        waiting = self._waiting.get(key)
+        if waiting is not None:
+            waiting.append(build_id)  # same build already queued or running
+        else:
+            self._waiting[key] = [build_id]
+            self._configs[key] = config
+            self._queue.put_nowait(key)
+        return key, False
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                await self._build(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Agent build worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    async def _produce(path: str, build):
+        """Run `build(tmp)` and move the result to `path` (atomic: readers never see a partial executable)"""
+        tmp = f"{path}.{os.getpid()}.{id(build):x}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            await build(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _stamp(self, key: str, config: Dict, base: str):
+        path = artifact_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            tmp = f.name
+        try:
+            stamp_file(base, tmp, config, stamp_key())
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    async def _stamp_from_base(self, key: str, config: Dict):
+        try:
+            await asyncio.to_thread(self._stamp, key, config, artifact_path(base_key()))
+        finally:
+            self._stamping.pop(key, None)
+        # Hash and precompressed variants in the background: the identity download works meanwhile
+        task = asyncio.create_task(asyncio.to_thread(prepare, artifact_path(key)))
+        self._preparing.add(task)
+        task.add_done_callback(self._preparing.discard)
+
+    async def _ensure_base(self) -> str:
+        """Path of the base executable, building it once if needed (shared by concurrent callers)"""
+        path = artifact_path(base_key())
+        if os.path.exists(path):
+            return path
+        if self._base is None or self._base.done():
+            self._base = asyncio.create_task(
+                self._produce(path, lambda tmp: build_windows_agent(None, tmp, stamp_key())))
+        await asyncio.shield(self._base)
+        return path
+
+    async def _build(self, key: str):
+        config = self._configs[key]
+        try:
+            if settings.AGENT_CONFIG_STAMPING:
+                base = await self._ensure_base()
+                await asyncio.to_thread(self._stamp, key, config, base)
+            else:
+                await self._produce(artifact_path(key), lambda tmp: build_windows_agent(config, tmp))
+            await asyncio.to_thread(prepare, artifact_path(key))
+            status, details = "completed", f"Agent built successfully: {key}"
+        except Exception as e:
+            status, details = "failed", f"Build failed: {str(e)}"
+        build_ids = self._waiting.pop(key, [])
+        self._configs.pop(key, None)
+        await asyncio.to_thread(finish_builds, build_ids, status, details, key if status == "completed" else None)
+        log.info(f"Agent build {key[:12]} {status} ({len(build_ids)} request(s))")
+
+        # Broadcast update
+        await notification_manager.broadcast({
+            "type": "deployment_update",
+            "data": {
+                "action": "build_agent",
+                "status": status,
+                "build_ids": build_ids,
+                "artifact": key if status == "completed" else None,
+                "message": "Agent build completed successfully" if status == "completed" else details
+            }
+        })
+
+def finish_builds(build_ids: list, status: str, details: str, artifact: str | None):
+    db = SessionLocal()
+    try:
+        for row in db.query(DeploymentLog).filter(DeploymentLog.id.in_(build_ids)).all():
+            row.status = status
+            row.details = details
+            row.artifact = artifact
+        db.commit()
+    finally:
+        db.close()
+
+agent_build_queue = AgentBuildQueue()
@@ -0,0 +1,101 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import tempfile
+import brotli
+from fastapi import Request, Response
+
+from ..config import settings
+from ..utils.http_cache import file_response
+from ..utils.logging import get_logger
+
+log = get_logger(__name__)
+
+# Precompressed variants kept next to an artifact, in order of preference
+VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+CHUNK_SIZE = 1024 * 1024
+
+def _write_atomic(path: str, write):
+    # Unique temp name: a background prepare() and a download may write the same file at once
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False)
+    try:
+        with f:
+            write(f)
+        os.replace(f.name, path)
+    finally:
+        if os.path.exists(f.name):
+            os.remove(f.name)
+
+def sha256_of(path: str) -> str:
+    """Content hash of an artifact, computed once and kept in a `.sha256` file next to it"""
+    sidecar = f"{path}.sha256"
+    try:
+        with open(sidecar) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    value = digest.hexdigest()
+    _write_atomic(sidecar, lambda f: f.write(value.encode()))
+    return value
+
+def _compress(path: str, encoding: str, out):
+    with open(path, "rb") as src:
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=settings.ARTIFACT_BROTLI_QUALITY)
+            while chunk := src.read(CHUNK_SIZE):
+                out.write(compressor.process(chunk))
+            out.write(compressor.finish())
+        else:
+            # mtime=0: identical input gives identical bytes (stable across rebuilds of the variant)
+            with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0) as gz:
+                while chunk := src.read(CHUNK_SIZE):
+                    gz.write(chunk)
+
+def prepare(path: str):
+    """Hash an artifact and write its precompressed variants (skipped when they save under
+    ARTIFACT_MIN_SAVING of the size: not worth a second representation)"""
+    sha256_of(path)
+    size = os.path.getsize(path)
+    for encoding, suffix in VARIANTS:
+        variant = path + suffix
+        if os.path.exists(variant):
+            continue
+        _write_atomic(variant, lambda f: _compress(path, encoding, f))
+        if os.path.getsize(variant) > size * (1 - settings.ARTIFACT_MIN_SAVING):
+            os.remove(variant)
+            log.info(f"{os.path.basename(path)}: {encoding} saves too little, serving identity only")
+
+def _accepts(request: Request, encoding: str) -> bool:
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if name != encoding:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+async def artifact_response(request: Request, path: str, filename: str, cache_control: str) -> Response:
+    """Serve an artifact: strong ETag from its content hash (one per representation), the
+    smallest precompressed variant the client accepts, Range/If-Range for resumed downloads"""
+    digest = (await asyncio.to_thread(sha256_of, path))[:32]  # hashes once per artifact, off the loop
+    headers = {
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    for encoding, suffix in VARIANTS:
+        if _accepts(request, encoding) and os.path.exists(path + suffix):
+            headers["Content-Encoding"] = encoding
+            return file_response(request, path + suffix, f'"{digest}-{suffix[1:]}"', headers)
+    return file_response(request, path, f'"{digest}"', headers)
@@ -0,0 +1,58 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import AuthKey, Machine, PortForward, User, Device, ChangeLog
+from .device_sync import REMOVED, device_view
+
+CHANGES_PAGE_MAX = 5000
+
+# entity -> (model, id column, row view)
+ENTITY_MODELS = {
+    "keys": (AuthKey, AuthKey.id, AuthKey.to_dict),
+    "machines": (Machine, Machine.id, Machine.to_dict),
+    "port_forwards": (PortForward, PortForward.id, PortForward.to_dict),
+    "users": (User, User.id, User.to_dict),
+    "devices": (Device, Device.ts_device_id, device_view),
+}
+
+def changes_since(db: Session, entity: str, since: int, limit: int) -> dict:
+    """Upserts (current row state) and tombstones of `entity` after cursor `since`, oldest first.
+
+    Only the latest change of each row within the page is returned. The returned `cursor` is the
+    last seq read; pass it as `since` for the next page / poll until `has_more` is false.
+    """
+    model, id_column, view = ENTITY_MODELS[entity]
+    log = db.execute(
+        select(ChangeLog.seq, ChangeLog.entity_id, ChangeLog.op)
+        .where(ChangeLog.entity == entity, ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(limit)
+    ).all()
+
+    latest = {}
+    for seq, entity_id, op in log:
+        latest.pop(entity_id, None)
+        latest[entity_id] = (seq, op)
+
+    upsert_ids = [entity_id for entity_id, (_, op) in latest.items() if op == "upsert"]
+    rows = {}
+    if upsert_ids:
+        rows = {getattr(row, id_column.key): row for row in db.query(model).filter(id_column.in_(upsert_ids)).all()}
+
+    changes = []
+    for entity_id, (seq, op) in latest.items():
+        row = rows.get(entity_id)
+        if op == "upsert" and row is None:
+            continue  # deleted after this page; its tombstone comes with a later cursor
+        if op == "delete" or (model is Device and row.status == REMOVED):
+            changes.append({"seq": seq, "op": "delete", "id": entity_id})
+        else:
+            changes.append({"seq": seq, "op": "upsert", "id": entity_id, "data": view(row)})
+
+    return {
+        "entity": entity,
+        "since": since,
+        "cursor": log[-1][0] if log else since,
+        "has_more": len(log) == limit,
+        "changes": changes,
+    }
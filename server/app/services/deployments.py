@@ -0,0 +1,286 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+import orjson
+from sqlalchemy import select, update, insert, or_, and_
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..db import SessionLocal
+from ..models import Deployment, DeploymentTarget, DeploymentEvent
+from ..utils.logging import get_logger
+from ..utils.security import decrypt_cipher, encrypt_plain, mask_key
+from ..websockets import notification_manager
+
+log = get_logger(__name__)
+
+COUNTERS = ("queued", "running", "succeeded", "failed")
+LOG_LINE_MAX = 1000
+
+def topic(deployment_id: str) -> str:
+    return f"deployment:{deployment_id}"
+
+def _emit(db: Session, deployment_id: str, events: list, **deltas) -> dict:
+    """Apply counter `deltas` and number `events` in one update of the deployment row (which also
+    serializes writers, so seq order is commit order); the events are stored for replay.
+    Returns the progress message to publish once the transaction commits."""
+    values = {getattr(Deployment, name): getattr(Deployment, name) + delta for name, delta in deltas.items()}
+    values[Deployment.seq] = Deployment.seq + len(events)
+    row = db.execute(
+        update(Deployment).where(Deployment.id == deployment_id).values(values)
+        .returning(Deployment.seq, Deployment.status, *(getattr(Deployment, name) for name in COUNTERS))
+    ).one()
+    first = row.seq - len(events) + 1
+    for i, event in enumerate(events):
+        event["seq"] = first + i
+    db.execute(insert(DeploymentEvent), [
+        {"deployment_id": deployment_id, "seq": event["seq"], "data": orjson.dumps(event).decode()} for event in events
+    ])
+    message = {"type": "deployment_progress", "deployment_id": deployment_id,
+               "counts": {name: getattr(row, name) for name in COUNTERS}, "events": events}
+    if row.status == "started" and row.queued == 0 and row.running == 0:
+        db.execute(update(Deployment).where(Deployment.id == deployment_id)
+                   .values(status="completed", completed_at=datetime.now(timezone.utc), seq=Deployment.seq + 1))
+        done = {"seq": row.seq + 1, "t": "status", "status": "completed"}
+        db.add(DeploymentEvent(deployment_id=deployment_id, seq=done["seq"], data=orjson.dumps(done).decode()))
+        events.append(done)
+    return message
+
+def _publish(messages: list):
+    for message in messages:
+        notification_manager.publish(topic(message["deployment_id"]), message)
+
+def events_since(db: Session, deployment_id: str, since: int, limit: int) -> list[str]:
+    """Stored progress events after `since`, as JSON text"""
+    return list(db.scalars(
+        select(DeploymentEvent.data)
+        .where(DeploymentEvent.deployment_id == deployment_id, DeploymentEvent.seq > since)
+        .order_by(DeploymentEvent.seq)
+        .limit(limit)
+    ))
+
+def _seal(config: dict) -> str:
+    """Stored form of a deployment config: the auth key encrypted like AuthKey.authkey_ciphertext"""
+    stored = {k: v for k, v in config.items() if k != "auth_key"}
+    if config.get("auth_key"):
+        stored["auth_key_ciphertext"] = encrypt_plain(config["auth_key"])
+        stored["auth_key_masked"] = mask_key(config["auth_key"])
+    return json.dumps(stored)
+
+def _unseal(stored: str) -> dict:
+    """Config for the workers, auth key decrypted"""
+    config = json.loads(stored)
+    if "auth_key_ciphertext" in config:
+        config["auth_key"] = decrypt_cipher(config.pop("auth_key_ciphertext"))
+    config.pop("auth_key_masked", None)
+    return config
+
+def public_config(stored: str) -> dict:
+    """Config as shown by the API: the auth key only masked"""
+    config = json.loads(stored)
+    config.pop("auth_key_ciphertext", None)
+    config.pop("auth_key", None)
+    return config
+
+def create_deployment(db: Session, hostnames: list[str], config: dict) -> Deployment:
+    """Queue a deployment of `config` to `hostnames` (duplicates dropped); picked up by the workers on commit"""
+    hostnames = list(dict.fromkeys(hostnames))
+    deployment = Deployment(config=_seal(config), total=len(hostnames), queued=len(hostnames))
+    db.add(deployment)
+    db.flush()
+    # One flush for all targets: a single multi-row INSERT
+    db.add_all([DeploymentTarget(deployment_id=deployment.id, hostname=hostname) for hostname in hostnames])
+    if not hostnames:
+        deployment.status = "completed"
+        deployment.completed_at = datetime.now(timezone.utc)
+    return deployment
+
+async def deploy_device(hostname: str, config: dict, output) -> str:
+    """Install and enroll the agent on one device; progress lines go to `output(line)`.
+    Returns a status message, raises on failure."""
+    # Simulate deployment process
+    output("Downloading Tailscale installer...")
+    await asyncio.sleep(1)
+    output("Installing Tailscale...")
+    await asyncio.sleep(1)  # Simulate installation time
+    return "Deployment completed successfully"
+
+class DeploymentWorkers:
+    """Runs queued deployment targets, up to DEPLOY_WORKERS devices at a time.
+
+    Targets are claimed from the database with a lease (SKIP LOCKED, so several API workers can
+    share the queue). Work left behind by a restart or crash is claimed again once its lease
+    expires, up to DEPLOY_MAX_ATTEMPTS times. Each transition updates its deployment's counters
+    and appends numbered progress events (deployment_events) in the same transaction, so progress
+    reads are a single row and live streams can resume from a seq.
+    """
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._flusher: asyncio.Task | None = None
+        self._active: set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._output: dict = {}  # deployment id -> log line events not yet written
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, self._flusher, *self._active) if task is not None]
+        for task in tasks:
+            task.cancel()
+        # Interrupted devices keep their lease and are retried after it expires
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify(self):
+        """New targets were queued"""
+        self._wake.set()
+
+    def stats(self) -> dict:
+        return {"workers": settings.DEPLOY_WORKERS, "active": len(self._active)}
+
+    async def _run(self):
+        while True:
+            claimed = []
+            free = settings.DEPLOY_WORKERS - len(self._active)
+            if free > 0:
+                try:
+                    claimed = await asyncio.to_thread(self._claim, free)
+                except Exception as e:
+                    log.warning(f"Claiming deployment targets failed: {e}")
+            for target in claimed:
+                task = asyncio.create_task(self._execute(*target))
+                self._active.add(task)
+                task.add_done_callback(self._finished)
+            if not claimed:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), settings.DEPLOY_POLL_SEC)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _finished(self, task: asyncio.Task):
+        self._active.discard(task)
+        self._wake.set()  # a slot is free
+
+    def _claim(self, limit: int) -> list[tuple]:
+        now = datetime.now(timezone.utc)
+        lease = now + timedelta(seconds=settings.DEPLOY_DEVICE_TIMEOUT_SEC + settings.DEPLOY_LEASE_GRACE_SEC)
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(DeploymentTarget, Deployment.config)
+                .join(Deployment, Deployment.id == DeploymentTarget.deployment_id)
+                .where(or_(
+                    DeploymentTarget.status == "queued",
+                    and_(DeploymentTarget.status == "running", DeploymentTarget.lease_until < now),
+                ))
+                .order_by(DeploymentTarget.id)
+                .limit(limit)
+                .with_for_update(of=DeploymentTarget, skip_locked=True)
+            ).all()
+            claimed = []
+            changes: dict = {}  # deployment id -> (events, counter deltas)
+            for target, config in rows:
+                events, deltas = changes.setdefault(target.deployment_id, ([], {}))
+                if target.status == "running" and target.attempts >= settings.DEPLOY_MAX_ATTEMPTS:
+                    # Lease expired too often (the worker keeps dying on this device): give up
+                    target.status = "failed"
+                    target.message = f"Abandoned after {target.attempts} attempts"
+                    target.completed_at = now
+                    target.lease_until = None
+                    events.append({"t": "device", "device": target.hostname, "status": "failed", "message": target.message})
+                    deltas["running"] = deltas.get("running", 0) - 1
+                    deltas["failed"] = deltas.get("failed", 0) + 1
+                    continue
+                if target.status == "queued":
+                    deltas["queued"] = deltas.get("queued", 0) - 1
+                    deltas["running"] = deltas.get("running", 0) + 1
+                    target.started_at = now
+                target.status = "running"
+                target.attempts += 1
+                target.lease_until = lease
+                events.append({"t": "device", "device": target.hostname, "status": "running", "attempt": target.attempts})
+                claimed.append((target.id, target.attempts, target.deployment_id, target.hostname, _unseal(config)))
+            messages = [_emit(db, deployment_id, events, **deltas) for deployment_id, (events, deltas) in changes.items()]
+            db.commit()
+            _publish(messages)
+            return claimed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _execute(self, target_id: int, attempt: int, deployment_id: str, hostname: str, config: dict):
+        def output(line: str):
+            self._output.setdefault(deployment_id, []).append(
+                {"t": "log", "device": hostname, "line": str(line)[:LOG_LINE_MAX]})
+
+        try:
+            message = await asyncio.wait_for(deploy_device(hostname, config, output), settings.DEPLOY_DEVICE_TIMEOUT_SEC)
+            status = "success"
+        except asyncio.TimeoutError:
+            status, message = "failed", f"Deployment failed: timed out after {settings.DEPLOY_DEVICE_TIMEOUT_SEC}s"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status, message = "failed", f"Deployment failed: {str(e)}"
+        # Output not flushed yet goes out first, in the same transaction as the result
+        lines = self._output.pop(deployment_id, [])
+        try:
+            await asyncio.to_thread(self._record, target_id, attempt, deployment_id, hostname, status, message, lines)
+        except Exception as e:
+            log.warning(f"Recording deployment result for {hostname} failed (retried after the lease expires): {e}")
+
+    def _record(self, target_id: int, attempt: int, deployment_id: str, hostname: str, status: str, message: str,
+                lines: list):
+        db = SessionLocal()
+        try:
+            # `attempts` fences the update: if the lease expired and the device was claimed again, this result is stale
+            result = db.execute(
+                update(DeploymentTarget)
+                .where(DeploymentTarget.id == target_id, DeploymentTarget.status == "running",
+                       DeploymentTarget.attempts == attempt)
+                .values(status=status, message=message, completed_at=datetime.now(timezone.utc), lease_until=None)
+            )
+            events = list(lines)
+            deltas = {}
+            if result.rowcount:
+                events.append({"t": "device", "device": hostname, "status": status, "message": message})
+                deltas = {"running": -1, "succeeded" if status == "success" else "failed": 1}
+            messages = [_emit(db, deployment_id, events, **deltas)] if events else []
+            db.commit()
+            _publish(messages)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _flush_loop(self):
+        """Write buffered output lines of running devices, batched per deployment"""
+        while True:
+            await asyncio.sleep(settings.DEPLOY_OUTPUT_FLUSH_SEC)
+            if not self._output:
+                continue
+            pending, self._output = self._output, {}
+            try:
+                await asyncio.to_thread(self._write_output, pending)
+            except Exception as e:
+                log.warning(f"Writing deployment output failed: {e}")
+
+    def _write_output(self, pending: dict):
+        db = SessionLocal()
+        try:
+            messages = [_emit(db, deployment_id, events) for deployment_id, events in pending.items()]
+            db.commit()
+            _publish(messages)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+deployment_workers = DeploymentWorkers()
@@ -0,0 +1,188 @@
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import json
+
+from ..config import settings
+from ..models import Device, DeviceSession, User
+from ..tailscale import list_devices
+from ..utils.logging import get_logger
+from ..websockets import notification_manager
+
+log = get_logger(__name__)
+
+def aware(dt: datetime | None) -> datetime | None:
+    """Treat naive timestamps coming back from the DB as UTC"""
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+def _parse_ts(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+def is_online(ts_device: dict, now: datetime) -> bool:
+    """Online if Tailscale says it is connected, else if it was seen within the online window"""
+    if "connectedToControl" in ts_device:
+        return bool(ts_device["connectedToControl"])
+    last_seen = _parse_ts(ts_device.get("lastSeen"))
+    return bool(last_seen and last_seen > now - timedelta(seconds=settings.DEVICE_ONLINE_WINDOW_SEC))
+
+def _last_session(db: Session, device_id: str) -> DeviceSession | None:
+    # Served by ix_device_sessions_device_started (index seek, newest first)
+    return db.execute(
+        select(DeviceSession)
+        .where(DeviceSession.device_id == device_id)
+        .order_by(DeviceSession.started_at.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+def record_transition(db: Session, device: Device, online: bool, now: datetime, last_seen: datetime | None = None):
+    """Open or close the device's current online session when its status flips.
+
+    Sessions are run-length encoded: nothing is written while the status stays the same.
+    Each new session stores the cumulative online seconds of all earlier sessions so that
+    interval queries need a single index seek per boundary (see services/uptime.py).
+    """
+    was_online = device.status == "online"
+    if online == was_online:
+        return
+
+    last = _last_session(db, device.id)
+    if online:
+        online_before = 0.0
+        if last is not None:
+            end = aware(last.ended_at) or now
+            online_before = last.online_before + max(0.0, (end - aware(last.started_at)).total_seconds())
+            if last.ended_at is None:
+                last.ended_at = now
+        db.add(DeviceSession(device_id=device.id, started_at=now, ended_at=None, online_before=online_before))
+    elif last is not None and last.ended_at is None:
+        # Close at the last time Tailscale actually saw the device, not at the time we noticed
+        started = aware(last.started_at)
+        end = now
+        if last_seen and started <= last_seen < now:
+            end = last_seen
+        last.ended_at = end
+
+    device.status = "online" if online else "offline"
+
+def _mirror_fields(ts_device: dict, user_ids: dict) -> dict:
+    addresses = ts_device.get("addresses") or []
+    return {
+        "name": ts_device.get("name") or ts_device.get("hostname") or ts_device.get("id"),
+        "hostname": ts_device.get("hostname"),
+        "ip": addresses[0] if addresses else None,
+        "os": ts_device.get("os"),
+        "user_id": user_ids.get(ts_device.get("user")),
+        "last_seen": _parse_ts(ts_device.get("lastSeen")),
+        "tags": json.dumps(ts_device.get("tags") or []),
+    }
+
+# Mirror status of devices that are no longer in the tailnet
+REMOVED = "removed"
+
+def device_view(device: Device) -> dict:
+    return {
+        "id": device.ts_device_id,
+        "name": device.name,
+        "hostname": device.hostname,
+        "ip": device.ip,
+        "os": device.os,
+        "user_id": device.user_id,
+        "status": device.status,
+        "tags": json.loads(device.tags or "[]"),
+        "last_seen": device.last_seen.isoformat() if device.last_seen else None,
+    }
+
+def _delta(op: str, device: Device, changes: dict | None = None) -> tuple:
+    """A compact device delta event: full view when added, changed fields only when updated"""
+    message = {"type": "device_delta", "op": op, "id": device.ts_device_id}
+    if op == "added":
+        message["device"] = device_view(device)
+    elif op == "changed":
+        message["changes"] = {k: json.loads(v) if k == "tags" else v for k, v in changes.items()}
+    return message, {"user_id": device.user_id}
+
+async def sync_devices(db: Session) -> dict:
+    """Refresh the `devices` mirror from Tailscale, record online/offline transitions and publish deltas"""
+    response = await list_devices()
+    ts_devices = response.get("devices", []) if isinstance(response, dict) else (response or [])
+    now = datetime.now(timezone.utc)
+
+    mirror = {d.ts_device_id: d for d in db.query(Device).all()}
+    user_ids = {email: uid for uid, email in db.query(User.id, User.email).all()}
+
+    added = updated = transitions = removed = 0
+    deltas = []
+    seen = set()
+    for ts_device in ts_devices:
+        ts_id = ts_device.get("id")
+        if not ts_id:
+            continue
+        seen.add(ts_id)
+        online = is_online(ts_device, now)
+        fields = _mirror_fields(ts_device, user_ids)
+
+        device = mirror.get(ts_id)
+        if device is None:
+            device = Device(ts_device_id=ts_id, status="offline", created_at=now, updated_at=now, **fields)
+            db.add(device)
+            db.flush()
+            mirror[ts_id] = device
+            added += 1
+            if online:
+                record_transition(db, device, online, now, aware(device.last_seen))
+                transitions += 1
+            deltas.append(_delta("added", device))
+            continue
+
+        # last_seen moves on every poll for connected devices, so it is kept current
+        # without counting as a change of the mirrored device
+        device.last_seen = fields.pop("last_seen")
+        returned = device.status == REMOVED
+        if returned:
+            device.status = "offline"
+        changes = {}
+        for name, value in fields.items():
+            if getattr(device, name) != value:
+                setattr(device, name, value)
+                changes[name] = value
+        if changes:
+            updated += 1
+
+        if (device.status == "online") != online:
+            record_transition(db, device, online, now, aware(device.last_seen))
+            changes["status"] = device.status
+            transitions += 1
+
+        if returned:
+            device.updated_at = now
+            deltas.append(_delta("added", device))
+        elif changes:
+            device.updated_at = now
+            deltas.append(_delta("changed", device, changes))
+
+    # Devices that disappeared from the tailnet go offline and are flagged as removed (history is kept)
+    for ts_id, device in mirror.items():
+        if ts_id not in seen and device.status != REMOVED:
+            if device.status == "online":
+                record_transition(db, device, False, now, aware(device.last_seen))
+                transitions += 1
+            device.status = REMOVED
+            device.updated_at = now
+            removed += 1
+            deltas.append(_delta("removed", device))
+
+    db.commit()
+    # Only real changes are published; an unchanged tailnet produces no traffic
+    for message, attrs in deltas:
+        notification_manager.publish("devices", message, attrs)
+    result = {"devices": len(ts_devices), "added": added, "updated": updated,
+              "transitions": transitions, "removed": removed}
+    log.info(f"Device sync completed: {result}")
+    return result
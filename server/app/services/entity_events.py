@@ -0,0 +1,80 @@
+from typing import Callable, NamedTuple
+from sqlalchemy import event, inspect, insert, text
+from sqlalchemy.orm import Session
+
+from ..db import SessionLocal
+from ..models import AuthKey, Machine, PortForward, DeploymentLog, User, Device, ChangeLog
+from ..websockets import notification_manager
+
+class Tracked(NamedTuple):
+    entity: str              # change-log entity and live-feed topic
+    changelog: bool          # write a change_log row (delta sync)
+    live: bool               # publish an entity_delta (live feed)
+    ignore: frozenset = frozenset()  # attributes whose changes alone are not a change
+    key: Callable = lambda obj: obj.id
+
+TRACKED = {
+    AuthKey: Tracked("keys", changelog=True, live=True),
+    Machine: Tracked("machines", changelog=True, live=True),
+    PortForward: Tracked("port_forwards", changelog=True, live=True),
+    User: Tracked("users", changelog=True, live=False),
+    # The mirror publishes its own device_delta events (services/device_sync.py); last_seen
+    # moves on every sync and is not a change
+    Device: Tracked("devices", changelog=True, live=False, ignore=frozenset({"last_seen"}),
+                    key=lambda d: d.ts_device_id),
+    DeploymentLog: Tracked("deployments", changelog=False, live=True),
+}
+
+# Serializes change_log inserts until commit so `seq` order is commit order and a reader
+# holding cursor N can never later see a smaller seq appear (PostgreSQL only)
+CHANGELOG_LOCK_KEY = 7_301_736
+
+def _modified(obj, ignore: frozenset) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[column.key].history.has_changes()
+               for column in state.mapper.column_attrs if column.key not in ignore)
+
+def _pending(session: Session) -> dict:
+    return session.info.setdefault("entity_deltas", {})
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect(session: Session, flush_context):
+    """Record changed rows while the flush can still load them: change_log rows are written in
+    the same transaction, live deltas are published on commit"""
+    pending = _pending(session)
+    changes = []
+    new = session.new
+    for obj in list(new) + list(session.dirty) + list(session.deleted):
+        tracked = TRACKED.get(type(obj))
+        if tracked is None:
+            continue
+        deleted = obj in session.deleted
+        if not deleted and obj not in new and not _modified(obj, tracked.ignore):
+            continue
+        entity_id = tracked.key(obj)
+        if entity_id is None:
+            continue
+        op = "delete" if deleted else "upsert"
+        if tracked.changelog:
+            changes.append({"entity": tracked.entity, "entity_id": entity_id, "op": op})
+        if tracked.live:
+            message = {"type": "entity_delta", "entity": tracked.entity, "op": op, "id": entity_id}
+            if not deleted:
+                message["item"] = obj.to_dict()
+            pending[(tracked.entity, entity_id)] = (message, {"user_id": getattr(obj, "user_id", None)})
+
+    if changes:
+        connection = session.connection()
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGELOG_LOCK_KEY})
+        connection.execute(insert(ChangeLog), changes)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish(session: Session):
+    deltas = session.info.pop("entity_deltas", None)
+    for (entity, _), (message, attrs) in (deltas or {}).items():
+        notification_manager.publish(entity, message, attrs)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard(session: Session):
+    session.info.pop("entity_deltas", None)
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import socket
+import zlib
+import orjson
+
+from ..config import settings
+from ..utils.logging import get_logger
+
+log = get_logger(__name__)
+
+# Frame prefixes: plain JSON batch, or zlib-compressed JSON batch
+_RAW, _ZLIB = b"j", b"z"
+
+def encode_batch(events: list) -> bytes:
+    """One frame per batch; large batches are compressed"""
+    body = orjson.dumps(events)
+    if len(body) >= settings.EVENT_BUS_COMPRESS_MIN:
+        return _ZLIB + zlib.compress(body, 6)
+    return _RAW + body
+
+def decode_batch(frame: bytes) -> list:
+    kind, body = frame[:1], frame[1:]
+    if kind == _ZLIB:
+        body = zlib.decompress(body)
+    return orjson.loads(body)
+
+class MemoryBackend:
+    """In-process backend (single worker, tests): frames loop straight back to this process"""
+
+    async def start(self, on_frame):
+        self._on_frame = on_frame
+
+    async def publish(self, frame: bytes):
+        self._on_frame(frame)
+
+    async def stop(self):
+        pass
+
+class RedisBackend:
+    """Redis pub/sub: every worker subscribes to one channel and delivers to its own clients"""
+
+    def __init__(self, url: str, channel: str):
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._task = None
+
+    async def start(self, on_frame):
+        import redis.asyncio as redis  # only needed when this backend is configured
+        self._on_frame = on_frame
+        self._redis = redis.from_url(self.url)
+        self._task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        delay = 1
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                delay = 1
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        try:
+                            self._on_frame(message["data"])
+                        except Exception as e:
+                            log.warning(f"Dropping undecodable event batch: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Event bus subscription lost ({e}); retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def publish(self, frame: bytes):
+        await self._redis.publish(self.channel, frame)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+class EventBus:
+    """Fans published events out to every API worker.
+
+    Events are buffered for EVENT_BUS_BATCH_MS (or until EVENT_BUS_BATCH_MAX are pending) and
+    published as one frame. Each worker, the publisher included, receives the frame once and
+    routes it to its local WebSocket subscribers.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self._manager = None
+        self._pending: list = []
+        self._flush_handle = None
+        self._flushing: set = set()
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.published = 0
+        self.frames = 0
+        self.received = 0
+
+    def _make_backend(self):
+        if settings.EVENT_BUS_BACKEND == "redis":
+            return RedisBackend(settings.REDIS_URL, settings.EVENT_BUS_CHANNEL)
+        if settings.EVENT_BUS_BACKEND != "memory":
+            log.warning(f"Unknown EVENT_BUS_BACKEND={settings.EVENT_BUS_BACKEND!r}, using memory")
+        return MemoryBackend()
+
+    async def start(self, manager):
+        self._manager = manager
+        self.backend = self._make_backend()
+        await self.backend.start(self._on_frame)
+        manager.attach_bus(self, asyncio.get_running_loop())
+        log.info(f"Event bus started ({type(self.backend).__name__})")
+
+    async def stop(self):
+        self._flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+        if self.backend is not None:
+            await self.backend.stop()
+
+    def publish(self, topic: str, payload: str, attrs: dict, coalesce):
+        """Queue an already-serialized message; must be called on the event loop"""
+        self._pending.append([topic, payload, attrs, coalesce])
+        self.published += 1
+        if len(self._pending) >= settings.EVENT_BUS_BATCH_MAX:
+            self._flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(settings.EVENT_BUS_BATCH_MS / 1000, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        events, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._send(events))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _send(self, events: list):
+        frame = encode_batch(events)
+        self.frames += 1
+        try:
+            await self.backend.publish(frame)
+        except Exception as e:
+            # Other workers miss this batch, but clients of this worker still get it
+            log.warning(f"Event bus publish failed ({e}); delivering {len(events)} events locally only")
+            self._deliver(events)
+
+    def _on_frame(self, frame: bytes):
+        self._deliver(decode_batch(frame))
+
+    def _deliver(self, events: list):
+        self.received += len(events)
+        for topic, payload, attrs, coalesce in events:
+            self._manager.route(topic, payload, attrs, coalesce)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "origin": self.origin,
+            "published": self.published,
+            "frames": self.frames,
+            "received": self.received,
+            "pending": len(self._pending),
+        }
+
+event_bus = EventBus()
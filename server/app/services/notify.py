@@ -1,20 +1,235 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
 import httpx
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
 from ..config import settings
+from ..db import SessionLocal
+from ..models import Notification
 from ..utils.logging import get_logger
 
 log = get_logger(__name__)
 
-async def notify_telegram(msg: str):
-    if not (settings.TELEGRAM_BOT_TOKEN and settings.TELEGRAM_CHAT_ID): return
-    url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
-    async with httpx.AsyncClient(timeout=15) as c:
-        await c.post(url, json={"chat_id": settings.TELEGRAM_CHAT_ID, "text": msg})
+# Digest headline per kind when a burst of the same kind is merged into one message
+DIGEST_TITLES = {
+    "key_created": "[Key Created] created {n} keys",
+    "key_rotated": "[Key Rotated] rotated {n} keys",
+}
+
+class SendError(Exception):
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Channel:
+    """One chat destination: request shape, message size limit and send rate"""
+    max_len = 2000
+
+    def __init__(self, name: str, per_minute: int):
+        self.name = name
+        self.interval = 60 / max(per_minute, 1)
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        raise NotImplementedError
+
+    def request(self, text: str) -> tuple[str, dict]:
+        raise NotImplementedError
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def _slot(self):
+        """Space sends at least `interval` apart"""
+        now = time.monotonic()
+        wait = max(self._next_slot, self._paused_until) - now
+        self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def send(self, client: httpx.AsyncClient, text: str):
+        await self._slot()
+        url, body = self.request(text)
+        try:
+            r = await client.post(url, json=body)
+        except httpx.HTTPError as e:
+            raise SendError(f"{type(e).__name__}: {e}")
+        if r.status_code == 429:
+            retry_after = _retry_after(r)
+            self.pause(retry_after)
+            raise SendError("rate limited", retry_after)
+        if r.status_code >= 400:
+            raise SendError(f"HTTP {r.status_code}: {r.text[:200]}")
+
+class Telegram(Channel):
+    max_len = 4096
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.TELEGRAM_BOT_TOKEN and settings.TELEGRAM_CHAT_ID)
+
+    def request(self, text):
+        url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
+        return url, {"chat_id": settings.TELEGRAM_CHAT_ID, "text": text}
+
+class Discord(Channel):
+    max_len = 2000
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.DISCORD_WEBHOOK_URL)
+
+    def request(self, text):
+        return settings.DISCORD_WEBHOOK_URL, {"content": text}
+
+def _retry_after(r: httpx.Response) -> float:
+    try:
+        body = r.json()
+        # Telegram: parameters.retry_after (s); Discord: retry_after (s)
+        value = (body.get("parameters") or {}).get("retry_after") or body.get("retry_after")
+        if value:
+            return float(value)
+    except Exception:
+        pass
+    try:
+        return float(r.headers.get("Retry-After", 5))
+    except ValueError:
+        return 5.0
+
+CHANNELS = {
+    "telegram": Telegram("telegram", settings.NOTIFY_TELEGRAM_PER_MIN),
+    "discord": Discord("discord", settings.NOTIFY_DISCORD_PER_MIN),
+}
+
+def announce(db: Session, msg: str, kind: str = "info"):
+    """Queue `msg` for every configured channel in the caller's transaction (sent on commit by the dispatcher)"""
+    for name, channel in CHANNELS.items():
+        if channel.enabled:
+            db.add(Notification(channel=name, kind=kind, message=msg))
+
+def _digest(kind: str, rows: list, max_len: int) -> str:
+    title = DIGEST_TITLES.get(kind, "[" + kind + "] {n} notifications").format(n=len(rows))
+    lines = [title]
+    size = len(title)
+    for i, row in enumerate(rows[:settings.NOTIFY_DIGEST_SAMPLE]):
+        more = f"… and {len(rows) - i} more"
+        if size + len(row.message) + len(more) + 2 > max_len:
+            lines.append(more)
+            break
+        lines.append(row.message)
+        size += len(row.message) + 1
+    else:
+        if len(rows) > settings.NOTIFY_DIGEST_SAMPLE:
+            lines.append(f"… and {len(rows) - settings.NOTIFY_DIGEST_SAMPLE} more")
+    return "\n".join(lines)
+
+def _batches(rows: list, max_len: int) -> list[tuple[str, list]]:
+    """Merge each burst of one kind into a digest; smaller groups go out as they are"""
+    groups: dict[str, list] = {}
+    for row in rows:
+        groups.setdefault(row.kind, []).append(row)
+    batches = []
+    for kind, group in groups.items():
+        if len(group) >= settings.NOTIFY_DIGEST_MIN:
+            batches.append((_digest(kind, group, max_len), group))
+        else:
+            batches.extend((row.message[:max_len], [row]) for row in group)
+    batches.sort(key=lambda batch: batch[1][0].id)
+    return batches
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(settings.NOTIFY_RETRY_BASE_SEC * 2 ** (attempts - 1), settings.NOTIFY_RETRY_MAX_SEC))
+
+class NotificationDispatcher:
+    """Delivers the outbox: channels concurrently over one pooled client, bursts as digests,
+    failed sends retried with exponential backoff until NOTIFY_MAX_ATTEMPTS"""
+
+    def __init__(self):
+        self._client: httpx.AsyncClient | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=15, limits=httpx.Limits(max_connections=10, max_keepalive_connections=4))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.dispatch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Notification dispatch failed: {e}")
+            await asyncio.sleep(settings.NOTIFY_POLL_SEC)
+
+    async def dispatch(self):
+        channels = [name for name, channel in CHANNELS.items() if channel.enabled and not channel.paused]
+        await asyncio.gather(*(self._drain(name) for name in channels))
+
+    async def _drain(self, name: str):
+        channel = CHANNELS[name]
+        db = SessionLocal()
+        try:
+            # SKIP LOCKED lets several API workers drain the same outbox without double sends
+            rows = db.execute(
+                select(Notification)
+                .where(Notification.channel == name, Notification.status == "pending",
+                       Notification.next_attempt_at <= func.now())
+                .order_by(Notification.id)
+                .limit(settings.NOTIFY_BATCH_MAX)
+                .with_for_update(skip_locked=True)
+            ).scalars().all()
+            if not rows:
+                return
+
+            now = datetime.now(timezone.utc)
+            for text, batch in _batches(rows, channel.max_len):
+                if channel.paused:
+                    break  # rate limited: the rest stays due for the next round
+                try:
+                    await channel.send(self._client, text)
+                except SendError as e:
+                    self._failed(batch, e, now)
+                    continue
+                for row in batch:
+                    row.status = "sent"
+                    row.sent_at = now
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
 
-async def notify_discord(msg: str):
-    if not settings.DISCORD_WEBHOOK_URL: return
-    async with httpx.AsyncClient(timeout=15) as c:
-        await c.post(settings.DISCORD_WEBHOOK_URL, json={"content": msg})
+    def _failed(self, batch: list, error: SendError, now: datetime):
+        for row in batch:
+            row.attempts += 1
+            row.last_error = str(error)
+            if row.attempts >= settings.NOTIFY_MAX_ATTEMPTS:
+                row.status = "failed"
+            else:
+                delay = _backoff(row.attempts)
+                if error.retry_after:
+                    delay = max(delay, timedelta(seconds=error.retry_after))
+                row.next_attempt_at = now + delay
+        log.warning(f"Notification send to {batch[0].channel} failed ({error}): {len(batch)} message(s), attempt {batch[0].attempts}")
 
-async def announce(msg: str):
-    await notify_telegram(msg)
-    await notify_discord(msg)
+notification_dispatcher = NotificationDispatcher()
@@ -1,151 +1,582 @@
-import subprocess
 import asyncio
-from typing import List, Dict
+import ipaddress
+import json
+import shlex
+import shutil
+from collections import Counter
+from typing import Iterable, List, Dict, NamedTuple
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..models import PortForward
+from .relay import relay_engine
 from ..utils.logging import get_logger
 
 log = get_logger(__name__)
 
-class PortForwardManager:
-    """Manages iptables rules for port forwarding"""
-    
-    @staticmethod
-    async def _run_command(cmd: List[str]) -> tuple[int, str, str]:
-        """Run a system command asynchronously"""
+class Forward(NamedTuple):
+    source_port: int
+    target_host: str
+    target_port: int
+    protocol: str = "tcp"
+
+def _checked(fw: Forward) -> Forward:
+    """Rules are written into a restore script, so every field must be a plain token"""
+    if fw.protocol not in ("tcp", "udp"):
+        raise ValueError(f"Unsupported protocol: {fw.protocol!r}")
+    if ipaddress.ip_address(fw.target_host).version != 4:  # DNAT needs an address; also rejects anything with whitespace
+        raise ValueError(f"Only IPv4 targets are supported: {fw.target_host!r}")
+    for port in (fw.source_port, fw.target_port):
+        if not 0 < int(port) <= 65535:
+            raise ValueError(f"Invalid port: {port!r}")
+    return fw
+
+def _target(fw: Forward) -> tuple:
+    return (fw.target_host, fw.target_port, fw.protocol)
+
+def _options(tokens: list) -> dict:
+    """`-p tcp -m tcp --dport 80 ...` -> {"-p": "tcp", "-m": "tcp", "--dport": "80", ...} (last wins)"""
+    opts = {}
+    for i, token in enumerate(tokens):
+        if token.startswith("-") and i + 1 < len(tokens) and not tokens[i + 1].startswith("-"):
+            opts[token] = tokens[i + 1]
+    return opts
+
+def _drift(installed: list, desired: list) -> dict:
+    """Forward-level difference between kernel and database (a retargeted port shows as `changed`)"""
+    counts = Counter(installed)
+    wanted = set(desired)
+    missing = {(fw.protocol, fw.source_port): fw for fw in desired if fw not in counts}
+    unexpected = {(fw.protocol, fw.source_port): fw for fw in counts if fw not in wanted}
+    changed = [{"from": unexpected.pop(key)._asdict(), "to": missing.pop(key)._asdict()}
+               for key in list(missing) if key in unexpected]
+    return {
+        "missing": [fw._asdict() for fw in missing.values()],
+        "unexpected": [fw._asdict() for fw in unexpected.values()],
+        "changed": changed,
+        "duplicates": sum(n - 1 for n in counts.values() if n > 1),
+    }
+
+async def _run_command(cmd: List[str], input: str | None = None) -> tuple[int, str, str]:
+    """Run a system command asynchronously"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input is not None else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate(input.encode() if input is not None else None)
+        return process.returncode, stdout.decode(), stderr.decode()
+    except Exception as e:
+        log.error(f"Command execution failed: {e}")
+        return 1, "", str(e)
+
+class RulesetBackend:
+    """Kernel-side store of the forwards; every change is applied as one atomic batch"""
+    name = ""
+    tools: tuple = ()
+
+    def __init__(self):
+        self._available: bool | None = None
+        self._ready = False
+        self._lock = asyncio.Lock()
+
+    def available(self) -> bool:
+        """Tool lookup, done once per process"""
+        if self._available is None:
+            self._available = all(shutil.which(tool) for tool in self.tools)
+        return self._available
+
+    async def _setup(self) -> bool:
+        raise NotImplementedError
+
+    async def _apply(self, add: list, remove: list) -> bool:
+        raise NotImplementedError
+
+    async def _replace(self, forwards: list) -> bool:
+        raise NotImplementedError
+
+    async def read_state(self):
+        """Installed rules, read with one command in structured form (None if unreadable)"""
+        raise NotImplementedError
+
+    def forwards(self, state) -> list:
+        """Forwards present in `state` (duplicates included)"""
+        raise NotImplementedError
+
+    def _installed(self, state, remove: list) -> list:
+        """The forwards of `remove` that `state` actually holds"""
+        have = set(self.forwards(state))
+        return [fw for fw in remove if fw in have]
+
+    def _plan(self, state, desired: list):
+        """Minimal batch turning `state` into `desired`, or None when already in sync"""
+        have, want = set(state), set(desired)
+        add, remove = [fw for fw in desired if fw not in have], [fw for fw in state if fw not in want]
+        return (add, remove) if add or remove else None
+
+    async def _run_plan(self, plan) -> bool:
+        return await self._apply(*plan)
+
+    async def read_counters(self) -> dict | None:
+        """Forward -> cumulative counters (bytes_in, bytes_out, packets_in, packets_out, connections;
+        None where the backend cannot tell), read with one call; None if unsupported"""
+        return None
+
+    async def close(self):
+        pass
+
+    async def list_rules(self) -> List[Dict]:
+        state = await self.read_state()
+        return [fw._asdict() for fw in self.forwards(state)] if state is not None else []
+
+    async def _ensure_ready(self) -> bool:
+        if self._ready:
+            return True
+        if not self.available():
+            log.error(f"{self.name} is not available on this system")
+            return False
+        if not await self._setup():
+            return False
+        self._ready = True
+        return True
+
+    async def apply_changes(self, add: Iterable[Forward] = (), remove: Iterable[Forward] = ()) -> bool:
         try:
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            return process.returncode, stdout.decode(), stderr.decode()
-        except Exception as e:
-            log.error(f"Command execution failed: {e}")
-            return 1, "", str(e)
+            add, remove = [_checked(fw) for fw in add], [_checked(fw) for fw in remove]
+        except ValueError as e:
+            log.error(f"Rejected port forward rule: {e}")
+            return False
+        async with self._lock:
+            if not await self._ensure_ready():
+                return False
+            if await self._apply(add, remove):
+                return True
+            if not remove:
+                return False
+            # A rule to delete may be missing from the kernel (edited by hand, reboot before the
+            # reconcile), which aborts the whole batch: retry deleting only what is installed
+            state = await self.read_state()
+            if state is None:
+                return False
+            installed = self._installed(state, remove)
+            if len(installed) == len(remove):
+                return False
+            log.warning(f"Not installed, skipped: {[fw for fw in remove if fw not in installed]}")
+            return await self._apply(add, installed)
 
-    @staticmethod
-    async def check_iptables_available() -> bool:
-        """Check if iptables is available on the system"""
-        returncode, _, _ = await PortForwardManager._run_command(["which", "iptables"])
-        return returncode == 0
+    async def withdraw(self, installed: Iterable[Forward], owners: Iterable[Forward] = ()) -> bool:
+        """Undo this request's `installed` forwards after another worker won some of their ports;
+        `owners` are the forwards now holding those ports. Rules here are per forward, so deleting
+        ours leaves the owner's rule (even an identical one) in place."""
+        return await self.apply_changes(remove=installed)
 
-    @staticmethod
-    def _get_iptables_rule(source_port: int, target_host: str, target_port: int, protocol: str) -> List[str]:
-        """Generate iptables rule for port forwarding"""
-        return [
-            "iptables", "-t", "nat", "-A", "PREROUTING",
-            "-p", protocol, "--dport", str(source_port),
-            "-j", "DNAT", "--to-destination", f"{target_host}:{target_port}"
-        ]
+    async def replace_all(self, forwards: Iterable[Forward]) -> bool:
+        try:
+            forwards = [_checked(fw) for fw in forwards]
+        except ValueError as e:
+            log.error(f"Rejected port forward rule: {e}")
+            return False
+        async with self._lock:
+            return await self._ensure_ready() and await self._replace(forwards)
 
-    @staticmethod
-    def _get_iptables_delete_rule(source_port: int, target_host: str, target_port: int, protocol: str) -> List[str]:
-        """Generate iptables rule for deleting port forwarding"""
+    async def reconcile(self, desired: Iterable[Forward], apply: bool = True) -> dict:
+        """Diff `desired` against the kernel and, if `apply`, fix the drift in one batch"""
+        valid = {}
+        for fw in desired:
+            try:
+                fw = _checked(fw)
+            except ValueError as e:
+                log.warning(f"Skipping invalid port forward {fw}: {e}")
+                continue
+            if valid.setdefault((fw.protocol, fw.source_port), fw) != fw:
+                log.warning(f"Skipping port forward {fw}: {fw.protocol}/{fw.source_port} is already forwarded")
+        desired = list(valid.values())
+
+        async with self._lock:
+            if not await self._ensure_ready():
+                return {"ok": False, "error": f"{self.name} is not ready"}
+            state = await self.read_state()
+            if state is None:
+                return {"ok": False, "error": f"Could not read {self.name} state"}
+            report = {"ok": True, "backend": self.name, "desired": len(desired), **_drift(self.forwards(state), desired)}
+            plan = self._plan(state, desired)
+            report["in_sync"] = plan is None
+            report["applied"] = False
+            if plan is not None and apply:
+                report["applied"] = await self._run_plan(plan)
+                report["ok"] = report["applied"]
+        return report
+
+class IptablesBackend(RulesetBackend):
+    """DNAT rules in `<prefix>-PREROUTING` (nat) and their ACCEPT rules in `<prefix>-FORWARD`
+    (filter); the built-in PREROUTING/FORWARD chains only jump there. Scripts are applied with
+    `iptables-restore --noflush`, so each table's changes commit atomically and other rules on
+    the host are left alone.
+    """
+    name = "iptables"
+    tools = ("iptables", "iptables-restore")
+
+    def __init__(self, prefix: str):
+        super().__init__()
+        self.nat_chain = f"{prefix}-PREROUTING"
+        self.filter_chain = f"{prefix}-FORWARD"
+
+    def nat_rule(self, fw: Forward) -> str:
+        return (f"{self.nat_chain} -p {fw.protocol} -m {fw.protocol} --dport {fw.source_port} "
+                f"-j DNAT --to-destination {fw.target_host}:{fw.target_port}")
+
+    def filter_rule(self, fw: Forward) -> str:
+        return self._accept_rule(_target(fw))
+
+    def _accept_rule(self, target: tuple) -> str:
+        host, port, protocol = target
+        return f"{self.filter_chain} -d {host}/32 -p {protocol} -m {protocol} --dport {port} -j ACCEPT"
+
+    def _script(self, nat: list, filter: list) -> str:
+        lines = []
+        for table, rules in (("nat", nat), ("filter", filter)):
+            if rules:
+                lines += [f"*{table}", *rules, "COMMIT"]
+        return "\n".join(lines) + "\n"
+
+    def changes_script(self, add: list, remove: list) -> str:
+        """Incremental script: delete `remove`, append `add`"""
+        return self._script(
+            [f"-D {self.nat_rule(fw)}" for fw in remove] + [f"-A {self.nat_rule(fw)}" for fw in add],
+            [f"-D {self.filter_rule(fw)}" for fw in remove] + [f"-A {self.filter_rule(fw)}" for fw in add],
+        )
+
+    def full_script(self, forwards: list) -> str:
+        """Whole desired state: declaring a chain under --noflush empties it before the rules are added"""
+        return self._script(
+            [f":{self.nat_chain} - [0:0]", *(f"-A {self.nat_rule(fw)}" for fw in forwards)],
+            [f":{self.filter_chain} - [0:0]", *(f"-A {self.filter_rule(fw)}" for fw in forwards)],
+        )
+
+    async def _setup(self) -> bool:
+        for table, chain, parent in (("nat", self.nat_chain, "PREROUTING"),
+                                     ("filter", self.filter_chain, "FORWARD")):
+            await _run_command(["iptables", "-t", table, "-N", chain])  # fails harmlessly if it exists
+            returncode, _, _ = await _run_command(["iptables", "-t", table, "-C", parent, "-j", chain])
+            if returncode != 0:
+                returncode, _, stderr = await _run_command(["iptables", "-t", table, "-I", parent, "1", "-j", chain])
+                if returncode != 0:
+                    log.error(f"Failed to hook {chain} into {parent}: {stderr}")
+                    return False
+        await _run_command(["sysctl", "-w", "net.ipv4.ip_forward=1"])
+        return True
+
+    async def _restore(self, script: str) -> bool:
+        returncode, _, stderr = await _run_command(["iptables-restore", "--noflush"], input=script)
+        if returncode != 0:
+            log.error(f"iptables-restore failed: {stderr.strip()}")
+            return False
+        return True
+
+    async def _apply(self, add, remove):
+        return await self._restore(self.changes_script(add, remove))
+
+    async def _replace(self, forwards):
+        return await self._restore(self.full_script(forwards))
+
+    async def _save(self, counters: bool = False) -> dict | None:
+        """Rules of the dedicated chains from one `iptables-save` (with `-c`, also their [packets:bytes])"""
+        returncode, stdout, stderr = await _run_command(["iptables-save", "-c"] if counters else ["iptables-save"])
+        if returncode != 0:
+            log.error(f"iptables-save failed: {stderr.strip()}")
+            return None
+        state = {"nat": [], "filter": [], "foreign": {"nat": [], "filter": []}, "counters": {"nat": {}, "filter": {}}}
+        table = None
+        for line in stdout.splitlines():
+            if line.startswith("*"):
+                table = line[1:]
+                continue
+            count = None
+            if line.startswith("["):
+                prefix, _, line = line.partition("] ")
+                count = tuple(int(n) for n in prefix[1:].split(":"))
+            if not line.startswith("-A "):
+                continue
+            tokens = shlex.split(line)
+            chain = tokens[1]
+            if (table, chain) not in (("nat", self.nat_chain), ("filter", self.filter_chain)):
+                continue
+            opts = _options(tokens[2:])
+            try:
+                if table == "nat" and opts.get("-j") == "DNAT":
+                    host, port = opts["--to-destination"].rsplit(":", 1)
+                    entry = Forward(int(opts["--dport"]), host, int(port), opts["-p"])
+                elif table == "filter" and opts.get("-j") == "ACCEPT":
+                    entry = (opts["-d"].removesuffix("/32"), int(opts["--dport"]), opts["-p"])
+                else:
+                    entry = None
+            except (KeyError, ValueError):
+                entry = None
+            if entry is None:
+                # Not a rule this manager writes: it does not belong in the dedicated chain
+                state["foreign"][table].append(line[3:])
+                continue
+            state[table].append(entry)
+            if count is not None:
+                packets, octets = state["counters"][table].get(entry, (0, 0))
+                state["counters"][table][entry] = (packets + count[0], octets + count[1])
+        return state
+
+    async def read_state(self) -> dict | None:
+        return await self._save()
+
+    def _installed(self, state, remove):
+        # A forward is deleted as its DNAT rule plus one copy of its target's ACCEPT rule: both must exist
+        nat, accept = Counter(state["nat"]), Counter(state["filter"])
+        installed = []
+        for fw in remove:
+            if nat[fw] and accept[_target(fw)]:
+                nat[fw] -= 1
+                accept[_target(fw)] -= 1
+                installed.append(fw)
+        return installed
+
+    async def read_counters(self) -> dict | None:
+        """nat rules only see the first packet of a connection (-> connections); the ACCEPT rule of
+        the target counts client -> target traffic. Reply traffic is not matched by any rule."""
+        state = await self._save(counters=True)
+        if state is None:
+            return None
+        nat, accept = state["counters"]["nat"], state["counters"]["filter"]
+        counters = {}
+        for fw in set(state["nat"]):
+            packets_in, bytes_in = accept.get(_target(fw), (None, None))
+            counters[fw] = {"bytes_in": bytes_in, "bytes_out": None, "packets_in": packets_in,
+                            "packets_out": None, "connections": nat[fw][0]}
+        return counters
+
+    def forwards(self, state):
+        return state["nat"]
+
+    def _plan(self, state, desired):
+        nat_have, nat_want = Counter(state["nat"]), Counter(desired)
+        acc_have, acc_want = Counter(state["filter"]), Counter(_target(fw) for fw in desired)
+        nat = ([f"-D {rule}" for rule in state["foreign"]["nat"]]
+               + [f"-D {self.nat_rule(fw)}" for fw in (nat_have - nat_want).elements()]
+               + [f"-A {self.nat_rule(fw)}" for fw in (nat_want - nat_have).elements()])
+        filter = ([f"-D {rule}" for rule in state["foreign"]["filter"]]
+                  + [f"-D {self._accept_rule(t)}" for t in (acc_have - acc_want).elements()]
+                  + [f"-A {self._accept_rule(t)}" for t in (acc_want - acc_have).elements()])
+        if not nat and not filter:
+            return None
+        return self._script(nat, filter)
+
+    async def _run_plan(self, plan):
+        return await self._restore(plan)
+
+class NftablesBackend(RulesetBackend):
+    """One nftables table holding the forwards in a map keyed by (protocol, port).
+
+    A single prerouting rule DNATs through the map, so the per-packet lookup is a hash lookup
+    however many forwards exist, and a change only adds/deletes map elements. Every change is
+    one `nft -j -f -` JSON batch, which the kernel applies as a single transaction.
+    """
+    name = "nftables"
+    tools = ("nft",)
+
+    def __init__(self, table: str):
+        super().__init__()
+        self.table = table
+        self.map = "forwards"
+
+    def _ref(self, **extra) -> dict:
+        return {"family": "ip", "table": self.table, **extra}
+
+    def _key(self, fw: Forward) -> dict:
+        return {"concat": [fw.protocol, fw.source_port]}
+
+    def _element(self, fw: Forward) -> list:
+        return [self._key(fw), {"concat": [fw.target_host, fw.target_port]}]
+
+    def _elements(self, op: str, elems: list) -> dict:
+        return {op: {"element": self._ref(name=self.map, elem=elems)}}
+
+    def _skeleton(self) -> list:
+        """Table, map and chains (idempotent adds); the rules are rewritten, map elements kept"""
+        l4 = {"meta": {"key": "l4proto"}}
+        dport = {"payload": {"protocol": "th", "field": "dport"}}
         return [
-            "iptables", "-t", "nat", "-D", "PREROUTING",
-            "-p", protocol, "--dport", str(source_port),
-            "-j", "DNAT", "--to-destination", f"{target_host}:{target_port}"
+            {"add": {"table": {"family": "ip", "name": self.table}}},
+            {"add": {"map": self._ref(name=self.map, type=["inet_proto", "inet_service"],
+                                      map=["ipv4_addr", "inet_service"])}},
+            {"add": {"chain": self._ref(name="prerouting", type="nat", hook="prerouting", prio=-100, policy="accept")}},
+            {"add": {"chain": self._ref(name="forward", type="filter", hook="forward", prio=0, policy="accept")}},
+            {"flush": {"chain": self._ref(name="prerouting")}},
+            {"flush": {"chain": self._ref(name="forward")}},
+            {"add": {"rule": self._ref(chain="prerouting", expr=[
+                {"dnat": {"family": "ip", "addr": {"map": {"key": {"concat": [l4, dport]}, "data": f"@{self.map}"}}}},
+            ])}},
+            # Let the translated connections through the forward hook
+            {"add": {"rule": self._ref(chain="forward", expr=[
+                {"match": {"op": "in", "left": {"ct": {"key": "status"}}, "right": "dnat"}},
+                {"accept": None},
+            ])}},
         ]
 
-    @staticmethod
-    async def create_port_forward(source_port: int, target_host: str, target_port: int, protocol: str = "tcp") -> bool:
-        """Create a port forwarding rule"""
-        # Check if iptables is available
-        if not await PortForwardManager.check_iptables_available():
-            log.error("iptables is not available on this system")
+    async def _batch(self, commands: list) -> bool:
+        if not commands:
+            return True
+        returncode, _, stderr = await _run_command(["nft", "-j", "-f", "-"], input=json.dumps({"nftables": commands}))
+        if returncode != 0:
+            log.error(f"nft batch failed: {stderr.strip()}")
             return False
+        return True
 
-        # Add the DNAT rule
-        rule_cmd = PortForwardManager._get_iptables_rule(source_port, target_host, target_port, protocol)
-        returncode, stdout, stderr = await PortForwardManager._run_command(rule_cmd)
-        
-        if returncode != 0:
-            log.error(f"Failed to create port forward rule: {stderr}")
+    async def _setup(self) -> bool:
+        if not await self._batch(self._skeleton()):
             return False
+        await _run_command(["sysctl", "-w", "net.ipv4.ip_forward=1"])
+        return True
 
-        # Enable IP forwarding if not already enabled
-        forward_cmd = ["sysctl", "-w", "net.ipv4.ip_forward=1"]
-        await PortForwardManager._run_command(forward_cmd)
+    async def _apply(self, add, remove):
+        commands = []
+        if remove:
+            commands.append(self._elements("delete", [self._key(fw) for fw in remove]))
+        if add:
+            commands.append(self._elements("add", [self._element(fw) for fw in add]))
+        return await self._batch(commands)
 
-        # Add FORWARD rule to accept the traffic
-        forward_rule = [
-            "iptables", "-A", "FORWARD",
-            "-p", protocol, "--dport", str(target_port),
-            "-d", target_host, "-j", "ACCEPT"
-        ]
-        await PortForwardManager._run_command(forward_rule)
+    async def withdraw(self, installed, owners=()):
+        # One element per (protocol, port): deleting ours deletes the owner's too, so put it back
+        # in the same transaction
+        return await self.apply_changes(add=owners, remove=installed)
+
+    def _installed(self, state, remove):
+        # Elements are deleted by key: whatever target the kernel holds for the port
+        keys = {(fw.protocol, fw.source_port) for fw in state}
+        return [fw for fw in remove if (fw.protocol, fw.source_port) in keys]
+
+    async def _replace(self, forwards):
+        commands = [*self._skeleton(), {"flush": {"map": self._ref(name=self.map)}}]
+        if forwards:
+            commands.append(self._elements("add", [self._element(fw) for fw in forwards]))
+        return await self._batch(commands)
+
+    async def read_state(self) -> list | None:
+        """Map elements from one `nft -j list map`"""
+        returncode, stdout, stderr = await _run_command(["nft", "-j", "list", "map", "ip", self.table, self.map])
+        if returncode != 0:
+            log.error(f"Failed to list nftables map: {stderr.strip()}")
+            return None
+        forwards = []
+        for item in json.loads(stdout).get("nftables", []):
+            for key, value in item.get("map", {}).get("elem", []):
+                protocol, source_port = key["concat"]
+                target_host, target_port = value["concat"]
+                forwards.append(Forward(int(source_port), target_host, int(target_port), protocol))
+        return forwards
+
+    def forwards(self, state):
+        return state
+
+class UserspaceBackend(RulesetBackend):
+    """Forwards relayed by this process (services/relay.py); needs no firewall privileges"""
+    name = "userspace"
+
+    def available(self) -> bool:
+        return True
+
+    async def _setup(self) -> bool:
+        return True
+
+    async def _apply(self, add, remove):
+        return await relay_engine.apply(add, remove)
+
+    async def _replace(self, forwards):
+        return await self._apply(*(self._plan(relay_engine.forwards(), forwards) or ([], [])))
+
+    async def read_state(self) -> list:
+        return relay_engine.forwards()
+
+    def forwards(self, state):
+        return state
+
+    async def read_counters(self) -> dict:
+        return {fw: {name: getattr(stats, name) for name in ("bytes_in", "bytes_out", "packets_in", "packets_out", "connections")}
+                for fw, stats in relay_engine.stats().items()}
+
+    async def close(self):
+        await relay_engine.close()
+
+def _make_backend() -> RulesetBackend:
+    if settings.PORT_FORWARD_BACKEND == "userspace":
+        return UserspaceBackend()
+    if settings.PORT_FORWARD_BACKEND == "nftables":
+        return NftablesBackend(settings.PORT_FORWARD_CHAIN_PREFIX.lower())
+    if settings.PORT_FORWARD_BACKEND != "iptables":
+        log.warning(f"Unknown PORT_FORWARD_BACKEND={settings.PORT_FORWARD_BACKEND!r}, using iptables")
+    return IptablesBackend(settings.PORT_FORWARD_CHAIN_PREFIX)
+
+class PortForwardManager:
+    """Manages kernel port forwarding rules (iptables or nftables, see PORT_FORWARD_BACKEND)"""
+
+    backend = _make_backend()
 
+    @staticmethod
+    async def check_iptables_available() -> bool:
+        """Check if the configured firewall tool is available on the system"""
+        return PortForwardManager.backend.available()
+
+    @staticmethod
+    async def apply_changes(add: Iterable[Forward] = (), remove: Iterable[Forward] = ()) -> bool:
+        """Add and remove any number of forwards in one atomic batch"""
+        return await PortForwardManager.backend.apply_changes(add, remove)
+
+    @staticmethod
+    async def withdraw(installed: Iterable[Forward], owners: Iterable[Forward] = ()) -> bool:
+        """Remove forwards this request installed for ports that `owners` (another worker) hold"""
+        return await PortForwardManager.backend.withdraw(list(installed), list(owners))
+
+    @staticmethod
+    async def replace_all(forwards: Iterable[Forward]) -> bool:
+        """Make the kernel state contain exactly `forwards` (one atomic batch)"""
+        return await PortForwardManager.backend.replace_all(forwards)
+
+    @staticmethod
+    async def create_port_forward(source_port: int, target_host: str, target_port: int, protocol: str = "tcp") -> bool:
+        """Create a port forwarding rule"""
+        fw = Forward(source_port, target_host, target_port, protocol)
+        if not await PortForwardManager.apply_changes(add=[fw]):
+            return False
         log.info(f"Created port forward: {source_port} -> {target_host}:{target_port} ({protocol})")
         return True
 
     @staticmethod
     async def delete_port_forward(source_port: int, target_host: str, target_port: int, protocol: str = "tcp") -> bool:
         """Delete a port forwarding rule"""
-        if not await PortForwardManager.check_iptables_available():
-            log.error("iptables is not available on this system")
+        fw = Forward(source_port, target_host, target_port, protocol)
+        if not PortForwardManager.backend.available():
+            log.error(f"{PortForwardManager.backend.name} is not available on this system")
             return False
-
-        # Remove the DNAT rule
-        delete_cmd = PortForwardManager._get_iptables_delete_rule(source_port, target_host, target_port, protocol)
-        returncode, stdout, stderr = await PortForwardManager._run_command(delete_cmd)
-        
-        if returncode != 0:
-            log.warning(f"Failed to delete port forward rule (may not exist): {stderr}")
-
-        # Remove FORWARD rule
-        delete_forward_rule = [
-            "iptables", "-D", "FORWARD",
-            "-p", protocol, "--dport", str(target_port),
-            "-d", target_host, "-j", "ACCEPT"
-        ]
-        await PortForwardManager._run_command(delete_forward_rule)
-
+        if not await PortForwardManager.apply_changes(remove=[fw]):
+            log.warning(f"Failed to delete port forward rule (may not exist): {fw}")
         log.info(f"Deleted port forward: {source_port} -> {target_host}:{target_port} ({protocol})")
         return True
 
     @staticmethod
-    async def list_port_forwards() -> List[Dict]:
-        """List current iptables DNAT rules"""
-        if not await PortForwardManager.check_iptables_available():
-            return []
+    async def reconcile(desired: Iterable[Forward], apply: bool = True) -> dict:
+        """Drift report between `desired` and the kernel; fixed in one batch when `apply`"""
+        return await PortForwardManager.backend.reconcile(desired, apply)
 
-        cmd = ["iptables", "-t", "nat", "-L", "PREROUTING", "-n", "--line-numbers"]
-        returncode, stdout, stderr = await PortForwardManager._run_command(cmd)
-        
-        if returncode != 0:
-            log.error(f"Failed to list iptables rules: {stderr}")
-            return []
+    @staticmethod
+    async def read_counters() -> dict | None:
+        """Cumulative per-forward counters from the backend (None if it has none)"""
+        if not PortForwardManager.backend.available():
+            return None
+        return await PortForwardManager.backend.read_counters()
 
-        rules = []
-        for line in stdout.split('\n')[2:]:  # Skip header lines
-            if 'DNAT' in line and '--to-destination' in line:
-                parts = line.split()
-                if len(parts) >= 6:
-                    try:
-                        # Parse the rule (this is a simplified parser)
-                        protocol = parts[2] if parts[2] != 'all' else 'tcp'
-                        dport_idx = next(i for i, part in enumerate(parts) if 'dpt:' in part)
-                        source_port = parts[dport_idx].split(':')[1]
-                        
-                        dest_idx = next(i for i, part in enumerate(parts) if '--to-destination' in part)
-                        destination = parts[dest_idx + 1] if dest_idx + 1 < len(parts) else parts[dest_idx].split('--to-destination')[1]
-                        
-                        if ':' in destination:
-                            target_host, target_port = destination.split(':')
-                        else:
-                            target_host, target_port = destination, source_port
-                            
-                        rules.append({
-                            'source_port': int(source_port),
-                            'target_host': target_host,
-                            'target_port': int(target_port),
-                            'protocol': protocol
-                        })
-                    except (ValueError, StopIteration, IndexError) as e:
-                        log.warning(f"Failed to parse iptables rule: {line}, error: {e}")
-                        continue
-
-        return rules
+    @staticmethod
+    async def list_port_forwards() -> List[Dict]:
+        """List the forwards currently installed in the kernel"""
+        if not PortForwardManager.backend.available():
+            return []
+        return await PortForwardManager.backend.list_rules()
 
     @staticmethod
     async def enable_port_forward(source_port: int, target_host: str, target_port: int, protocol: str = "tcp") -> bool:
@@ -156,3 +587,34 @@ class PortForwardManager:
     async def disable_port_forward(source_port: int, target_host: str, target_port: int, protocol: str = "tcp") -> bool:
         """Disable an existing port forward rule"""
         return await PortForwardManager.delete_port_forward(source_port, target_host, target_port, protocol)
+
+    @staticmethod
+    def invalid_reason(fw: Forward) -> str | None:
+        """Why the backend would reject `fw`, or None if it is a valid rule"""
+        try:
+            _checked(fw)
+        except ValueError as e:
+            return str(e)
+        return None
+
+    @staticmethod
+    async def move_port_forward(old: Forward, new: Forward) -> bool:
+        """Retarget a rule: the old rule is removed and the new one added in the same transaction"""
+        return await PortForwardManager.apply_changes(add=[new], remove=[old])
+
+async def reconcile_port_forwards(db: Session, apply: bool = True) -> dict:
+    """Bring the kernel in line with the active PortForward rows (startup, schedule, on demand)"""
+    if not PortForwardManager.backend.available():
+        return {"ok": False, "error": f"{PortForwardManager.backend.name} is not available on this system"}
+    desired = [
+        Forward(pf.source_port, pf.target_host, pf.target_port, pf.protocol)
+        for pf in db.query(PortForward).filter(PortForward.active == True).all()
+    ]
+    report = await PortForwardManager.reconcile(desired, apply)
+    if report.get("ok") and not report["in_sync"]:
+        log.warning(
+            f"Port forward drift: {len(report['missing'])} missing, {len(report['unexpected'])} unexpected, "
+            f"{len(report['changed'])} changed, {report['duplicates']} duplicate"
+            + (" (fixed)" if report["applied"] else "")
+        )
+    return report
@@ -0,0 +1,132 @@
+import threading
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import PortForward
+
+PROTOCOLS = ("tcp", "udp")
+
+class PortIndex:
+    """Listening ports held by active forwards: one 65536-bit map per protocol.
+
+    Checks and reservations are O(1) and atomic within the process; the partial unique index
+    on port_forwards catches what another worker reserved at the same time. Other workers'
+    changes are picked up by reload(): on the reconcile schedule, and whenever a claim finds
+    its port taken (it may have been freed elsewhere since the last load).
+
+    Reservations not yet committed are pending: a reload keeps them, as well as those settled
+    while it was reading, since neither is visible in its snapshot.
+    """
+
+    def __init__(self):
+        self._bits = {protocol: bytearray(65536 // 8) for protocol in PROTOCOLS}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._pending: set = set()   # (protocol, port) reserved here, not committed yet
+        self._settled: set = set()   # committed since the running reload started
+
+    def ensure_loaded(self, db: Session):
+        if not self._loaded:
+            self.reload(db)
+
+    def reload(self, db: Session):
+        with self._lock:
+            self._settled = set()
+        rows = db.execute(select(PortForward.protocol, PortForward.source_port).where(PortForward.active == True)).all()
+        bits = {protocol: bytearray(65536 // 8) for protocol in PROTOCOLS}
+        with self._lock:
+            for protocol, port in [*rows, *self._pending, *self._settled]:
+                if protocol in bits:
+                    bits[protocol][port >> 3] |= 1 << (port & 7)
+            self._bits = bits
+            self._loaded = True
+
+    def taken(self, protocol: str, port: int) -> bool:
+        return bool(self._bits[protocol][port >> 3] & (1 << (port & 7)))
+
+    def reserve(self, protocol: str, port: int) -> bool:
+        """Claim a port; False if it is already held. Follow with settle() once committed, or release()"""
+        with self._lock:
+            if self.taken(protocol, port):
+                return False
+            self._bits[protocol][port >> 3] |= 1 << (port & 7)
+            self._pending.add((protocol, port))
+            return True
+
+    def reserve_many(self, items: list) -> list[bool]:
+        """Claim every free (protocol, port) of `items` in one step; a port repeated in `items` is granted once"""
+        with self._lock:
+            granted = []
+            for protocol, port in items:
+                ok = not self.taken(protocol, port)
+                if ok:
+                    self._bits[protocol][port >> 3] |= 1 << (port & 7)
+                    self._pending.add((protocol, port))
+                granted.append(ok)
+            return granted
+
+    def claim(self, db: Session, protocol: str, port: int) -> bool:
+        """reserve(), resyncing once from the database if the port looks taken"""
+        self.ensure_loaded(db)
+        if self.reserve(protocol, port):
+            return True
+        self.reload(db)
+        return self.reserve(protocol, port)
+
+    def claim_many(self, db: Session, items: list) -> list[bool]:
+        """reserve_many(), resyncing once from the database if any port looks taken"""
+        self.ensure_loaded(db)
+        granted = self.reserve_many(items)
+        denied = [i for i, ok in enumerate(granted) if not ok]
+        if denied:
+            self.reload(db)
+            for i, ok in zip(denied, self.reserve_many([items[i] for i in denied])):
+                granted[i] = ok
+        return granted
+
+    def settle(self, items: list):
+        """The reservations of `items` are committed (or lost to another worker): the database holds them now"""
+        with self._lock:
+            for item in items:
+                if item in self._pending:
+                    self._pending.discard(item)
+                    self._settled.add(item)
+
+    def release(self, protocol: str, port: int):
+        with self._lock:
+            self._bits[protocol][port >> 3] &= ~(1 << (port & 7)) & 0xFF
+            self._pending.discard((protocol, port))
+
+    def free(self, protocol: str, count: int, start: int, end: int) -> list[int]:
+        """First `count` free ports in [start, end]"""
+        bits = self._bits[protocol]
+        ports = []
+        port = start
+        while port <= end and len(ports) < count:
+            byte = bits[port >> 3]
+            if byte == 0xFF:
+                port = (port | 7) + 1  # whole byte taken
+                continue
+            if not byte & (1 << (port & 7)):
+                ports.append(port)
+            port += 1
+        return ports
+
+    def free_ranges(self, protocol: str, size: int, count: int, start: int, end: int) -> list[tuple[int, int]]:
+        """First `count` runs of `size` consecutive free ports in [start, end]"""
+        ranges = []
+        run_start, port = None, start
+        bits = self._bits[protocol]
+        while port <= end and len(ranges) < count:
+            if bits[port >> 3] & (1 << (port & 7)):
+                run_start = None
+            else:
+                if run_start is None:
+                    run_start = port
+                if port - run_start + 1 == size:
+                    ranges.append((run_start, port))
+                    run_start = None
+            port += 1
+        return ranges
+
+port_index = PortIndex()
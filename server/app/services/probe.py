@@ -0,0 +1,183 @@
+import asyncio
+import heapq
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from ..config import settings
+from ..db import SessionLocal
+from ..models import PortForward
+from ..utils.logging import get_logger
+
+log = get_logger(__name__)
+
+UP, DOWN, NO_REPLY, PENDING = "up", "down", "no_reply", "pending"
+
+class _Target:
+    __slots__ = ("host", "port", "protocol", "latencies", "status", "failures", "checked_at", "error", "running", "due")
+
+    def __init__(self, host: str, port: int, protocol: str):
+        self.host, self.port, self.protocol = host, port, protocol
+        self.latencies = deque(maxlen=settings.PROBE_WINDOW)  # ms of successful probes
+        self.status = PENDING
+        self.failures = 0
+        self.checked_at: datetime | None = None
+        self.error: str | None = None
+        self.running = False
+        self.due = 0.0
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 2) if ordered else None
+
+        return {
+            "status": self.status,
+            "latency_ms": {"last": round(self.latencies[-1], 2) if self.latencies else None,
+                           "p50": pct(50), "p90": pct(90), "p99": pct(99)},
+            "samples": len(ordered),
+            "consecutive_failures": self.failures,
+            "checked_at": self.checked_at.isoformat() if self.checked_at else None,
+            "error": self.error,
+        }
+
+class _UdpEcho(asyncio.DatagramProtocol):
+    def __init__(self, done: asyncio.Future):
+        self.done = done
+
+    def connection_made(self, transport):
+        transport.sendto(b"\0")
+
+    def datagram_received(self, data, addr):
+        if not self.done.done():
+            self.done.set_result(True)
+
+    def error_received(self, exc):
+        if not self.done.done():
+            self.done.set_exception(exc)
+
+async def _probe_tcp(host: str, port: int):
+    _, writer = await asyncio.open_connection(host, port)
+    writer.transport.abort()
+
+async def _probe_udp(host: str, port: int):
+    done = asyncio.get_running_loop().create_future()
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: _UdpEcho(done), remote_addr=(host, port))
+    try:
+        await done
+    finally:
+        transport.close()
+
+class ProbeScheduler:
+    """Checks every active port-forward target (TCP connect / UDP echo) about once per
+    PROBE_INTERVAL_SEC, with jitter so probes are spread over the interval, at most
+    PROBE_CONCURRENCY at a time. Results (status, rolling latency percentiles) stay in memory.
+
+    Rules sharing a target share its probe.
+    """
+
+    def __init__(self):
+        self._targets: dict[tuple, _Target] = {}
+        self._rules: dict[str, tuple] = {}
+        self._heap: list = []
+        self._task: asyncio.Task | None = None
+        self._probes: set = set()
+
+    async def start(self):
+        self._semaphore = asyncio.Semaphore(settings.PROBE_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        for task in list(self._probes):
+            task.cancel()
+
+    def _interval(self) -> float:
+        jitter = settings.PROBE_INTERVAL_SEC * settings.PROBE_JITTER
+        return settings.PROBE_INTERVAL_SEC + random.uniform(-jitter, jitter)
+
+    def _schedule(self, target: _Target, due: float):
+        target.due = due
+        heapq.heappush(self._heap, (due, (target.host, target.port, target.protocol)))
+
+    def _refresh(self):
+        db = SessionLocal()
+        try:
+            rows = db.query(PortForward.id, PortForward.target_host, PortForward.target_port, PortForward.protocol) \
+                .filter(PortForward.active == True).all()
+        finally:
+            db.close()
+        self._rules = {id: (host, port, protocol) for id, host, port, protocol in rows}
+        wanted = set(self._rules.values())
+        now = time.monotonic()
+        for key in wanted - set(self._targets):
+            target = self._targets[key] = _Target(*key)
+            # first probes spread over a few seconds, not all at once
+            self._schedule(target, now + random.uniform(0, min(settings.PROBE_INTERVAL_SEC, 5)))
+        for key in set(self._targets) - wanted:
+            del self._targets[key]  # its heap entry is skipped when it comes up
+
+    async def _run(self):
+        next_refresh = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_refresh:
+                try:
+                    await asyncio.to_thread(self._refresh)
+                except Exception as e:
+                    log.warning(f"Probe target refresh failed: {e}")
+                next_refresh = now + settings.PROBE_REFRESH_SEC
+            while self._heap and self._heap[0][0] <= now:
+                due, key = heapq.heappop(self._heap)
+                target = self._targets.get(key)
+                if target is None or target.due != due:
+                    continue  # removed, or superseded by a newer entry
+                self._schedule(target, now + self._interval())
+                if target.running:
+                    continue
+                target.running = True
+                task = asyncio.create_task(self._probe(target))
+                self._probes.add(task)
+                task.add_done_callback(self._probes.discard)
+            wake = min(self._heap[0][0] if self._heap else next_refresh, next_refresh)
+            await asyncio.sleep(max(wake - time.monotonic(), 0.01))
+
+    async def _probe(self, target: _Target):
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    probe = _probe_udp if target.protocol == "udp" else _probe_tcp
+                    await asyncio.wait_for(probe(target.host, target.port), settings.PROBE_TIMEOUT_SEC)
+                except asyncio.TimeoutError:
+                    if target.protocol == "udp":
+                        # Silence is normal for UDP services; only an ICMP error proves it is down
+                        target.status, target.error = NO_REPLY, None
+                    else:
+                        self._failed(target, f"timeout after {settings.PROBE_TIMEOUT_SEC}s")
+                except OSError as e:
+                    self._failed(target, e.strerror or type(e).__name__)
+                else:
+                    target.latencies.append((time.perf_counter() - started) * 1000)
+                    target.status, target.error, target.failures = UP, None, 0
+                target.checked_at = datetime.now(timezone.utc)
+        finally:
+            target.running = False
+
+    def _failed(self, target: _Target, error: str):
+        target.status, target.error = DOWN, error
+        target.failures += 1
+
+    def health(self, rule_id: str) -> dict | None:
+        key = self._rules.get(rule_id)
+        target = self._targets.get(key) if key else None
+        return target.snapshot() if target else None
+
+    def all(self) -> dict:
+        return {rule_id: self._targets[key].snapshot() for rule_id, key in self._rules.items() if key in self._targets}
+
+probe_scheduler = ProbeScheduler()
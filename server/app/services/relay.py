@@ -0,0 +1,357 @@
+import asyncio
+import time
+from ..config import settings
+from ..utils.logging import get_logger
+
+log = get_logger(__name__)
+
+class RuleStats:
+    __slots__ = ("bytes_in", "bytes_out", "packets_in", "packets_out", "connections", "active", "rejected")
+
+    def __init__(self):
+        self.bytes_in = self.bytes_out = 0        # client -> target / target -> client
+        self.packets_in = self.packets_out = 0    # reads (TCP) or datagrams (UDP)
+        self.connections = self.active = self.rejected = 0
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class _Pipe(asyncio.BufferedProtocol):
+    """One side of a TCP relay: what is read here is written to `peer`.
+
+    Reads land in a preallocated buffer reused for every read; each read is copied once on its
+    way to the peer (the transport may keep data it cannot send right away). Flow control is
+    end-to-end: when the peer's send buffer fills up this side stops reading.
+    """
+
+    def __init__(self, rule: "_Rule", inbound: bool, peer: "_Pipe | None" = None):
+        self.rule = rule
+        self.inbound = inbound
+        self.peer = peer
+        self.transport = None
+        self._view = memoryview(bytearray(settings.RELAY_BUFFER_SIZE))
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self._view
+
+    def buffer_updated(self, nbytes):
+        stats = self.rule.stats
+        if self.inbound:
+            stats.bytes_in += nbytes
+            stats.packets_in += 1
+        else:
+            stats.bytes_out += nbytes
+            stats.packets_out += 1
+        # bytes(): the transport may keep what it cannot send right away, and this buffer is reused
+        self.peer.transport.write(bytes(self._view[:nbytes]))
+
+    def eof_received(self):
+        if self.peer and self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+            return True  # half-close: keep relaying the other direction
+        return False
+
+    def pause_writing(self):
+        if self.peer:
+            self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.peer:
+            self.peer.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        if self.peer and self.peer.transport:
+            self.peer.transport.close()
+
+class _UdpSession(asyncio.DatagramProtocol):
+    """Upstream socket of one client address"""
+
+    def __init__(self, listener: "_UdpListener", client):
+        self.listener = listener
+        self.client = client
+        self.transport = None
+        self.pending: list[bytes] = []
+        self.opening: asyncio.Task | None = None
+        self.last_seen = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for data in self.pending:
+            transport.sendto(data)
+        self.pending.clear()
+
+    def send(self, data: bytes):
+        self.last_seen = time.monotonic()
+        if self.transport is None:
+            self.pending.append(data)
+        else:
+            self.transport.sendto(data)
+
+    def datagram_received(self, data, addr):
+        self.last_seen = time.monotonic()
+        stats = self.listener.rule.stats
+        stats.bytes_out += len(data)
+        stats.packets_out += 1
+        self.listener.transport.sendto(data, self.client)
+
+    def error_received(self, exc):
+        log.debug(f"UDP relay error for {self.client}: {exc}")
+
+class _UdpListener(asyncio.DatagramProtocol):
+    def __init__(self, rule: "_Rule"):
+        self.rule = rule
+        self.transport = None
+        self.sessions: dict = {}
+        self._closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def datagram_received(self, data, addr):
+        stats = self.rule.stats
+        session = self.sessions.get(addr)
+        if session is None:
+            if len(self.sessions) >= self.rule.limit:
+                stats.rejected += 1
+                return
+            session = self.sessions[addr] = _UdpSession(self, addr)
+            stats.connections += 1
+            stats.active = len(self.sessions)
+            session.opening = asyncio.get_running_loop().create_task(self._open(session))
+        stats.bytes_in += len(data)
+        stats.packets_in += 1
+        session.send(data)
+
+    async def _open(self, session: _UdpSession):
+        fw = self.rule.forward
+        try:
+            await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: session, remote_addr=(fw.target_host, fw.target_port))
+        except OSError as e:
+            log.warning(f"UDP relay {fw.source_port} -> {fw.target_host}:{fw.target_port} failed: {e}")
+            self.drop(session)
+            return
+        if self.sessions.get(session.client) is not session:
+            session.transport.close()  # expired or removed while connecting
+
+    def drop(self, session: _UdpSession):
+        if self.sessions.get(session.client) is session:
+            del self.sessions[session.client]
+            self.rule.stats.active = len(self.sessions)
+        if session.transport is not None:
+            session.transport.close()
+
+    def expire(self, idle_before: float):
+        for session in [s for s in self.sessions.values() if s.last_seen < idle_before]:
+            self.drop(session)
+
+    async def close(self):
+        """Close every session and the listening socket; returns once the port is released
+        (transport.close() only lets go of the socket on a later loop iteration)"""
+        for session in list(self.sessions.values()):
+            self.drop(session)
+        if self.transport is not None:
+            self.transport.close()
+            await self._closed
+
+class _Rule:
+    def __init__(self, forward, limit: int):
+        self.forward = forward
+        self.limit = limit
+        self.stats = RuleStats()
+        self.server: asyncio.AbstractServer | None = None
+        self.udp: _UdpListener | None = None
+        self.clients: set[_Pipe] = set()
+
+    def closed(self, pipe: _Pipe):
+        self.clients.discard(pipe)
+        self.stats.active = len(self.clients)
+
+class _Acceptor(_Pipe):
+    """Client side of a TCP relay; connects upstream before any data is relayed"""
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        rule = self.rule
+        if len(rule.clients) >= rule.limit:
+            rule.stats.rejected += 1
+            transport.abort()
+            return
+        rule.clients.add(self)
+        rule.stats.connections += 1
+        rule.stats.active = len(rule.clients)
+        transport.pause_reading()
+        self._connecting = asyncio.get_running_loop().create_task(self._connect())
+
+    async def _connect(self):
+        fw = self.rule.forward
+        loop = asyncio.get_running_loop()
+        try:
+            # Paired from the start: targets that speak first (SSH, SMTP, MySQL banners) can write
+            # to the client before this coroutine resumes
+            _, upstream = await asyncio.wait_for(
+                loop.create_connection(lambda: _Pipe(self.rule, inbound=False, peer=self),
+                                       fw.target_host, fw.target_port),
+                settings.RELAY_CONNECT_TIMEOUT_SEC)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug(f"TCP relay {fw.source_port} -> {fw.target_host}:{fw.target_port} failed: {e}")
+            self.transport.close()
+            return
+        if self.transport.is_closing():
+            upstream.transport.close()
+            return
+        self.peer = upstream
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        self.rule.closed(self)
+        super().connection_lost(exc)
+
+class RelayEngine:
+    """In-process TCP/UDP port forwarding for hosts where the firewall cannot be changed
+    (no NET_ADMIN). Rules are added and removed on the running loop without a restart.
+    """
+
+    def __init__(self):
+        self._rules: dict = {}
+        self._sweeper: asyncio.Task | None = None
+
+    def forwards(self) -> list:
+        return list(self._rules)
+
+    def stats(self) -> dict:
+        return {fw: rule.stats for fw, rule in self._rules.items()}
+
+    async def add(self, fw, limit: int | None = None):
+        """Start listening for `fw`; raises OSError if the port cannot be bound"""
+        if fw in self._rules:
+            return
+        rule = _Rule(fw, limit or settings.RELAY_MAX_CONNECTIONS_PER_RULE)
+        loop = asyncio.get_running_loop()
+        if fw.protocol == "udp":
+            _, rule.udp = await loop.create_datagram_endpoint(
+                lambda: _UdpListener(rule), local_addr=(settings.RELAY_LISTEN_HOST, fw.source_port))
+            self._ensure_sweeper()
+        else:
+            rule.server = await loop.create_server(
+                lambda: _Acceptor(rule, inbound=True), settings.RELAY_LISTEN_HOST, fw.source_port,
+                reuse_address=True, backlog=1024)
+        self._rules[fw] = rule
+
+    async def remove(self, fw):
+        """Stop listening for `fw` and drop its connections"""
+        rule = self._rules.pop(fw, None)
+        if rule is None:
+            return
+        if rule.server is not None:
+            rule.server.close()
+            for pipe in list(rule.clients):
+                pipe.transport.abort()
+        if rule.udp is not None:
+            await rule.udp.close()  # so the port can be bound again right away (retarget)
+
+    async def apply(self, add: list, remove: list) -> bool:
+        """Remove then add; if any add fails the batch is rolled back"""
+        removed = [fw for fw in remove if fw in self._rules]
+        for fw in removed:
+            await self.remove(fw)
+        added = []
+        for fw in add:
+            try:
+                await self.add(fw)
+                added.append(fw)
+            except OSError as e:
+                log.error(f"Cannot listen on {fw.protocol}/{fw.source_port}: {e}")
+                for done in added:
+                    await self.remove(done)
+                for fw in removed:
+                    try:
+                        await self.add(fw)
+                    except OSError as e:
+                        log.error(f"Rollback could not restore {fw.protocol}/{fw.source_port}: {e}")
+                return False
+        return True
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+
+    async def _sweep(self):
+        """Expire idle UDP sessions"""
+        idle = settings.RELAY_UDP_IDLE_SEC
+        while any(rule.udp for rule in self._rules.values()):
+            await asyncio.sleep(max(idle / 4, 1))
+            cutoff = time.monotonic() - idle
+            for rule in list(self._rules.values()):
+                if rule.udp is not None:
+                    rule.udp.expire(cutoff)
+
+    async def close(self):
+        for fw in list(self._rules):
+            await self.remove(fw)
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+
+relay_engine = RelayEngine()
+
+async def benchmark(seconds: float = 5.0, chunk: int = 256 * 1024, streams: int = 1) -> dict:
+    """Loopback throughput through the relay: client -> relay -> sink"""
+    from .portforward import Forward
+
+    received = 0
+
+    class Sink(asyncio.Protocol):
+        def data_received(self, data):
+            nonlocal received
+            received += len(data)
+
+    loop = asyncio.get_running_loop()
+    sink = await loop.create_server(Sink, "127.0.0.1", 0)
+    sink_port = sink.sockets[0].getsockname()[1]
+    probe = await loop.create_server(asyncio.Protocol, "127.0.0.1", 0)
+    relay_port = probe.sockets[0].getsockname()[1]
+    probe.close()
+
+    engine = RelayEngine()
+    fw = Forward(relay_port, "127.0.0.1", sink_port, "tcp")
+    await engine.add(fw)
+    payload = b"\0" * chunk
+
+    async def stream():
+        _, writer = await asyncio.open_connection("127.0.0.1", relay_port)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            writer.write(payload)
+            await writer.drain()
+        writer.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(stream() for _ in range(streams)))
+    elapsed = time.monotonic() - started
+    await asyncio.sleep(0.2)
+    result = {
+        "seconds": round(elapsed, 2),
+        "streams": streams,
+        "relayed_bytes": engine.stats()[fw].bytes_in,
+        "delivered_bytes": received,
+        "mb_per_sec": round(received / elapsed / 1e6, 1),
+    }
+    await engine.close()
+    sink.close()
+    return result
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Loopback throughput of the userspace relay")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--chunk", type=int, default=256 * 1024)
+    parser.add_argument("--streams", type=int, default=1)
+    args = parser.parse_args()
+    print(asyncio.run(benchmark(args.seconds, args.chunk, args.streams)))
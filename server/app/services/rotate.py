@@ -8,6 +8,7 @@ from ..models import AuthKey, Event, User, Machine
 from ..tailscale import create_auth_key, revoke_auth_key
 from ..utils.security import encrypt_plain, mask_key
 from ..utils.logging import get_logger
+from ..websockets import notification_manager
 from .notify import announce
 
 log = get_logger(__name__)
@@ -28,8 +29,8 @@ async def _create_and_store_key(db: Session, user: User, machine: Machine | None
     db.add(k)
     db.add(Event(user_id=user.id, machine_id=machine.id if machine else None,
                  type="KEY_CREATED", message=f"{masked} exp={expires_at}"))
+    announce(db, f"[Key Created] user={user.email} key={masked} exp={expires_at}", kind="key_created")
     db.commit(); db.refresh(k)
-    await announce(f"[Key Created] user={user.email} key={masked} exp={expires_at}")
     return k
 
 async def rotate_if_necessary(db: Session):
@@ -39,6 +40,11 @@ async def rotate_if_necessary(db: Session):
     for k in keys:
         user = db.get(User, k.user_id)
         machine = db.get(Machine, k.machine_id) if k.machine_id else None
+        notification_manager.publish("keys.expiring", {
+            "type": "key_expiring",
+            "data": {"key_id": k.id, "masked": k.masked, "user_id": k.user_id,
+                     "expires_at": k.expires_at.isoformat() if k.expires_at else None}
+        }, attrs={"user_id": k.user_id})
         # 1) create new key
         new_k = await _create_and_store_key(db, user, machine,
                     desc=f"rotate of {k.masked}", ttl=k.ttl_seconds,
@@ -48,6 +54,7 @@ async def rotate_if_necessary(db: Session):
         k.active = False
         db.add(Event(user_id=user.id, machine_id=k.machine_id, type="KEY_ROTATED",
                      message=f"{k.masked} -> {new_k.masked}"))
+        announce(db, f"[Key Rotated] user={user.email} old={k.masked} new={new_k.masked}", kind="key_rotated")
         db.commit()
         if k.ts_key_id:
             try:
@@ -56,4 +63,8 @@ async def rotate_if_necessary(db: Session):
                 db.commit()
             except Exception as e:
                 log.warning(f"Failed to revoke old key {k.masked}: {e}")
-        await announce(f"[Key Rotated] user={user.email} old={k.masked} new={new_k.masked}")
+        notification_manager.publish("keys.rotated", {
+            "type": "key_rotated",
+            "data": {"old_key_id": k.id, "new_key_id": new_k.id, "user_id": user.id,
+                     "old": k.masked, "new": new_k.masked}
+        }, attrs={"user_id": user.id})
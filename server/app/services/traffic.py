@@ -0,0 +1,84 @@
+import time
+from collections import deque
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import PortForward
+from ..utils.logging import get_logger
+from .portforward import Forward, PortForwardManager
+
+log = get_logger(__name__)
+
+FIELDS = ("bytes_in", "bytes_out", "packets_in", "packets_out", "connections")
+
+class TrafficCollector:
+    """Per-forward traffic rates from the backend's cumulative counters.
+
+    Every sample reads all counters with one backend call and keeps, per rule, a ring buffer
+    of (timestamp, rate per field) points; counters that went backwards (rule re-created)
+    restart from zero.
+    """
+
+    def __init__(self):
+        self._series: dict[str, deque] = {}
+        self._last: dict[str, tuple[float, dict]] = {}
+        self.supported: bool | None = None
+        self.sampled_at: float | None = None
+
+    async def sample(self, db: Session):
+        counters = await PortForwardManager.read_counters()
+        self.supported = counters is not None
+        if counters is None:
+            return
+        now = time.time()
+        rows = db.query(PortForward.id, PortForward.source_port, PortForward.target_host,
+                        PortForward.target_port, PortForward.protocol).filter(PortForward.active == True).all()
+        active = set()
+        for id, source_port, target_host, target_port, protocol in rows:
+            current = counters.get(Forward(source_port, target_host, target_port, protocol))
+            if current is None:
+                continue
+            active.add(id)
+            previous = self._last.get(id)
+            self._last[id] = (now, current)
+            if previous is None:
+                continue
+            elapsed = now - previous[0]
+            rates = []
+            for field in FIELDS:
+                new, old = current[field], previous[1][field]
+                if new is None or old is None:
+                    rates.append(None)
+                else:
+                    rates.append(round((new - old if new >= old else new) / elapsed, 2))
+            series = self._series.get(id)
+            if series is None:
+                series = self._series[id] = deque(maxlen=settings.TRAFFIC_HISTORY_POINTS)
+            series.append((round(now), *rates))
+        for id in set(self._last) - active:
+            self._last.pop(id, None)
+            self._series.pop(id, None)
+        self.sampled_at = now
+
+    def latest(self, id: str) -> dict | None:
+        series = self._series.get(id)
+        if not series:
+            return None
+        ts, *rates = series[-1]
+        return {"at": ts, **{f"{field}_per_sec": rate for field, rate in zip(FIELDS, rates)},
+                "totals": self._last[id][1]}
+
+    def top(self, limit: int) -> list:
+        """Rules by current throughput (both directions), busiest first"""
+        rows = []
+        for id in self._series:
+            latest = self.latest(id)
+            if latest is not None:
+                rows.append({"id": id, **latest})
+        rows.sort(key=lambda r: (r["bytes_in_per_sec"] or 0) + (r["bytes_out_per_sec"] or 0), reverse=True)
+        return rows[:limit]
+
+    def series(self, id: str, since: float) -> list:
+        return [point for point in self._series.get(id, ()) if point[0] >= since]
+
+traffic_collector = TrafficCollector()
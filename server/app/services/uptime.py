@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import Device, DeviceSession
+from .device_sync import REMOVED, aware
+
+def _cumulative_online(db: Session, at: datetime, now: datetime, device_ids: list[str] | None = None) -> dict[str, float]:
+    """Online seconds accumulated by each device up to `at`.
+
+    For every device we only need the last session that started at or before `at`:
+    its `online_before` prefix sum plus the part of the session itself that falls before `at`.
+    The correlated LIMIT 1 subquery is one index seek per device on (device_id, started_at).
+    """
+    latest = (
+        select(DeviceSession.id)
+        .where(DeviceSession.device_id == Device.id, DeviceSession.started_at <= at)
+        .order_by(DeviceSession.started_at.desc())
+        .limit(1)
+        .correlate(Device)
+        .scalar_subquery()
+    )
+    q = select(Device.id, DeviceSession).outerjoin(DeviceSession, DeviceSession.id == latest)
+    if device_ids is not None:
+        q = q.where(Device.id.in_(device_ids))
+
+    totals = {}
+    for device_id, session in db.execute(q).all():
+        if session is None:
+            totals[device_id] = 0.0
+            continue
+        started = aware(session.started_at)
+        end = min(at, aware(session.ended_at) or now)
+        totals[device_id] = session.online_before + max(0.0, (end - started).total_seconds())
+    return totals
+
+def _window(start: datetime, end: datetime, now: datetime) -> tuple[datetime, datetime]:
+    start, end = aware(start), aware(min(aware(end), now))
+    if end <= start:
+        raise ValueError("end must be after start")
+    return start, end
+
+def fleet_uptime(db: Session, start: datetime, end: datetime, device_ids: list[str] | None = None) -> dict:
+    """Exact uptime of every mirrored device (and the fleet average) over [start, end]"""
+    now = datetime.now(timezone.utc)
+    start, end = _window(start, end, now)
+
+    before = _cumulative_online(db, start, now, device_ids)
+    after = _cumulative_online(db, end, now, device_ids)
+    q = db.query(Device.id, Device.created_at, Device.status, Device.updated_at)
+    if device_ids is not None:
+        q = q.filter(Device.id.in_(device_ids))
+    tracked = {
+        # A removed device stopped being tracked when it left the tailnet (updated_at is the removal time)
+        device_id: (aware(created_at), aware(updated_at) if status == REMOVED else None)
+        for device_id, created_at, status, updated_at in q.all()
+    }
+
+    devices = {}
+    total_online = total_window = 0.0
+    for device_id, online_end in after.items():
+        # Only count the part of the window during which the device was being tracked
+        tracked_since, removed_at = tracked.get(device_id, (None, None))
+        observed_from = max(start, tracked_since or start)
+        observed_to = min(end, removed_at or end)
+        if removed_at is not None and observed_to <= observed_from:
+            continue  # removed before the window
+        window = max(0.0, (observed_to - observed_from).total_seconds())
+        online = max(0.0, online_end - before.get(device_id, 0.0))
+        devices[device_id] = {
+            "online_seconds": round(online, 1),
+            "window_seconds": round(window, 1),
+            "uptime": round(min(100.0, online / window * 100), 2) if window else 0.0,
+        }
+        total_online += online
+        total_window += window
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "tracked_devices": len(devices),
+        "online_seconds": round(total_online, 1),
+        "window_seconds": round(total_window, 1),
+        "uptime": round(min(100.0, total_online / total_window * 100), 2) if total_window else 0.0,
+        "devices": devices,
+    }
+
+def device_uptime(db: Session, device_id: str, start: datetime, end: datetime) -> dict:
+    """Exact uptime of a single mirrored device over [start, end]"""
+    result = fleet_uptime(db, start, end, [device_id])
+    stats = result["devices"].get(device_id, {"online_seconds": 0.0, "window_seconds": 0.0, "uptime": 0.0})
+    return {"device_id": device_id, "start": result["start"], "end": result["end"], **stats}
@@ -1,6 +1,8 @@
 import os
+import asyncio
+import hashlib
+import json
 import tempfile
-import subprocess
 from typing import Dict
 import base64
 
@@ -14,8 +16,31 @@ import winreg
 import logging
 from pathlib import Path
 
-# Configuration
+# Configuration (None in a base build: read from the stamp appended to the executable)
 CONFIG = {config_placeholder}
+STAMP_KEY = "{stamp_key_placeholder}"
+
+def load_stamped_config():
+    """Config appended by app/utils/agent_stamp.py: payload | HMAC-SHA256 | length (uint32 BE) | b"TSMCFG01" """
+    import hashlib, hmac, json, struct
+    with open(sys.executable, "rb") as f:
+        end = f.seek(0, 2)
+        f.seek(max(end - 44, 0))
+        trailer = f.read(44)
+        if len(trailer) != 44:
+            raise RuntimeError("No configuration stamped into this agent")
+        signature, length, magic = struct.unpack(">32sI8s", trailer)
+        if magic != b"TSMCFG01" or length + 44 > min(end, 4096):
+            raise RuntimeError("No configuration stamped into this agent")
+        f.seek(end - 44 - length)
+        payload = f.read(length)
+    expected = hmac.new(bytes.fromhex(STAMP_KEY), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise RuntimeError("Agent configuration signature mismatch")
+    return json.loads(payload)
+
+if CONFIG is None:
+    CONFIG = load_stamped_config()
 
 class TailscaleAgent:
     def __init__(self):
@@ -181,25 +206,7 @@ if __name__ == "__main__":
         input("Press Enter to exit...")
 '''
 
-async def build_windows_agent(config: Dict) -> str:
-    """Build Windows agent executable with configuration"""
-    
-    # Replace config in template
-    agent_code = AGENT_TEMPLATE.replace(
-        "{config_placeholder}", 
-        str(config).replace("'", '"')
-    )
-    
-    # Create temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
-        agent_py = os.path.join(temp_dir, "agent.py")
-        
-        # Write agent code
-        with open(agent_py, "w") as f:
-            f.write(agent_code)
-        
-        # Create PyInstaller spec
-        spec_content = f'''
+SPEC_TEMPLATE = '''
 # -*- mode: python ; coding: utf-8 -*-
 
 block_cipher = None
@@ -245,25 +252,59 @@ exe = EXE(
     uac_admin=True,
 )
 '''
+
+# Changes whenever the agent code or the build recipe changes
+TEMPLATE_VERSION = hashlib.sha256((AGENT_TEMPLATE + SPEC_TEMPLATE).encode()).hexdigest()[:16]
+
+def build_key(config: Dict) -> str:
+    """Content address of a build: same template and config -> same executable"""
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{TEMPLATE_VERSION}\n{canonical}".encode()).hexdigest()
+
+async def build_windows_agent(config: Dict | None, output_path: str, stamp_key: bytes = b"") -> str:
+    """Build Windows agent executable with configuration into `output_path`.
+
+    With `config` None this is a base build: the agent reads its config from a stamp verified
+    with `stamp_key` (utils/agent_stamp.py).
+    """
+    
+    # Replace config in template
+    agent_code = AGENT_TEMPLATE.replace(
+        "{config_placeholder}", 
+        str(config).replace("'", '"')
+    ).replace("{stamp_key_placeholder}", stamp_key.hex())
+    
+    # Create temporary directory (one per build, so concurrent builds never share files)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        agent_py = os.path.join(temp_dir, "agent.py")
+        
+        # Write agent code
+        with open(agent_py, "w") as f:
+            f.write(agent_code)
         
+        # Create PyInstaller spec
         spec_file = os.path.join(temp_dir, "agent.spec")
         with open(spec_file, "w") as f:
-            f.write(spec_content)
+            f.write(SPEC_TEMPLATE.format(agent_py=agent_py))
         
-        # Build with PyInstaller
-        result = subprocess.run([
-            "pyinstaller", "--clean", spec_file
-        ], cwd=temp_dir, capture_output=True, text=True)
+        # Build with PyInstaller; without --clean its analysis/bootloader cache is reused across builds
+        process = await asyncio.create_subprocess_exec(
+            "pyinstaller", "--noconfirm",
+            "--workpath", os.path.join(temp_dir, "build"), "--distpath", os.path.join(temp_dir, "dist"),
+            spec_file,
+            cwd=temp_dir, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
         
-        if result.returncode != 0:
-            raise Exception(f"PyInstaller failed: {result.stderr}")
+        if process.returncode != 0:
+            raise Exception(f"PyInstaller failed: {stderr.decode(errors='replace')[-2000:]}")
         
         # Move built executable
         built_exe = os.path.join(temp_dir, "dist", "tailscale-agent.exe")
-        output_path = "/tmp/tailscale-agent.exe"
         
         if os.path.exists(built_exe):
-            os.rename(built_exe, output_path)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            os.replace(built_exe, output_path)
             return output_path
         else:
-            raise Exception("Built executable not found")
\ No newline at end of file
+            raise Exception("Built executable not found")
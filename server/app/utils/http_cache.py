@@ -0,0 +1,99 @@
+import hashlib
+import os
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+# Always revalidate, but let the browser keep the body so a 304 costs no payload
+NO_CACHE = "private, no-cache"
+
+def etag_for(*parts) -> str:
+    """Weak ETag derived from data versions (counts, max timestamps, snapshot ids...).
+
+    Weak because these JSON bodies are compressed afterwards by the middleware: the br, gzip and
+    identity bytes differ, so the tag only promises equivalent content (no byte ranges on it).
+    """
+    digest = hashlib.sha1("|".join(repr(p) for p in parts).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    candidates = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+def conditional(request: Request, response: Response, etag: str, cache_control: str = NO_CACHE) -> Response | None:
+    """Return a bodiless 304 if the client already has `etag`, else stamp the cache headers on `response`"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# Content-addressed URLs never change what they point to
+IMMUTABLE = "public, max-age=31536000, immutable"
+FILE_CHUNK_SIZE = 256 * 1024
+
+def _byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """(start, end) inclusive of a single `bytes=` range; None if it cannot be served as one range.
+    Raises ValueError if the range is unsatisfiable."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None  # other units or multipart ranges: send the whole representation
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1  # suffix range: the last N bytes
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("unsatisfiable")
+    return start, end
+
+def _file_chunks(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(FILE_CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+def file_response(request: Request, path: str, etag: str, headers: dict, media_type: str = "application/octet-stream") -> Response:
+    """Serve a file with validators and resume support: 304 on If-None-Match, 206 for a single
+    Range (honouring If-Range), 416 if it is unsatisfiable. HEAD gets the headers only.
+    `headers` should carry Cache-Control and, for precompressed files, Content-Encoding."""
+    size = os.path.getsize(path)
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", **headers}
+    # Tell the compression middleware the body is final (identity keeps it from re-encoding ranges)
+    headers.setdefault("Content-Encoding", "identity")
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    status, start, length = 200, 0, size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range needs a strong match: a resumed download must continue the same bytes
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _byte_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            status, length = 206, end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(_file_chunks(path, start, length), status_code=status, headers=headers, media_type=media_type)
@@ -0,0 +1,24 @@
+from datetime import datetime
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+
+# Revalidation headers set by utils.http_cache.conditional on the injected response
+_CACHE_HEADERS = ("etag", "cache-control")
+
+_DATETIME = TypeAdapter(datetime | None)
+
+def json_datetime(value: datetime | None) -> str | None:
+    """A datetime as response models serialize it (UTC as `Z`, unlike isoformat() or orjson)"""
+    return _DATETIME.dump_python(value, mode="json")
+
+def fast_json(content, response: Response | None = None, status_code: int = 200) -> ORJSONResponse:
+    """Serialize plain dicts/lists straight to JSON.
+
+    Returning a Response skips FastAPI's response_model re-validation and jsonable_encoder pass,
+    which dominate CPU time for large lists. `response_model` stays on the route for the docs.
+    """
+    headers = None
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k in _CACHE_HEADERS}
+    return ORJSONResponse(content, status_code=status_code, headers=headers)
@@ -0,0 +1,43 @@
+from typing import Callable, Iterable, Iterator
+import orjson
+from fastapi.responses import StreamingResponse
+from sqlalchemy.sql import Select
+
+from ..db import SessionLocal
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 1000
+
+def stream_rows(stmt: Select, to_dict: Callable, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[dict]:
+    """Yield rows of `stmt` from a server-side cursor, `batch_size` at a time.
+
+    Opens its own session: the request's get_db session is closed before a streamed body is sent.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+        # The identity map is weak-referencing, so rows are released once serialized
+        for row in result:
+            item = to_dict(row)
+            if item is not None:
+                yield item
+    finally:
+        db.close()
+
+def _ndjson_lines(rows: Iterable[dict], batch_size: int) -> Iterator[bytes]:
+    chunk = []
+    for row in rows:
+        chunk.append(orjson.dumps(row))
+        if len(chunk) >= batch_size:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+def ndjson_response(rows: Iterable[dict], batch_size: int = STREAM_BATCH_SIZE) -> StreamingResponse:
+    """Stream rows as newline-delimited JSON (one object per line), written in batches"""
+    return StreamingResponse(
+        _ndjson_lines(rows, batch_size), media_type=NDJSON_MEDIA_TYPE,
+        # identity keeps the compression middleware from buffering the stream (its gzip fallback never flushes)
+        headers={"Content-Encoding": "identity"},
+    )
@@ -1,61 +1,369 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import List
-import json
+from collections import deque
+from typing import List, Optional
+import orjson
 import asyncio
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+
+from .config import settings
+from .utils.logging import get_logger
+
+log = get_logger(__name__)
+
+HEARTBEAT_INTERVAL_SEC = 30
+# Clients that never subscribed keep receiving everything
+ALL_TOPICS = "*"
+# Topic of legacy broadcasts that only carry a message type
+TYPE_TOPICS = {
+    "device_status_update": "devices",
+    "deployment_update": "deployment",
+}
+
+def _topic_chain(topic: str) -> list:
+    """A topic and its parents: "deployment:42" -> ["deployment:42", "deployment"], "keys.expiring" -> [..., "keys"]"""
+    chain = [topic]
+    for sep in (":", "."):
+        head, found, _ = topic.partition(sep)
+        if found and head not in chain:
+            chain.append(head)
+    return chain
+
+# Close code for clients evicted for not keeping up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+class _Client:
+    """One connection: a bounded queue of pre-serialized messages drained by its own writer task
+    (or, for streams without a WebSocket, by the response generator)"""
+
+    def __init__(self, websocket: Optional[WebSocket], maxsize: int):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.pending: deque = deque()  # (coalesce key, payload)
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.strikes = 0  # messages dropped since the last successful send
+        self.evicted = False
+        self.subscriptions: dict = {ALL_TOPICS: {}}  # topic -> attribute filter
+
+    @property
+    def name(self) -> str:
+        return str(self.websocket.client) if self.websocket is not None else f"stream-{id(self):x}"
+
+    def matches(self, topic: str, attrs: dict) -> bool:
+        for key, expected in self.subscriptions.get(topic, {}).items():
+            value = attrs.get(key)
+            if value != expected and not (isinstance(expected, list) and value in expected):
+                return False
+        return True
+
+    def offer(self, payload: str, coalesce: Optional[str] = None):
+        # A newer message with the same coalesce key replaces the queued one in place
+        if coalesce is not None:
+            for i, (key, _) in enumerate(self.pending):
+                if key == coalesce:
+                    self.pending[i] = (coalesce, payload)
+                    self.coalesced += 1
+                    return
+        if len(self.pending) >= self.maxsize:
+            self.pending.popleft()
+            self.dropped += 1
+            self.strikes += 1
+        self.pending.append((coalesce, payload))
+        self.ready.set()
+
+    async def next(self) -> str:
+        while not self.pending:
+            if self.evicted:
+                raise ConnectionError("evicted")
+            self.ready.clear()
+            await self.ready.wait()
+        return self.pending.popleft()[1]
 
 class ConnectionManager:
+    """Fan-out engine: each message is serialized once and queued to every subscribed connection.
+
+    Messages are published to a topic; a topic index maps each topic to its subscribers so the
+    cost of a message scales with the clients interested in it.
+
+    A slow connection only fills its own queue (oldest messages are dropped, or replaced when
+    they share a coalesce key); it is evicted after WS_EVICT_AFTER_DROPS consecutive drops or a
+    send that takes longer than WS_SEND_TIMEOUT_SEC.
+    """
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self._clients: dict = {}  # WebSocket -> _Client
+        self._send_latency: deque = deque(maxlen=1000)
+        self._evicted = 0
+        self._published = 0
+        self._delivered = 0
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._closing: set = set()  # keeps eviction close tasks referenced until they finish
+        self._index: dict = {}  # topic -> set of _Client
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bus = None  # services.eventbus.EventBus once started
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self._clients)
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    def attach_bus(self, bus, loop: asyncio.AbstractEventLoop):
+        """Publish through the cross-worker event bus; it calls route() back on every worker"""
+        self._bus = bus
+        self._loop = loop
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self._loop = self._loop or asyncio.get_running_loop()
+        client = _Client(websocket, settings.WS_SEND_QUEUE_SIZE)
+        self._clients[websocket] = client
+        self._index.setdefault(ALL_TOPICS, set()).add(client)
+        client.task = asyncio.create_task(self._writer(client))
+        client.offer(orjson.dumps({"type": "heartbeat", "timestamp": datetime.now(timezone.utc).isoformat()}).decode())
+        self._ensure_heartbeat()
+
+    def open_stream(self, topics: list, filters: Optional[dict] = None) -> _Client:
+        """Register a subscriber without a WebSocket (e.g. the SSE live feed); the caller drains client.next()"""
+        self._loop = self._loop or asyncio.get_running_loop()
+        client = _Client(None, settings.WS_SEND_QUEUE_SIZE)
+        client.subscriptions = {}
+        self._clients[client] = client
+        for topic in topics:
+            client.subscriptions[topic] = dict(filters or {})
+            self._index.setdefault(topic, set()).add(client)
+        self._ensure_heartbeat()
+        return client
+
+    def close_stream(self, client: _Client):
+        if self._clients.pop(client, None) is not None:
+            self._unindex(client, list(client.subscriptions))
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self._clients.pop(websocket, None)
+        if client is None:
+            return
+        self._unindex(client, list(client.subscriptions))
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def _unindex(self, client: _Client, topics: list):
+        for topic in topics:
+            client.subscriptions.pop(topic, None)
+            subscribers = self._index.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self._index[topic]
+
+    def subscribe(self, websocket: WebSocket, topics: list, filters: Optional[dict] = None):
+        """Route `topics` (and their sub-topics) to this connection, optionally only messages matching `filters`"""
+        client = self._clients.get(websocket)
+        if client is None:
+            return
+        # The first explicit subscription replaces the implicit everything-subscription
+        if client.subscriptions.keys() == {ALL_TOPICS} and ALL_TOPICS not in topics:
+            self._unindex(client, [ALL_TOPICS])
+        for topic in topics:
+            client.subscriptions[topic] = dict(filters or {})
+            self._index.setdefault(topic, set()).add(client)
+
+    def unsubscribe(self, websocket: WebSocket, topics: list):
+        client = self._clients.get(websocket)
+        if client is not None:
+            self._unindex(client, topics)
+
+    def subscriptions(self, websocket: WebSocket) -> dict:
+        client = self._clients.get(websocket)
+        return dict(client.subscriptions) if client is not None else {}
+
+    def _evict(self, client: _Client):
+        if client.evicted:
+            return
+        client.evicted = True
+        self._evicted += 1
+        log.warning(f"Evicting slow consumer {client.name} (queued={len(client.pending)}, dropped={client.dropped})")
+        self._clients.pop(client.websocket or client, None)
+        self._unindex(client, list(client.subscriptions))
+        client.ready.set()  # wake a stream reader so it notices the eviction
+        if client.websocket is None:
+            return
+        if client.task is not None:
+            client.task.cancel()
+        task = asyncio.create_task(self._close(client.websocket, SLOW_CONSUMER_CLOSE_CODE))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _writer(self, client: _Client):
+        websocket = client.websocket
+        try:
+            while True:
+                payload = await client.next()
+                started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(websocket.send_text(payload), settings.WS_SEND_TIMEOUT_SEC)
+                except asyncio.TimeoutError:
+                    self._evict(client)
+                    return
+                self._send_latency.append(time.perf_counter() - started)
+                client.sent += 1
+                client.strikes = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Connection closed underneath us; the receive loop may not have noticed yet
+            log.info(f"WebSocket send failed for {websocket.client}: {e}")
+            self.disconnect(websocket)
+
+    async def _heartbeat_loop(self):
+        while self._clients:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SEC)
+            payload = orjson.dumps({"type": "heartbeat", "timestamp": datetime.now(timezone.utc).isoformat()}).decode()
+            # Heartbeats go to every connection regardless of subscriptions
+            self._deliver(list(self._clients.values()), payload, "heartbeat")
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except:
-                await self.disconnect(connection)
-    
-    async def broadcast_notification(self, message: dict):
+        client = self._clients.get(websocket)
+        if client is not None:
+            client.offer(message)
+
+    def _deliver(self, clients, payload: str, coalesce: Optional[str]):
+        for client in clients:
+            client.offer(payload, coalesce)
+            if client.strikes >= settings.WS_EVICT_AFTER_DROPS:
+                self._evict(client)
+
+    def route(self, topic: str, payload: str, attrs: dict, coalesce: Optional[str]):
+        """Deliver a serialized message to this worker's matching subscribers"""
+        self._published += 1
+        targets = set(self._index.get(ALL_TOPICS, ()))
+        for t in _topic_chain(topic):
+            for client in self._index.get(t, ()):
+                if client not in targets and client.matches(t, attrs):
+                    targets.add(client)
+        self._delivered += len(targets)
+        self._deliver(targets, payload, coalesce)
+
+    def publish(self, topic: str, message: dict, attrs: Optional[dict] = None, coalesce: Optional[str] = None):
+        """Send `message` to the subscribers of `topic` whose filters match `attrs`.
+
+        Goes through the event bus when one is attached so clients of every worker receive it.
+        Safe to call from any thread (e.g. scheduler jobs running their own event loop).
+        """
+        loop = self._loop
+        if loop is None:
+            return  # no bus and nobody has ever connected
+        payload = orjson.dumps({"topic": topic, **message}).decode()
+        attrs = attrs or {}
+        deliver = self._bus.publish if self._bus is not None else self.route
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            deliver(topic, payload, attrs, coalesce)
+        else:
+            loop.call_soon_threadsafe(deliver, topic, payload, attrs, coalesce)
+
+    async def broadcast(self, message: dict, coalesce: Optional[str] = None, topic: Optional[str] = None,
+                        attrs: Optional[dict] = None):
+        """Publish `message`; the topic defaults to the one mapped from its type"""
+        message_type = message.get("type", "")
+        self.publish(topic or TYPE_TOPICS.get(message_type, message_type), message, attrs, coalesce)
+
+    async def broadcast_notification(self, message: dict, coalesce: Optional[str] = None):
         """Alias for broadcast method to maintain compatibility"""
-        await self.broadcast(message)
+        await self.broadcast(message, coalesce)
+
+    def stats(self) -> dict:
+        depths = [len(c.pending) for c in self._clients.values()]
+        latencies = sorted(self._send_latency)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else 0.0
+
+        return {
+            "connections": len(self._clients),
+            "published": self._published,
+            "delivered": self._delivered,
+            "topics": {topic: len(subscribers) for topic, subscribers in self._index.items()},
+            "evicted": self._evicted,
+            "queue_depth": {
+                "total": sum(depths),
+                "max": max(depths, default=0),
+                "capacity": settings.WS_SEND_QUEUE_SIZE,
+            },
+            "send_latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99), "samples": len(latencies)},
+            "clients": [
+                {
+                    "client": c.name,
+                    "queued": len(c.pending),
+                    "sent": c.sent,
+                    "dropped": c.dropped,
+                    "coalesced": c.coalesced,
+                    "subscriptions": c.subscriptions,
+                    "connected_at": datetime.fromtimestamp(c.connected_at, timezone.utc).isoformat(),
+                }
+                for c in self._clients.values()
+            ],
+        }
 
 notification_manager = ConnectionManager()
 
+def _handle_client_message(websocket: WebSocket, text: str):
+    """Client -> server control messages:
+    {"action": "subscribe", "topics": ["devices", "deployment:42"], "filter": {"user_id": "..."}}
+    {"action": "unsubscribe", "topics": ["devices"]}
+    """
+    try:
+        message = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return {"type": "error", "message": "Invalid JSON"}
+    if not isinstance(message, dict):
+        return {"type": "error", "message": "Expected an object"}
+
+    action = message.get("action")
+    topics = message.get("topics") or ([message["topic"]] if message.get("topic") else [])
+    if action in ("subscribe", "unsubscribe"):
+        if not isinstance(topics, list) or not all(isinstance(t, str) and t for t in topics):
+            return {"type": "error", "message": "topics must be a list of strings"}
+        if action == "subscribe":
+            filters = message.get("filter") or {}
+            if not isinstance(filters, dict):
+                return {"type": "error", "message": "filter must be an object"}
+            notification_manager.subscribe(websocket, topics, filters)
+        else:
+            notification_manager.unsubscribe(websocket, topics)
+        return {"type": "subscriptions", "topics": notification_manager.subscriptions(websocket)}
+    if action == "ping":
+        return {"type": "pong", "timestamp": datetime.now(timezone.utc).isoformat()}
+    return {"type": "error", "message": f"Unknown action: {action}"}
+
 async def websocket_endpoint(websocket: WebSocket):
+    await notification_manager.connect(websocket)
+    print(f"WebSocket connected: {websocket.client}")
     try:
-        await notification_manager.connect(websocket)
-        print(f"WebSocket connected: {websocket.client}")
-        
+        # Sending happens in the connection's writer task; here we read subscription requests
         while True:
-            try:
-                # Send periodic heartbeat
-                await notification_manager.send_personal_message(
-                    json.dumps({"type": "heartbeat", "timestamp": datetime.now().isoformat()}), 
-                    websocket
-                )
-                await asyncio.sleep(30)  # Heartbeat every 30 seconds
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                print(f"WebSocket error: {e}")
-                break
-                
+            reply = _handle_client_message(websocket, await websocket.receive_text())
+            await notification_manager.send_personal_message(orjson.dumps(reply).decode(), websocket)
     except WebSocketDisconnect:
         print(f"WebSocket disconnected: {websocket.client}")
-        notification_manager.disconnect(websocket)
     except Exception as e:
         print(f"WebSocket connection error: {e}")
-        try:
-            notification_manager.disconnect(websocket)
-        except:
-            pass
\ No newline at end of file
+    finally:
+        notification_manager.disconnect(websocket)
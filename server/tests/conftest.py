@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+# Settings are read at import time: point the app at a throwaway SQLite database first
+_DB_DIR = tempfile.mkdtemp(prefix="tsm-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_DIR}/test.db"
+os.environ.setdefault("TS_OAUTH_CLIENT_ID", "test")
+os.environ.setdefault("TS_OAUTH_CLIENT_SECRET", "test")
+os.environ.setdefault("ENCRYPTION_KEY", "MYdI7K3C6eQOa_yhkMjI3Q35eOKDky9opgjWrhvs_Fo=")
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.schema import DefaultClause
+
+from app.db import Base, SessionLocal, engine
+import app.models  # noqa: F401  (registers the tables)
+
+# The models default timestamps to PostgreSQL's now(); SQLite spells it CURRENT_TIMESTAMP
+for table in Base.metadata.tables.values():
+    for column in table.columns:
+        if column.server_default is not None and "now()" in str(getattr(column.server_default, "arg", "")):
+            column.server_default = DefaultClause(text("CURRENT_TIMESTAMP"))
+            column.server_default._set_parent(column)
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
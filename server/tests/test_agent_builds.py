@@ -0,0 +1,31 @@
+import asyncio
+import os
+
+from app.config import settings
+from app.services.agent_builds import AgentBuildQueue, artifact_path, base_key, stamp_key
+from app.utils.agent_stamp import read_stamp_file
+
+def test_concurrent_identical_stamps(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "AGENT_BUILD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "AGENT_CONFIG_STAMPING", True)
+    base = artifact_path(base_key())
+    os.makedirs(os.path.dirname(base))
+    with open(base, "wb") as f:
+        f.write(os.urandom(2_000_000))
+
+    async def run():
+        queue = AgentBuildQueue()
+        configs = [{"auth_key": f"key-{i}"} for i in range(20)]
+        results = await asyncio.gather(*(
+            queue.submit(f"build-{i}-{copy}", config)
+            for i, config in enumerate(configs) for copy in range(4)
+        ))
+        await asyncio.gather(*queue._preparing)
+        return configs, results
+
+    configs, results = asyncio.run(run())
+    assert all(done for _, done in results)
+    for (key, _), config in zip(results[::4], configs):
+        assert read_stamp_file(artifact_path(key), stamp_key()) == config
+    leftovers = [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+    assert leftovers == []
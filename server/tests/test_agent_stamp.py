@@ -0,0 +1,78 @@
+import os
+import types
+
+import pytest
+
+from app.config import settings
+from app.services.agent_builds import stamp_key
+from app.utils.agent_builder import AGENT_TEMPLATE
+from app.utils.agent_stamp import StampError, make_blob, read_stamp_file, stamp_file
+
+KEY = bytes.fromhex("11" * 32)
+CONFIG = {"auth_key": "tskey-auth-abc", "server_url": "https://tsm.example.com", "tags": ["tag:agent"]}
+
+def _agent_loader(executable: str, key: bytes):
+    """load_stamped_config() exactly as compiled into the agent, run against `executable`"""
+    start = AGENT_TEMPLATE.index("def load_stamped_config")
+    end = AGENT_TEMPLATE.index("if CONFIG is None")
+    namespace = {"sys": types.SimpleNamespace(executable=executable), "STAMP_KEY": key.hex()}
+    exec(AGENT_TEMPLATE[start:end], namespace)
+    return namespace["load_stamped_config"]
+
+@pytest.fixture
+def base(tmp_path):
+    path = tmp_path / "base.exe"
+    path.write_bytes(b"MZ" + os.urandom(100_000))
+    return str(path)
+
+def test_round_trip(base, tmp_path):
+    out = str(tmp_path / "agent.exe")
+    stamp_file(base, out, CONFIG, KEY)
+
+    assert read_stamp_file(out, KEY) == CONFIG
+    assert _agent_loader(out, KEY)() == CONFIG
+    with open(base, "rb") as f, open(out, "rb") as g:
+        assert g.read(os.path.getsize(base)) == f.read()  # the executable itself is untouched
+
+def test_restamp_replaces_the_config(base, tmp_path):
+    first, second = str(tmp_path / "first.exe"), str(tmp_path / "second.exe")
+    stamp_file(base, first, CONFIG, KEY)
+    other = {**CONFIG, "auth_key": "tskey-auth-xyz"}
+    stamp_file(first, second, other, KEY)
+
+    assert read_stamp_file(second, KEY) == other
+    assert _agent_loader(second, KEY)() == other
+    assert os.path.getsize(second) == os.path.getsize(base) + len(make_blob(other, KEY))
+
+@pytest.mark.parametrize("offset", [-44, -60])  # inside the MAC, inside the payload
+def test_tampering_is_rejected(base, tmp_path, offset):
+    out = str(tmp_path / "agent.exe")
+    stamp_file(base, out, CONFIG, KEY)
+    with open(out, "r+b") as f:
+        f.seek(offset, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(offset, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 0x01]))
+
+    with pytest.raises(StampError, match="signature"):
+        read_stamp_file(out, KEY)
+    with pytest.raises(RuntimeError, match="signature"):
+        _agent_loader(out, KEY)()
+
+def test_wrong_stamp_key_is_rejected(base, tmp_path, monkeypatch):
+    out = str(tmp_path / "agent.exe")
+    monkeypatch.setattr(settings, "AGENT_STAMP_KEY", "aa" * 32)
+    stamp_file(base, out, CONFIG, stamp_key())
+    assert _agent_loader(out, stamp_key())() == CONFIG
+
+    monkeypatch.setattr(settings, "AGENT_STAMP_KEY", "bb" * 32)
+    with pytest.raises(StampError, match="signature"):
+        read_stamp_file(out, stamp_key())
+    with pytest.raises(RuntimeError, match="signature"):
+        _agent_loader(out, stamp_key())()
+
+def test_unstamped_executable(base):
+    with pytest.raises(StampError, match="No config"):
+        read_stamp_file(base, KEY)
+    with pytest.raises(RuntimeError, match="No configuration"):
+        _agent_loader(base, KEY)()
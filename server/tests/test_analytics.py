@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.models import AuthKey, User
+from app.routers import analytics
+
+def _fake_tailnet(monkeypatch, devices):
+    calls = []
+
+    async def list_devices():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"devices": devices}
+
+    monkeypatch.setattr(analytics, "list_devices", list_devices)
+    monkeypatch.setattr(analytics, "_snapshot_cache", {"snapshot": None, "expires": 0.0})
+    monkeypatch.setattr(analytics, "_snapshot_lock", asyncio.Lock())
+    return calls
+
+def test_expired_snapshot_is_rebuilt_once(db, monkeypatch):
+    calls = _fake_tailnet(monkeypatch, [{"id": "d1", "hostname": "web-server"}])
+
+    async def run():
+        return await asyncio.gather(*(analytics._snapshot(db) for _ in range(20)))
+
+    snapshots = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(s is snapshots[0] for s in snapshots)
+
+def test_security_events_come_from_the_snapshot(db, monkeypatch):
+    _fake_tailnet(monkeypatch, [])
+    now = datetime.now(timezone.utc)
+    for i in range(8):
+        user = User(email=f"user{i}@example.com", last_login=now - timedelta(minutes=i))
+        db.add(user)
+        db.flush()
+        db.add(AuthKey(user_id=user.id, description=f"key {i}", authkey_ciphertext="x", masked="...x", ttl_seconds=3600,
+                          created_at=now - timedelta(minutes=i, seconds=30)))
+    db.add(User(email="old@example.com", last_login=now - timedelta(days=2)))
+    db.commit()
+
+    snapshot = asyncio.run(analytics._snapshot(db))
+    panel = snapshot.panel("security-events", db)
+    events = panel["recentEvents"]
+    assert len(events) == analytics.SECURITY_EVENTS_SHOWN
+    assert events[0]["description"] == "Successful login from user: user0@example.com"
+    assert events[1]["description"] == "New auth key created: key 0"
+    assert panel["totalEvents"] == 16
+    assert panel["resolved"] == analytics.SECURITY_EVENTS_SHOWN
+
+def test_snapshot_tag_changes_with_last_updated(db, monkeypatch):
+    _fake_tailnet(monkeypatch, [{"id": "d1", "hostname": "web-server"}])
+    first = asyncio.run(analytics._snapshot(db))
+    analytics._snapshot_cache["expires"] = 0.0
+    second = asyncio.run(analytics._snapshot(db))
+    assert second.timestamp != first.timestamp
+    assert second.id != first.id
+    assert first.id.startswith('W/"')
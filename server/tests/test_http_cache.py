@@ -0,0 +1,27 @@
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.utils.http_cache import conditional, etag_for
+
+def _request(headers: dict) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+def test_etag_for_is_weak_and_stable():
+    etag = etag_for("devices", 3, "2025-01-01")
+    assert etag.startswith('W/"')
+    assert etag == etag_for("devices", 3, "2025-01-01")
+    assert etag != etag_for("devices", 4, "2025-01-01")
+
+def test_conditional_revalidation():
+    etag = etag_for("devices", 3)
+    response = Response()
+    assert conditional(_request({}), response, etag) is None
+    assert response.headers["etag"] == etag
+
+    # Weak comparison: the tag matches with or without its W/ prefix
+    for sent in (etag, etag.removeprefix("W/"), f'"other", {etag}'):
+        not_modified = conditional(_request({"If-None-Match": sent}), Response(), etag)
+        assert not_modified is not None and not_modified.status_code == 304
+
+    assert conditional(_request({"If-None-Match": etag_for("devices", 4)}), Response(), etag) is None
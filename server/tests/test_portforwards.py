@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import pytest
+from fastapi import Response
+from pydantic import TypeAdapter
+from starlette.requests import Request
+
+from app.models import PortForward, User
+from app.routers.portforwards import list_port_forwards
+from app.schemas import PortForwardOut
+from app.utils.responses import json_datetime
+
+def _model_json(**fields) -> dict:
+    return orjson.loads(PortForwardOut(**fields).model_dump_json())
+
+@pytest.mark.parametrize("created_at", [
+    datetime(2025, 3, 1, 8, 30, tzinfo=timezone.utc),
+    datetime(2025, 3, 1, 8, 30, 0, 120000, tzinfo=timezone.utc),
+    datetime(2025, 3, 1, 8, 30, tzinfo=timezone(timedelta(hours=7))),
+    datetime(2025, 3, 1, 8, 30),
+])
+def test_json_datetime_matches_the_model(created_at):
+    fields = dict(id="x", name="ssh", source_port=2222, target_host="10.0.0.1", target_port=22,
+                  protocol="tcp", active=True, description=None, created_at=created_at, user_id="u", machine_id=None)
+    assert json_datetime(created_at) == _model_json(**fields)["created_at"]
+
+def test_list_fast_path_matches_the_model(db):
+    user = User(email="owner@example.com")
+    db.add(user)
+    db.flush()
+    for port in (2222, 2223):
+        db.add(PortForward(user_id=user.id, name=f"pf-{port}", source_port=port, target_host="10.0.0.1",
+                           target_port=22, protocol="tcp", active=True,
+                           created_at=datetime(2025, 3, 1, 8, 30, 0, 120000, tzinfo=timezone.utc)))
+    db.commit()
+
+    request = Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []})
+    fast = orjson.loads(asyncio.run(list_port_forwards(request, Response(), db)).body)
+    expected = TypeAdapter(list[PortForwardOut]).dump_python(
+        [PortForwardOut.model_validate(pf, from_attributes=True) for pf in db.query(PortForward).all()], mode="json")
+    assert fast == expected
+
+@pytest.mark.parametrize("target_host", ["db.internal", "fd00::1", "10.0.0.1 -j ACCEPT"])
+def test_unsupported_target_is_a_400(db, target_host):
+    from fastapi import HTTPException
+
+    from app.routers.portforwards import create_port_forward, update_port_forward
+    from app.schemas import CreatePortForwardReq, UpdatePortForwardReq
+
+    user = User(email="owner@example.com")
+    db.add(user)
+    db.flush()
+    pf = PortForward(user_id=user.id, name="ssh", source_port=2222, target_host="10.0.0.1", target_port=22,
+                     protocol="tcp", active=False)
+    db.add(pf)
+    db.commit()
+
+    with pytest.raises(HTTPException) as create_error:
+        asyncio.run(create_port_forward(CreatePortForwardReq(
+            user_id=user.id, name="web", source_port=8080, target_host=target_host, target_port=80), db))
+    with pytest.raises(HTTPException) as update_error:
+        asyncio.run(update_port_forward(pf.id, UpdatePortForwardReq(target_host=target_host), db))
+    for error in (create_error.value, update_error.value):
+        assert error.status_code == 400
+        assert target_host in error.detail
@@ -0,0 +1,123 @@
+import asyncio
+
+from app.models import PortForward, User
+from app.services.portforward import Forward, IptablesBackend, NftablesBackend
+from app.services.ports import PortIndex
+
+def _forward(db, port, active=True):
+    user = db.query(User).first()
+    if user is None:
+        user = User(email="owner@example.com")
+        db.add(user)
+        db.flush()
+    pf = PortForward(user_id=user.id, name=f"pf-{port}", source_port=port, target_host="10.0.0.1",
+                     target_port=22, protocol="tcp", active=active)
+    db.add(pf)
+    db.commit()
+    return pf
+
+def test_claim_sees_port_freed_by_another_worker(db):
+    pf = _forward(db, 2222)
+    index = PortIndex()
+    index.ensure_loaded(db)
+    assert index.taken("tcp", 2222)
+
+    pf.active = False  # freed by another worker
+    db.commit()
+    assert index.claim(db, "tcp", 2222)
+
+def test_reload_keeps_uncommitted_reservations(db):
+    _forward(db, 2222)
+    index = PortIndex()
+    assert index.claim(db, "tcp", 3333)
+    index.reload(db)
+    assert index.taken("tcp", 3333)  # pending: still ours
+    assert not index.claim(db, "tcp", 3333)
+
+    index.release("tcp", 3333)
+    index.reload(db)
+    assert not index.taken("tcp", 3333)
+    assert index.taken("tcp", 2222)
+
+def test_claim_many_resyncs_once(db):
+    pf = _forward(db, 2222)
+    index = PortIndex()
+    index.ensure_loaded(db)
+    pf.active = False  # freed by another worker
+    db.commit()
+    _forward(db, 4444)  # and this one taken: seen by the resync
+    assert index.claim_many(db, [("tcp", 2222), ("tcp", 2222), ("udp", 2222)]) == [True, False, True]
+    assert index.taken("tcp", 4444)
+
+def test_withdraw_keeps_the_owners_rule():
+    ours = Forward(2222, "10.0.0.1", 22, "tcp")
+    owner = Forward(2222, "10.0.0.2", 22, "tcp")
+
+    nft = NftablesBackend("tsm")
+    batches = []
+    nft._ready = True
+    nft._batch = lambda commands: asyncio.sleep(0, batches.append(commands) or True)
+    assert asyncio.run(nft.withdraw([ours], [owner]))
+    (delete, add), = batches
+    assert delete["delete"]["element"]["elem"] == [nft._key(ours)]
+    assert add["add"]["element"]["elem"] == [nft._element(owner)]
+
+    ipt = IptablesBackend("TSM")
+    scripts = []
+    ipt._ready = True
+    ipt._restore = lambda script: asyncio.sleep(0, scripts.append(script) or True)
+    assert asyncio.run(ipt.withdraw([ours], [owner]))
+    assert scripts == [ipt.changes_script([], [ours])]
+
+def test_retarget_when_the_old_rule_is_missing():
+    old = Forward(2222, "10.0.0.1", 22, "tcp")
+    new = Forward(2222, "10.0.0.2", 22, "tcp")
+
+    ipt = IptablesBackend("TSM")
+    ipt._ready = True
+    kernel = {"nat": [], "filter": [], "foreign": {"nat": [], "filter": []}, "counters": {"nat": {}, "filter": {}}}
+    scripts = []
+
+    async def restore(script):
+        scripts.append(script)
+        return "-D" not in script  # iptables-restore aborts on a missing rule
+
+    async def read_state():
+        return kernel
+
+    ipt._restore = restore
+    ipt.read_state = read_state
+    assert asyncio.run(ipt.apply_changes(add=[new], remove=[old]))
+    assert scripts[-1] == ipt.changes_script([new], [])
+
+    nft = NftablesBackend("tsm")
+    nft._ready = True
+    batches = []
+
+    async def batch(commands):
+        batches.append(commands)
+        return not any("delete" in command for command in commands)
+
+    async def nft_state():
+        return []
+
+    nft._batch = batch
+    nft.read_state = nft_state
+    assert asyncio.run(nft.apply_changes(add=[new], remove=[old]))
+    assert batches[-1] == [nft._elements("add", [nft._element(new)])]
+
+def test_failed_batch_with_installed_rules_still_fails():
+    old = Forward(2222, "10.0.0.1", 22, "tcp")
+    ipt = IptablesBackend("TSM")
+    ipt._ready = True
+    kernel = {"nat": [old], "filter": [("10.0.0.1", 22, "tcp")]}
+
+    async def restore(script):
+        return False
+
+    async def read_state():
+        return kernel
+
+    ipt._restore = restore
+    ipt.read_state = read_state
+    assert not asyncio.run(ipt.apply_changes(remove=[old]))
@@ -0,0 +1,117 @@
+import asyncio
+
+from app.services.portforward import Forward
+from app.services.relay import RelayEngine, benchmark
+
+async def _free_port() -> int:
+    server = await asyncio.get_running_loop().create_server(asyncio.Protocol, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+    return port
+
+async def _relay_to(handler):
+    target = await asyncio.start_server(handler, "127.0.0.1", 0)
+    engine = RelayEngine()
+    fw = Forward(await _free_port(), "127.0.0.1", target.sockets[0].getsockname()[1], "tcp")
+    await engine.add(fw)
+    return engine, target, fw
+
+def test_target_that_speaks_first():
+    async def banner(reader, writer):
+        writer.write(b"SSH-2.0-test\r\n")
+        await writer.drain()
+        writer.write((await reader.readline()).upper())
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        engine, target, fw = await _relay_to(banner)
+        try:
+            async def session(i):
+                reader, writer = await asyncio.open_connection("127.0.0.1", fw.source_port)
+                assert await reader.readline() == b"SSH-2.0-test\r\n"
+                writer.write(f"hello {i}\n".encode())
+                assert await reader.readline() == f"HELLO {i}\n".encode()
+                writer.close()
+
+            await asyncio.wait_for(asyncio.gather(*(session(i) for i in range(50))), 10)
+            stats = engine.stats()[fw]
+            assert stats.connections == 50
+            assert stats.rejected == 0
+        finally:
+            await engine.close()
+            target.close()
+
+    asyncio.run(run())
+
+def test_echo_and_half_close():
+    async def echo(reader, writer):
+        writer.write(await reader.read())
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        engine, target, fw = await _relay_to(echo)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", fw.source_port)
+            writer.write(b"x" * 100_000)
+            writer.write_eof()
+            assert await asyncio.wait_for(reader.read(), 5) == b"x" * 100_000
+            writer.close()
+        finally:
+            await engine.close()
+            target.close()
+
+    asyncio.run(run())
+
+def test_benchmark():
+    result = asyncio.run(benchmark(seconds=0.5, chunk=64 * 1024, streams=2))
+    assert result["streams"] == 2
+    assert result["delivered_bytes"] > 0
+    assert result["relayed_bytes"] >= result["delivered_bytes"]
+    assert result["mb_per_sec"] > 0
+
+class _UdpEcho(asyncio.DatagramProtocol):
+    def __init__(self, tag: bytes):
+        self.tag = tag
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(self.tag + data, addr)
+
+class _UdpClient(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.received = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.received.put_nowait(data)
+
+def test_udp_retarget_on_the_same_port():
+    async def run():
+        loop = asyncio.get_running_loop()
+        targets = [await loop.create_datagram_endpoint(lambda tag=tag: _UdpEcho(tag), local_addr=("127.0.0.1", 0))
+                   for tag in (b"old:", b"new:")]
+        old_port, new_port = (t.get_extra_info("sockname")[1] for t, _ in targets)
+        port = await _free_port()
+        old = Forward(port, "127.0.0.1", old_port, "udp")
+        new = Forward(port, "127.0.0.1", new_port, "udp")
+
+        engine = RelayEngine()
+        try:
+            await engine.add(old)
+            assert await engine.apply([new], [old])
+            assert engine.forwards() == [new]
+
+            client, protocol = await loop.create_datagram_endpoint(_UdpClient, remote_addr=("127.0.0.1", port))
+            client.sendto(b"ping")
+            assert await asyncio.wait_for(protocol.received.get(), 5) == b"new:ping"
+            client.close()
+        finally:
+            await engine.close()
+            for transport, _ in targets:
+                transport.close()
+
+    asyncio.run(run())
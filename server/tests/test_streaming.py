@@ -0,0 +1,25 @@
+import asyncio
+
+import httpx
+import orjson
+from brotli_asgi import BrotliMiddleware
+from fastapi import FastAPI
+
+from app.utils.streaming import ndjson_response
+
+def test_ndjson_is_not_buffered_by_compression():
+    app = FastAPI()
+    app.add_middleware(BrotliMiddleware, minimum_size=10, gzip_fallback=True)
+
+    @app.get("/rows")
+    async def rows():
+        return ndjson_response(({"id": i, "name": f"row-{i}"} for i in range(25)), batch_size=10)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            async with client.stream("GET", "/rows", headers={"Accept-Encoding": "gzip"}) as response:
+                assert response.headers["content-encoding"] == "identity"
+                return await response.aread()
+
+    lines = asyncio.run(run()).splitlines()
+    assert [orjson.loads(line)["id"] for line in lines] == list(range(25))
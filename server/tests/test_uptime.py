@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+from app.models import Device, DeviceSession
+from app.services.device_sync import REMOVED
+from app.services.uptime import device_uptime, fleet_uptime
+
+NOW = datetime.now(timezone.utc)
+DAY_AGO = NOW - timedelta(hours=24)
+
+def _device(db, name, created_at, status="online", updated_at=None):
+    device = Device(ts_device_id=name, name=name, status=status, created_at=created_at, updated_at=updated_at)
+    db.add(device)
+    db.flush()
+    return device
+
+def test_always_online_fleet_is_100(db):
+    device = _device(db, "a", NOW - timedelta(days=3))
+    db.add(DeviceSession(device_id=device.id, started_at=NOW - timedelta(days=3), online_before=0))
+    db.commit()
+    result = fleet_uptime(db, DAY_AGO, NOW)
+    assert result["tracked_devices"] == 1
+    assert result["uptime"] == 100.0
+
+def test_removed_device_does_not_drag_uptime_down(db):
+    online = _device(db, "a", NOW - timedelta(days=3))
+    db.add(DeviceSession(device_id=online.id, started_at=NOW - timedelta(days=3), online_before=0))
+    # Online until it left the tailnet two days ago
+    gone = _device(db, "b", NOW - timedelta(days=3), status=REMOVED, updated_at=NOW - timedelta(days=2))
+    db.add(DeviceSession(device_id=gone.id, started_at=NOW - timedelta(days=3),
+                         ended_at=NOW - timedelta(days=2), online_before=0))
+    db.commit()
+
+    result = fleet_uptime(db, DAY_AGO, NOW)
+    assert result["uptime"] == 100.0
+    assert result["tracked_devices"] == 1
+    assert gone.id not in result["devices"]
+
+def test_removed_device_counts_until_removal(db):
+    # Online for the first 6 of its 12 tracked hours in the window, then removed
+    device = _device(db, "b", NOW - timedelta(days=3), status=REMOVED, updated_at=NOW - timedelta(hours=12))
+    db.add(DeviceSession(device_id=device.id, started_at=NOW - timedelta(days=3),
+                         ended_at=NOW - timedelta(hours=18), online_before=0))
+    db.commit()
+
+    result = device_uptime(db, device.id, DAY_AGO, NOW)
+    assert result["window_seconds"] == 12 * 3600
+    assert result["uptime"] == 50.0
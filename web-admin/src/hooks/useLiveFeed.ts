@@ -0,0 +1,120 @@
+import { useEffect, useState, useCallback, useRef } from "react";
+
+const LIVE_URL = 'http://localhost:8000/api/live';
+
+export type LiveEntity = 'devices' | 'keys' | 'machines' | 'port_forwards' | 'deployments';
+
+type Row = { id: string } & Record<string, any>;
+
+interface LiveOptions<T> {
+  // Poll interval used only while the live feed is unavailable
+  fallbackMs?: number;
+  // Keep `fetcher` as the source of truth and just refetch when the entity changes
+  // (for views whose rows are not the entity rows, e.g. the merged /devices list)
+  refetchOnChange?: boolean;
+  // Map the entity rows to the view's data when patching in place (default: the rows themselves)
+  select?: (rows: Row[]) => T;
+}
+
+// Apply one delta to the id -> row map; returns false if the message is not for this entity
+function applyDelta(rows: Map<string, Row>, entity: LiveEntity, msg: any): boolean {
+  if (msg.type === 'device_delta' && entity === 'devices') {
+    if (msg.op === 'added') rows.set(msg.id, msg.device);
+    else if (msg.op === 'changed') rows.set(msg.id, { ...(rows.get(msg.id) || { id: msg.id }), ...msg.changes });
+    else if (msg.op === 'removed') rows.delete(msg.id);
+    return true;
+  }
+  if (msg.type === 'entity_delta' && msg.entity === entity) {
+    if (msg.op === 'delete') rows.delete(msg.id);
+    else rows.set(msg.id, msg.item);
+    return true;
+  }
+  return false;
+}
+
+/**
+ * Live view of an entity: initial snapshot + deltas over Server-Sent Events.
+ * Falls back to polling `fetcher` while the stream is down. Same return shape as usePoll.
+ */
+export default function useLiveFeed<T = Row[]>(entity: LiveEntity, fetcher: () => Promise<T>, options: LiveOptions<T> = {}) {
+  const { fallbackMs = 30000, refetchOnChange = false } = options;
+  const [data, setData] = useState<T>();
+  const [err, setErr] = useState<string>();
+  const [isLoading, setIsLoading] = useState(true);
+  const [isLive, setIsLive] = useState(false);
+  const rowsRef = useRef(new Map<string, Row>());
+  const fetcherRef = useRef(fetcher);
+  const selectRef = useRef(options.select);
+  fetcherRef.current = fetcher;
+  selectRef.current = options.select;
+
+  const load = useCallback(async () => {
+    try {
+      setErr(undefined);
+      setData(await fetcherRef.current());
+    } catch (error: any) {
+      setErr(error?.message || String(error));
+      console.error('useLiveFeed fetch error:', error);
+    } finally {
+      setIsLoading(false);
+    }
+  }, []);
+
+  const publish = useCallback(() => {
+    const rows = Array.from(rowsRef.current.values());
+    setData(selectRef.current ? selectRef.current(rows) : (rows as unknown as T));
+    setIsLoading(false);
+  }, []);
+
+  // Server-Sent Events; EventSource reconnects by itself and the server re-sends a snapshot
+  useEffect(() => {
+    const source = new EventSource(`${LIVE_URL}?entities=${entity}`);
+    let refetchTimer: number | undefined;
+
+    source.onopen = () => {
+      setIsLive(true);
+      setErr(undefined);
+    };
+    source.addEventListener('snapshot', (event) => {
+      const { items } = JSON.parse((event as MessageEvent).data);
+      if (refetchOnChange) {
+        load();
+        return;
+      }
+      rowsRef.current = new Map(items.map((row: Row) => [row.id, row]));
+      publish();
+    });
+    source.onmessage = (event) => {
+      let msg: any;
+      try {
+        msg = JSON.parse(event.data);
+      } catch {
+        return;
+      }
+      if (!applyDelta(rowsRef.current, entity, msg)) return;
+      if (refetchOnChange) {
+        // Collapse a burst of deltas into one refetch
+        window.clearTimeout(refetchTimer);
+        refetchTimer = window.setTimeout(load, 250);
+      } else {
+        publish();
+      }
+    };
+    source.onerror = () => setIsLive(false);
+
+    return () => {
+      window.clearTimeout(refetchTimer);
+      source.close();
+    };
+  }, [entity, refetchOnChange, load, publish]);
+
+  // Polling only while the live feed is down
+  useEffect(() => {
+    if (isLive) return;
+    load();
+    const timer = window.setInterval(load, fallbackMs);
+    return () => window.clearInterval(timer);
+  }, [isLive, fallbackMs, load]);
+
+  return { data, err, isLoading, refetch: load, isLive };
+}
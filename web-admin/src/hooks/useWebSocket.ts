@@ -2,7 +2,15 @@ import { useEffect, useRef, useState, useCallback } from 'react';
 
 type ConnectionStatus = 'connecting' | 'connected' | 'closing' | 'disconnected';
 
-export function useWebSocket<TSend = any, TMsg = any>(url: string) {
+export interface WebSocketSubscription {
+  // e.g. ['devices', 'deployment:42', 'keys.expiring']; omit to receive every message
+  topics?: string[];
+  // Only messages whose attributes match, e.g. { user_id: '...' }
+  filter?: Record<string, unknown>;
+}
+
+export function useWebSocket<TSend = any, TMsg = any>(url: string, subscription: WebSocketSubscription = {}) {
+  const subscriptionKey = JSON.stringify(subscription);
   const [isConnected, setIsConnected] = useState(false);
   const [connectionStatus, setConnectionStatus] = useState<ConnectionStatus>('disconnected');
   const [lastMessage, setLastMessage] = useState<TMsg | null>(null);
@@ -34,6 +42,11 @@ export function useWebSocket<TSend = any, TMsg = any>(url: string) {
             setError(null);
             reconnectAttemptsRef.current = 0;
             console.log('WebSocket connected successfully');
+
+            const { topics, filter } = JSON.parse(subscriptionKey) as WebSocketSubscription;
+            if (topics && topics.length > 0) {
+              ws.current?.send(JSON.stringify({ action: 'subscribe', topics, filter }));
+            }
           };
 
           ws.current.onmessage = (event) => {
@@ -82,7 +95,7 @@ export function useWebSocket<TSend = any, TMsg = any>(url: string) {
         setError('Backend server not running - WebSocket disabled');
         setConnectionStatus('disconnected');
       });
-  }, [url]);
+  }, [url, subscriptionKey]);
 
   useEffect(() => {
     connect();
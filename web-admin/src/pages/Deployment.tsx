@@ -178,8 +178,8 @@ const Deployment: React.FC = () => {
     },
     {
       title: 'Devices',
-      dataIndex: 'devices',
-      render: (devices: string[]) => devices.length
+      dataIndex: 'total'
+
     },
     {
       title: 'Status',
@@ -201,16 +201,15 @@ const Deployment: React.FC = () => {
     {
       title: 'Progress',
       render: (record: any) => {
-        if (record.status === 'started') {
-          return <Progress percent={0} status="active" />;
+        if (!record.total) {
+          return null;
         }
-        if (record.results) {
-          const success = record.results.filter((r: any) => r.status === 'success').length;
-          const total = record.results.length;
-          const percent = (success / total) * 100;
-          return <Progress percent={percent} status={percent === 100 ? 'success' : 'exception'} />;
+        const done = record.succeeded + record.failed;
+        const percent = Math.round((done / record.total) * 100);
+        if (record.status === 'started') {
+          return <Progress percent={percent} status="active" />;
         }
-        return null;
+        return <Progress percent={percent} status={record.failed === 0 ? 'success' : 'exception'} />;
       }
     }
   ];
@@ -1,5 +1,5 @@
 import { ApiService } from "../services/api";
-import usePoll from "../hooks/usePoll";
+import useLiveFeed from "../hooks/useLiveFeed";
 import Table from "../components/Table";
 import { TableLoadingSkeleton } from "../components/LoadingSpinner";
 import ErrorMessage from "../components/ErrorMessage";
@@ -16,7 +16,7 @@ const StatusBadge = ({ online }: { online: boolean }) => (
 );
 
 export default function Devices() {
-  const { data, err, isLoading, refetch } = usePoll<{devices: any[]}>(() => ApiService.getDevices(), 10000);
+  const { data, err, isLoading, refetch } = useLiveFeed<{devices: any[]}>('devices', () => ApiService.getDevices(), { refetchOnChange: true });
   
   if (err) {
     return (
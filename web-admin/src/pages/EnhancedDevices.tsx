@@ -1,6 +1,6 @@
 import { useState, useMemo, useCallback } from "react";
 import { ApiService } from "../services/api";
-import usePoll from "../hooks/usePoll";
+import useLiveFeed from "../hooks/useLiveFeed";
 import Table from "../components/Table";
 import { TableLoadingSkeleton } from "../components/LoadingSpinner";
 import ErrorMessage from "../components/ErrorMessage";
@@ -20,7 +20,7 @@ const StatusBadge = ({ online }: { online: boolean }) => (
 );
 
 export default function EnhancedDevices() {
-  const { data, err, isLoading, refetch } = usePoll<{devices: any[]}>(() => ApiService.getDevices(), 10000);
+  const { data, err, isLoading, refetch } = useLiveFeed<{devices: any[]}>('devices', () => ApiService.getDevices(), { refetchOnChange: true });
   const [view, setView] = useState<'table' | 'grid'>('table');
   const [filters, setFilters] = useState<DeviceFiltersType>({
     status: 'all',
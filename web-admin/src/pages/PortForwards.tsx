@@ -1,6 +1,6 @@
 import React, { useState } from "react";
 import { ApiService } from "../services/api";
-import usePoll from "../hooks/usePoll";
+import useLiveFeed from "../hooks/useLiveFeed";
 import Table from "../components/Table";
 import { TableLoadingSkeleton } from "../components/LoadingSpinner";
 import ErrorMessage from "../components/ErrorMessage";
@@ -217,7 +217,7 @@ const CreatePortForwardModal = ({
 };
 
 export default function PortForwards() {
-  const { data, err, refetch } = usePoll<PortForward[]>(() => ApiService.get("/port-forwards"), 10000);
+  const { data, err, refetch } = useLiveFeed<PortForward[]>('port_forwards', () => ApiService.get("/port-forwards"));
   const [isCreateModalOpen, setIsCreateModalOpen] = useState(false);
   
   const handleToggle = async (id: string) => {
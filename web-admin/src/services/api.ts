@@ -154,6 +154,11 @@ export class ApiService {
     return this.get('/analytics/overview');
   }
 
+  static getAnalyticsDashboard(panels?: string[]) {
+    const query = panels && panels.length ? `?panels=${encodeURIComponent(panels.join(','))}` : '';
+    return this.get(`/analytics/dashboard${query}`);
+  }
+
   static getNetworkUsage(days = 7) {
     return this.get(`/analytics/network-usage?days=${days}`);
   }